@@ -0,0 +1,233 @@
+'''
+Benchmarks for airspeed velocity (asv), run with "asv run" in the repository root and compare commits with "asv continuous".
+Input data is generated with SyntheticLoader, every benchmark is timed (time_) and its peak memory measured (peakmem_) 
+at 10k, 100k and 1M rows. Peak memory is that of the whole benchmark process, including the input data.
+'''
+import os
+import tempfile
+import numpy as np
+from nflmodels.dataloader import SyntheticLoader
+from nflmodels.preprocessing import preprocess_field_goal, preprocess_next_play, preprocess_ep, EP_PEAK_MEMORY_BUDGET
+from nflmodels.models import NextPlayModel, FieldGoalModel, EPModel, UPDATE_LOG_LOSS_TOLERANCE
+from nflmodels.profiling import Profiler
+from nflmodels.compiled import COMPILED_TOLERANCE
+from nflmodels.validation import valplot_fieldgoal
+
+ROWS = [10000, 100000, 1000000]
+
+PREPROCESSORS = {
+    'field_goal': lambda data: preprocess_field_goal(data, return_X_y=True, verbose=False),
+    'next_play': lambda data: preprocess_next_play(data, return_X_y=True, map_target_to_int=True, verbose=False)[:2],
+    'ep': lambda data: preprocess_ep(data, verbose=False)[:2],
+}
+
+MODELS = {
+    'NextPlayModel': (NextPlayModel, 'next_play'),
+    'FieldGoalModel': (FieldGoalModel, 'field_goal'),
+    'EPModel': (EPModel, 'ep'),
+}
+
+
+def _data(rows):
+    '''Play-by-play data of rows rows, the same for every run'''
+    return SyntheticLoader(n_rows=rows, seed=0).select(select_preset=True).load(verbose=False)
+
+
+def _X_y(rows, preprocessor):
+    '''Preprocessed features and 1D target'''
+    X, y = PREPROCESSORS[preprocessor](_data(rows))
+    return X, np.asarray(y).ravel()
+
+
+class Preprocessing:
+    params = (ROWS, list(PREPROCESSORS))
+    param_names = ['rows', 'preprocessor']
+    timeout = 600
+    
+    def setup(self, rows, preprocessor):
+        self.data = _data(rows)
+    
+    def time_preprocess(self, rows, preprocessor):
+        PREPROCESSORS[preprocessor](self.data)
+    
+    def peakmem_preprocess(self, rows, preprocessor):
+        PREPROCESSORS[preprocessor](self.data)
+
+
+class Fit:
+    '''Fit on the preprocessed rows of rows play-by-play rows, EPModel fits are slow as lbfgs runs to max_iter'''
+    params = (ROWS, list(MODELS))
+    param_names = ['rows', 'model']
+    timeout = 1800
+    number = 1
+    repeat = 1
+    
+    def setup(self, rows, model):
+        model_class, preprocessor = MODELS[model]
+        self.model_class = model_class
+        self.X, self.y = _X_y(rows, preprocessor)
+    
+    def time_fit(self, rows, model):
+        self.model_class().fit(self.X, self.y)
+    
+    def peakmem_fit(self, rows, model):
+        self.model_class().fit(self.X, self.y)
+
+
+class Predict:
+    '''Batched predict_proba on rows feature rows with models fitted once on 10k play-by-play rows'''
+    params = (ROWS, list(MODELS))
+    param_names = ['rows', 'model']
+    timeout = 600
+    
+    def setup_cache(self):
+        fitted = {}
+        for name, (model_class, preprocessor) in MODELS.items():
+            X, y = _X_y(10000, preprocessor)
+            fitted[name] = (model_class(), X)
+            fitted[name][0].fit(X, y)
+        return fitted
+    
+    def setup(self, fitted, rows, model):
+        self.model, X = fitted[model]
+        # rows are repeated to the batch size, the preprocessors keep only some of the play-by-play rows
+        self.X = X.iloc[np.arange(rows) % len(X)]
+    
+    def time_predict_proba(self, fitted, rows, model):
+        self.model.predict_proba(self.X)
+    
+    def peakmem_predict_proba(self, fitted, rows, model):
+        self.model.predict_proba(self.X)
+
+
+class PreprocessingMemory:
+    '''
+    Peak memory allocated by preprocess_ep as a fraction of the memory of its input, traced with tracemalloc.
+    The benchmark fails if the peak exceeds EP_PEAK_MEMORY_BUDGET.
+    '''
+    params = [ROWS]
+    param_names = ['rows']
+    timeout = 600
+    unit = 'fraction of input'
+    
+    def setup(self, rows):
+        self.data = _data(rows)
+    
+    def track_preprocess_ep_peakmem(self, rows):
+        with Profiler(memory='tracemalloc') as profiler:
+            preprocess_ep(self.data, verbose=False)
+        peak = profiler.to_dataframe().query('depth == 0')['peak_mb'].max() * 2**20
+        fraction = peak / self.data.memory_usage(deep=True).sum()
+        if fraction > EP_PEAK_MEMORY_BUDGET: 
+            raise Exception(f'preprocess_ep peak memory is {fraction:.2f} of the input, over the budget of {EP_PEAK_MEMORY_BUDGET}')
+        return fraction
+
+
+class Refresh:
+    '''
+    Weekly refresh with the games of a new week compared to a full refit, validated on the games of the following week.
+    XGBoost models are updated with the new week only (NFLModel.update), LogisticRegression models refit warm-started on all data
+    with max_iter=100 (NFLModel.refit).
+    The log loss benchmark fails if the update is worse than the refit by more than UPDATE_LOG_LOSS_TOLERANCE.
+    '''
+    params = (ROWS[:2], list(MODELS))
+    param_names = ['rows', 'model']
+    timeout = 1800
+    number = 1
+    repeat = 1
+    unit = 'log loss'
+    
+    def setup(self, rows, model):
+        model_class, preprocessor = MODELS[model]
+        data = _data(rows)
+        X, y = PREPROCESSORS[preprocessor](data)
+        y = np.asarray(y).ravel()
+        
+        # the last two weeks (16 games each) are the new week and the validation week
+        games = data.loc[X.index, 'game_id'].to_numpy()
+        last_games = np.unique(games)[-32:]
+        new, val = np.isin(games, last_games[:16]), np.isin(games, last_games[16:])
+        old = ~new & ~val
+        
+        self.model_class = model_class
+        self.X_all, self.y_all = X[old | new], y[old | new]
+        self.X_new, self.y_new = X[new], y[new]
+        self.X_val, self.y_val = X[val], y[val]
+        self.model = model_class()
+        self.model.fit(X[old], y[old])
+        self.is_xgb = type(self.model.classifier).__module__.startswith('xgboost')
+    
+    def _update(self):
+        if self.is_xgb: return self.model.update(self.X_new, self.y_new)
+        return self.model.refit(self.X_all, self.y_all, max_iter=100)
+    
+    def time_update(self, rows, model):
+        self._update()
+    
+    def time_refit(self, rows, model):
+        self.model_class().fit(self.X_all, self.y_all)
+    
+    def track_update_log_loss_gap(self, rows, model):
+        from sklearn.metrics import log_loss
+        refit = self.model_class()
+        refit.fit(self.X_all, self.y_all)
+        updated = self._update()
+        
+        labels = refit.classifier.classes_
+        gap = log_loss(self.y_val, updated.predict_proba(self.X_val), labels=labels) - log_loss(self.y_val, refit.predict_proba(self.X_val), labels=labels)
+        if gap > UPDATE_LOG_LOSS_TOLERANCE: 
+            raise Exception(f'Updated {model} log loss is {gap:.4f} worse than a full refit, over the tolerance of {UPDATE_LOG_LOSS_TOLERANCE}')
+        return gap
+
+
+class CompiledPredict:
+    '''
+    predict_proba of CompiledModel (pure NumPy) against the fitted model, for small scoring batches of rows feature rows.
+    The tolerance benchmark fails if the probabilities differ by more than COMPILED_TOLERANCE.
+    '''
+    params = ([1, 100, 10000], list(MODELS))
+    param_names = ['rows', 'model']
+    timeout = 600
+    
+    def setup_cache(self):
+        return Predict.setup_cache(self)
+    
+    def setup(self, fitted, rows, model):
+        self.model, X = fitted[model]
+        self.compiled = self.model.compile()
+        self.X = X.iloc[np.arange(rows) % len(X)]
+    
+    def time_predict_proba(self, fitted, rows, model):
+        self.model.predict_proba(self.X)
+    
+    def time_compiled_predict_proba(self, fitted, rows, model):
+        self.compiled.predict_proba(self.X)
+    
+    def track_compiled_max_difference(self, fitted, rows, model):
+        difference = np.abs(self.compiled.predict_proba(self.X) - self.model.predict_proba(self.X)).max()
+        if difference > COMPILED_TOLERANCE:
+            raise Exception(f'Compiled {model} probabilities differ by {difference:.2e}, over the tolerance of {COMPILED_TOLERANCE}')
+        return difference
+
+
+class Validation:
+    '''valplot_fieldgoal on a validation set of rows field goal attempts, tables only and plotted to a file with the Agg canvas'''
+    params = ROWS
+    param_names = ['rows']
+    timeout = 600
+    
+    def setup(self, rows):
+        X, y = _X_y(10000, 'field_goal')
+        model = FieldGoalModel()
+        model.fit(X, y)
+        # rows are repeated to the validation set size
+        positions = np.arange(rows) % len(X)
+        self.X, self.y = X.iloc[positions], np.asarray(y).ravel()[positions]
+        self.proba = model.predict_proba(self.X)
+        self.path = os.path.join(tempfile.mkdtemp(), 'valplot_fieldgoal.png')
+    
+    def time_valplot_tables(self, rows):
+        valplot_fieldgoal(self.X, self.y, None, self.proba, plot=False)
+    
+    def time_valplot_file(self, rows):
+        valplot_fieldgoal(self.X, self.y, None, self.proba, path=self.path)
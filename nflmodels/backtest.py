@@ -0,0 +1,90 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def backtest(model_class, X : pd.DataFrame, y, seasons, min_train_seasons : int = 1, encoder = None,
+             n_workers : int = None, threads_per_fold : int = 1, verbose : bool = True):
+    '''
+    Walk-forward (rolling-origin) backtest over seasons.
+    For every season N after the first min_train_seasons seasons, a new model is trained on all seasons before N and validated on N.
+    Folds run concurrently in a process pool, each fold limited to threads_per_fold threads so that n_jobs=-1 models do not oversubscribe cores.
+    
+    Parameters:
+        model_class (class): NFLModel subclass, e.g. NextPlayModel
+        X (DataFrame): Preprocessed features
+        y (DataFrame or Series): Target
+        seasons (array-like): Season of each row of X, e.g. data.loc[X.index, 'season']
+        min_train_seasons (int): Number of seasons in the first training set, default 1
+        encoder (FeatureEncoder): Passed to model fit, default None
+        n_workers (int): Number of worker processes, default None for cpu count // threads_per_fold
+        threads_per_fold (int): Thread budget of each fold, default 1
+        verbose (bool): Print progress messages? default True
+    
+    Returns:
+        results (DataFrame): One row of metrics per fold, sorted by validation season
+    '''
+    
+    seasons = np.asarray(seasons)
+    if len(seasons) != len(X): raise Exception('seasons must have one value for each row of X.')
+    
+    all_seasons = np.unique(seasons)
+    folds = [(all_seasons[i - 1], all_seasons[i]) for i in range(min_train_seasons, len(all_seasons))]
+    if len(folds) == 0: raise Exception(f'Not enough seasons for a fold, got {len(all_seasons)} with min_train_seasons = {min_train_seasons}.')
+    
+    if n_workers is None: n_workers = max(1, (os.cpu_count() or 1) // threads_per_fold)
+    if verbose: print(f'Running {len(folds)} folds of {model_class.__name__} in {n_workers} processes with {threads_per_fold} threads each')
+    
+    # data is sent to each worker once, folds only pass the seasons to use
+    results = []
+    with ProcessPoolExecutor(max_workers=min(n_workers, len(folds)), initializer=_init_worker,
+                             initargs=(model_class, X, y, seasons, encoder, threads_per_fold)) as executor:
+        futures = [executor.submit(_run_fold, last_train_season, val_season) for last_train_season, val_season in folds]
+        for future in as_completed(futures):
+            results.append(future.result())
+            if verbose: print(f'Finished fold {len(results)} out of {len(folds)}', end='\r')
+    
+    if verbose: print(f'Finished all {len(folds)} folds')
+    
+    return pd.DataFrame(results).sort_values('val_season').reset_index(drop=True)
+
+
+# ========================= Worker process =========================
+
+_worker = {}
+
+def _init_worker(model_class, X, y, seasons, encoder, threads):
+    '''Store the backtest data in the worker process'''
+    _worker.update(model_class=model_class, X=X, y=y, seasons=seasons, encoder=encoder, threads=threads)
+
+
+def _run_fold(last_train_season, val_season):
+    '''Train on seasons up to last_train_season and validate on val_season'''
+    from threadpoolctl import threadpool_limits
+    from nflmodels.metrics import evaluate
+    
+    X, y, seasons = _worker['X'], _worker['y'], _worker['seasons']
+    train = seasons <= last_train_season
+    val = seasons == val_season
+    
+    model = _worker['model_class']()
+    # XGBoost classifiers get the fold's thread budget, n_jobs is deprecated in LogisticRegression (limited by threadpool_limits)
+    if type(model.classifier).__module__.startswith('xgboost'): model.classifier.set_params(n_jobs=_worker['threads'])
+    
+    with threadpool_limits(limits=_worker['threads']):
+        t = time.perf_counter()
+        model.fit(X[train], _target(y[train]), encoder=_worker['encoder'])
+        fit_seconds = time.perf_counter() - t
+        
+        metrics = evaluate(model, X[val], _target(y[val])).to_dict()
+        del metrics['n']
+    
+    return {'model': type(model).__name__, 'train_seasons': f'{seasons[train].min()}-{last_train_season}', 'val_season': val_season,
+            'n_train': int(train.sum()), 'n_val': int(val.sum()), 'fit_seconds': fit_seconds, **metrics}
+
+
+def _target(y):
+    '''Single column target as a 1D array'''
+    return np.asarray(y).ravel()
@@ -0,0 +1,210 @@
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from nflmodels.encoder import FeatureEncoder
+
+
+class PreprocessingCache():
+    '''
+    Opt-in on-disk cache for the outputs of the preprocess_* functions.
+    Entries are keyed on a hash of the columns of the input frame the call reads, the source of the preprocessing module and the keyword arguments of the call.
+    The least recently used entries are evicted once the cache grows over max_size bytes.
+    An encoder passed as encoder= is stored with the entry, so that a hit fits an unfitted encoder like the call would have.
+    
+    Usage:
+        cache = PreprocessingCache('preprocessed')
+        X, y = cache(preprocess_field_goal, data, return_X_y=True)
+    '''
+    
+    def __init__(self, cache_dir : str = None, max_size : int = 2**30):
+        '''
+        Parameters:
+            cache_dir (str): Directory for cached outputs, default None for ~/.cache/nflmodels/preprocessed
+            max_size (int): Maximum total size of the cache in bytes, default 1 GiB
+        '''
+        self.cache_dir = cache_dir if cache_dir is not None else os.path.join(os.path.expanduser('~'), '.cache', 'nflmodels', 'preprocessed')
+        self.max_size = max_size
+    
+    def __call__(self, func, data : pd.DataFrame, **kwargs):
+        '''
+        Return the output of func(data, **kwargs), from the cache if an identical call has been made before.
+        
+        Parameters:
+            func (function): Preprocessing function, e.g. preprocess_ep
+            data (DataFrame): Dataset to preprocess
+            **kwargs: Keyword arguments passed to func
+        
+        Returns:
+            Output of func
+        '''
+        verbose = kwargs.get('verbose', True)
+        key = self.key(func, data, **kwargs)
+        path = os.path.join(self.cache_dir, key)
+        
+        # an unfitted encoder is fit by the call, a hit restores its fitted state from the entry
+        encoder = kwargs.get('encoder')
+        
+        if os.path.exists(os.path.join(path, 'manifest.json')):
+            try:
+                output = _read_output(path)
+                if isinstance(encoder, FeatureEncoder) and not encoder.fitted:
+                    with open(os.path.join(path, 'encoder.json')) as f:
+                        encoder.__dict__.update(FeatureEncoder.from_dict(json.load(f)).__dict__)
+                # manifest modification time is the last access time used for eviction
+                os.utime(os.path.join(path, 'manifest.json'))
+                if verbose: print(f'Loaded {func.__name__} output from cache')
+                return output
+            except (OSError, ValueError, KeyError):
+                # corrupted entry, recompute
+                shutil.rmtree(path, ignore_errors=True)
+        
+        output = func(data, **kwargs)
+        
+        # write to a temporary directory first so that a partial entry is never read
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        _write_output(tmp_path, output)
+        if isinstance(encoder, FeatureEncoder):
+            with open(os.path.join(tmp_path, 'encoder.json'), 'w') as f:
+                json.dump(encoder.to_dict(), f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        
+        self._evict()
+        return output
+    
+    def key(self, func, data : pd.DataFrame, **kwargs):
+        '''
+        Cache key of a preprocessing call.
+        Combines the function, the source of its module (so that edits of helpers and module level constants invalidate entries),
+        the bound keyword arguments and a hash of the data. Verbose is not part of the key, a FeatureEncoder argument is keyed on its fitted state.
+        
+        The data hash covers every value and index label of the columns the call reads (data_requirements), other columns are not hashed.
+        '''
+        h = hashlib.sha256()
+        
+        h.update(f'{func.__module__}.{func.__qualname__}'.encode())
+        # profiled functions are wrapped, the code of the function itself is hashed
+        code = inspect.unwrap(func).__code__
+        h.update(code.co_code)
+        # nested code objects have a memory address in their repr, they are part of the module source
+        h.update(repr([c for c in code.co_consts if not inspect.iscode(c)]).encode())
+        h.update(_source_hash(inspect.unwrap(func)).encode())
+        
+        arguments = inspect.signature(func).bind(data, **kwargs)
+        arguments.apply_defaults()
+        params = {k: _argument_key(v) for k, v in list(arguments.arguments.items())[1:] if k != 'verbose'}
+        h.update(json.dumps(params, sort_keys=True, default=str).encode())
+        
+        columns = _required_columns(func, data, **kwargs)
+        h.update(json.dumps([len(data)] + [(str(c), str(data[c].dtype)) for c in columns]).encode())
+        # one hash per row of the values and the index label, in row order
+        h.update(pd.util.hash_pandas_object(data[columns], index=True).to_numpy().tobytes())
+        
+        return h.hexdigest()
+    
+    def size(self):
+        '''Total size of the cache in bytes'''
+        return sum(size for _, size, _ in self._entries())
+    
+    def clear(self):
+        '''Remove all cached entries'''
+        for path, _, _ in self._entries():
+            shutil.rmtree(path, ignore_errors=True)
+    
+    def _entries(self):
+        '''List (path, size, last access time) of all entries'''
+        if not os.path.isdir(self.cache_dir): return []
+        
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            manifest = os.path.join(path, 'manifest.json')
+            if not os.path.exists(manifest): continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            entries.append((path, size, os.path.getmtime(manifest)))
+        return entries
+    
+    def _evict(self):
+        '''Remove least recently used entries until the cache fits in max_size'''
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_size: break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+def _argument_key(value):
+    '''JSON key of an argument, encoders by their fitted state instead of their repr (which contains a memory address)'''
+    if isinstance(value, FeatureEncoder): return {'encoder': value.to_dict() if value.fitted else None}
+    return value
+
+
+def _source_hash(func):
+    '''sha256 of the source file of the module defining func, empty for functions without a source file'''
+    try:
+        file = inspect.getsourcefile(func)
+        with open(file, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except (TypeError, OSError):
+        return ''
+
+
+def _required_columns(func, data : pd.DataFrame, **kwargs):
+    '''Columns of data read by a preprocessing call, all columns for functions without known data requirements'''
+    from nflmodels.preprocessing import data_requirements
+    try:
+        columns = data_requirements(func, **{k: v for k, v in kwargs.items() if k != 'verbose'})['columns']
+    except Exception:
+        return list(data.columns)
+    return [c for c in data.columns if c in set(columns)]
+
+
+def _write_output(path : str, output):
+    '''Store a preprocessing output: DataFrames and Series as Parquet, arrays as .npy and other values in the manifest'''
+    
+    items = output if isinstance(output, tuple) else (output,)
+    manifest = {'tuple': isinstance(output, tuple), 'items': []}
+    
+    for i, item in enumerate(items):
+        if isinstance(item, pd.DataFrame):
+            item.to_parquet(os.path.join(path, f'{i}.parquet'))
+            manifest['items'].append({'type': 'frame'})
+        elif isinstance(item, pd.Series):
+            item.to_frame(name='series').to_parquet(os.path.join(path, f'{i}.parquet'))
+            manifest['items'].append({'type': 'series', 'name': item.name})
+        elif isinstance(item, np.ndarray):
+            np.save(os.path.join(path, f'{i}.npy'), item, allow_pickle=False)
+            manifest['items'].append({'type': 'array'})
+        else:
+            manifest['items'].append({'type': 'value', 'value': item})
+    
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+
+def _read_output(path : str):
+    '''Read an output stored by _write_output'''
+    
+    with open(os.path.join(path, 'manifest.json')) as f:
+        manifest = json.load(f)
+    
+    items = []
+    for i, item in enumerate(manifest['items']):
+        if item['type'] == 'frame':
+            items.append(pd.read_parquet(os.path.join(path, f'{i}.parquet')))
+        elif item['type'] == 'series':
+            items.append(pd.read_parquet(os.path.join(path, f'{i}.parquet'))['series'].rename(item['name']))
+        elif item['type'] == 'array':
+            items.append(np.load(os.path.join(path, f'{i}.npy'), mmap_mode='r'))
+        else:
+            items.append(item['value'])
+    
+    return tuple(items) if manifest['tuple'] else items[0]
@@ -0,0 +1,217 @@
+import json
+import os
+import numpy as np
+from nflmodels.encoder import FeatureEncoder
+
+# version of the saved compiled model layout, bumped on incompatible changes
+COMPILED_VERSION = 1
+
+# largest allowed difference between the probabilities of a compiled model and of the model it was compiled from (checked by the tests and benchmarks)
+COMPILED_TOLERANCE = 1e-6
+
+
+class CompiledModel():
+    '''
+    Pure NumPy inference representation of a fitted NFLModel, for scoring workers that do not import sklearn or xgboost.
+    LogisticRegression models are a dense coefficient matrix with a softmax (sigmoid for two classes),
+    XGBoost models flattened arrays of the nodes of all trees, evaluated level by level for a batch of rows at a time.
+    Outputs match the predict_proba of the original model within 1e-6.
+    
+    Usage:
+        compiled = model.compile()
+        compiled.save('compiled/ep')
+        compiled = CompiledModel.load('compiled/ep')  # in the worker
+        proba = compiled.predict_proba(X)
+    '''
+    
+    def __init__(self, kind : str, arrays : dict, classes, feature_names : list = None, encoder : FeatureEncoder = None, labels : list = None,
+                 objective : str = None):
+        '''
+        Parameters:
+            kind (str): "linear" or "trees"
+            arrays (dict): Model arrays, coef and intercept for "linear" and the node arrays for "trees"
+            classes (array-like): Class labels in the column order of the probabilities
+            feature_names (list): Feature names in the column order of the classifier, used to order DataFrame columns, default None
+            encoder (FeatureEncoder): Encoder of the model, default None
+            labels (list): Names of the target classes, default None
+            objective (str): XGBoost objective, "multi:softprob" or "binary:logistic", default None
+        '''
+        if kind not in ('linear', 'trees'): raise Exception('Unknown value for parameter kind, use "linear" or "trees"')
+        self.kind = kind
+        self.arrays = arrays
+        self.classes_ = np.asarray(classes)
+        self.feature_names = feature_names
+        self.encoder = encoder
+        self.labels = labels
+        self.objective = objective
+    
+    def predict_proba(self, X, chunksize : int = 8192):
+        '''
+        Predict class probabilities.
+        
+        Parameters:
+            X (DataFrame, ndarray or dict of arrays): Features, raw features for a model with an encoder
+            chunksize (int): Number of rows evaluated at a time by tree models, default 8192
+        
+        Returns:
+            ndarray of shape (rows, classes)
+        '''
+        X = self._features(X)
+        if self.kind == 'linear': return self._linear(X)
+        return np.concatenate([self._trees(X[i:i + chunksize]) for i in range(0, len(X), chunksize)] or [np.empty((0, len(self.classes_)))])
+    
+    def predict(self, X):
+        '''Predict the most probable classes'''
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+    
+    def _features(self, X):
+        '''Features as a 2D array in the column order of the classifier'''
+        if self.encoder is not None and not isinstance(X, np.ndarray): return self.encoder.transform(X)
+        if hasattr(X, 'columns') and self.feature_names is not None: return X[self.feature_names].to_numpy(dtype=np.float64)
+        return np.asarray(X, dtype=np.float64)
+    
+    def _linear(self, X : np.ndarray):
+        '''Probabilities of a logistic regression'''
+        z = X @ self.arrays['coef'].T + self.arrays['intercept']
+        if z.shape[1] == 1:
+            p = 1 / (1 + np.exp(-z[:, 0]))
+            return np.column_stack([1 - p, p])
+        return _softmax(z)
+    
+    def _trees(self, X : np.ndarray):
+        '''Probabilities of boosted trees, all trees are evaluated together one level at a time'''
+        a = self.arrays
+        # xgboost compares float32 features to float32 thresholds
+        X = X.astype(np.float32)
+        rows = np.arange(len(X))[:, None]
+        
+        node = np.broadcast_to(a['roots'], (len(X), len(a['roots']))).copy()
+        for _ in range(int(a['depth'][0])):
+            value = X[rows, a['feature'][node]]
+            left = np.where(np.isnan(value), a['default_left'][node], value < a['threshold'][node])
+            node = np.where(left, a['left'][node], a['right'][node])
+        
+        # leaves point to themselves, so every row has reached its leaf in each tree
+        leaves = a['threshold'][node].astype(np.float64)
+        n_groups = len(a['base_margin'])
+        margin = np.zeros((len(X), n_groups))
+        for g in range(n_groups):
+            margin[:, g] = leaves[:, a['tree_group'] == g].sum(axis=1)
+        margin += a['base_margin']
+        
+        if self.objective == 'binary:logistic':
+            p = 1 / (1 + np.exp(-margin[:, 0]))
+            return np.column_stack([1 - p, p])
+        return _softmax(margin)
+    
+    def save(self, path : str):
+        '''Save to directory path, the arrays as raw .npy files and the rest in a JSON manifest'''
+        os.makedirs(path, exist_ok=True)
+        for name, array in self.arrays.items():
+            np.save(os.path.join(path, f'{name}.npy'), np.ascontiguousarray(array), allow_pickle=False)
+        with open(os.path.join(path, 'compiled.json'), 'w') as f:
+            json.dump({'compiled_version': COMPILED_VERSION, 'kind': self.kind, 'arrays': list(self.arrays), 'objective': self.objective,
+                       'classes': self.classes_.tolist(), 'classes_dtype': self.classes_.dtype.str, 'feature_names': self.feature_names,
+                       'encoder': self.encoder.to_dict() if self.encoder is not None else None, 'labels': self.labels}, f, default=str)
+    
+    @classmethod
+    def load(cls, path : str, mmap : bool = True):
+        '''Load a compiled model saved with save(), the arrays are memory-mapped unless mmap = False'''
+        with open(os.path.join(path, 'compiled.json')) as f:
+            manifest = json.load(f)
+        if manifest['compiled_version'] != COMPILED_VERSION:
+            raise Exception(f'Unsupported compiled model version {manifest["compiled_version"]}, expected {COMPILED_VERSION}')
+        
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r' if mmap else None) for name in manifest['arrays']}
+        encoder = FeatureEncoder.from_dict(manifest['encoder']) if manifest['encoder'] is not None else None
+        return cls(manifest['kind'], arrays, np.array(manifest['classes'], dtype=np.dtype(manifest['classes_dtype'])),
+                   feature_names=manifest['feature_names'], encoder=encoder, labels=manifest['labels'], objective=manifest['objective'])
+
+
+def compile_model(model):
+    '''
+    Compile a fitted NFLModel into a CompiledModel.
+    
+    Parameters:
+        model (NFLModel): Fitted model with a LogisticRegression or XGBClassifier classifier
+    
+    Returns:
+        CompiledModel
+    '''
+    clf = model.classifier
+    classes = clf.classes_
+    classes = classes.astype(str) if classes.dtype.kind == 'O' else classes
+    
+    if type(clf).__module__.startswith('xgboost'):
+        booster = clf.get_booster()
+        kind, (arrays, objective) = 'trees', _flatten_booster(booster)
+        feature_names = booster.feature_names
+    else:
+        kind, objective = 'linear', None
+        arrays = {'coef': np.asarray(clf.coef_, dtype=np.float64), 'intercept': np.asarray(clf.intercept_, dtype=np.float64)}
+        feature_names = [str(f) for f in clf.feature_names_in_] if hasattr(clf, 'feature_names_in_') else None
+    
+    return CompiledModel(kind, arrays, classes, feature_names=feature_names, encoder=model.encoder, labels=model.labels, objective=objective)
+
+
+def _flatten_booster(booster):
+    '''Node arrays of all trees of an XGBoost booster, child indices are global and leaves point to themselves'''
+    model = json.loads(booster.save_raw('json'))
+    learner = model['learner']
+    objective = learner['objective']['name']
+    if objective not in ('multi:softprob', 'binary:logistic'): raise Exception(f'Unsupported XGBoost objective {objective}')
+    
+    gbtree = learner['gradient_booster']
+    if gbtree['name'] != 'gbtree': raise Exception(f'Unsupported XGBoost booster {gbtree["name"]}')
+    trees = gbtree['model']['trees']
+    if any(len(t['categories_nodes']) != 0 for t in trees): raise Exception('Categorical splits are not supported')
+    
+    feature, threshold, left, right, default_left, roots = [], [], [], [], [], []
+    offset, depth = 0, 0
+    for t in trees:
+        l, r = np.array(t['left_children']), np.array(t['right_children'])
+        nodes = np.arange(len(l)) + offset
+        leaf = l == -1
+        roots.append(offset)
+        feature.append(np.where(leaf, 0, np.array(t['split_indices'])))
+        threshold.append(np.array(t['split_conditions'], dtype=np.float32))
+        left.append(np.where(leaf, nodes, l + offset))
+        right.append(np.where(leaf, nodes, r + offset))
+        default_left.append(np.array(t['default_left'], dtype=bool))
+        depth = max(depth, _tree_depth(l, r))
+        offset += len(l)
+    
+    # base score is a probability for binary:logistic and one margin per class for multi:softprob
+    base_score = np.array(json.loads(learner['learner_model_param']['base_score']), dtype=np.float64).reshape(-1)
+    if objective == 'binary:logistic': base_margin = np.log(base_score / (1 - base_score))
+    else: base_margin = base_score
+    
+    arrays = {
+        'feature': np.concatenate(feature).astype(np.int32),
+        'threshold': np.concatenate(threshold),
+        'left': np.concatenate(left).astype(np.int32),
+        'right': np.concatenate(right).astype(np.int32),
+        'default_left': np.concatenate(default_left),
+        'roots': np.array(roots, dtype=np.int32),
+        'tree_group': np.array(gbtree['model']['tree_info'], dtype=np.int32),
+        'base_margin': base_margin,
+        'depth': np.array([depth]),
+    }
+    return arrays, objective
+
+
+def _tree_depth(left : np.ndarray, right : np.ndarray):
+    '''Maximum depth of a tree from its child arrays'''
+    depth, level = 0, np.array([0])
+    while True:
+        level = level[left[level] != -1]
+        if len(level) == 0: return depth
+        level = np.concatenate([left[level], right[level]])
+        depth += 1
+
+
+def _softmax(z : np.ndarray):
+    '''Row-wise softmax'''
+    z = z - z.max(axis=1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=1, keepdims=True)
@@ -1,2 +1,3 @@
 from nflmodels.dataloader.pgloader import PgLoader
-from nflmodels.dataloader.nflverseloader import nflverseLoader
\ No newline at end of file
+from nflmodels.dataloader.nflverseloader import nflverseLoader
+from nflmodels.dataloader.synthetic import SyntheticLoader
@@ -0,0 +1,80 @@
+import re
+import numpy as np
+
+# row filters are lists of (column, op, value) tuples that must all hold, e.g. [('play_type', 'in', ['field_goal']), ('season', '>=', 2015)]
+FILTER_OPS = ['==', '!=', '<', '<=', '>', '>=', 'in', 'not in']
+
+
+def check_filters(filters : list):
+    '''Validate row filters, column names must be plain identifiers as they are written into SQL'''
+    for f in filters:
+        if len(f) != 3: raise Exception(f'A filter must be a (column, op, value) tuple, got {f}')
+        column, op, value = f
+        if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', column): raise Exception(f'Invalid column name in filter: {column}')
+        if op not in FILTER_OPS: raise Exception(f'Unknown filter operator {op}, use one of {FILTER_OPS}')
+        if op in ('in', 'not in') and (isinstance(value, str) or not hasattr(value, '__iter__')):
+            raise Exception(f'Filter operator {op} requires a list of values, got {value}')
+    return list(filters)
+
+
+def sql_where(filters : list):
+    '''
+    Parameterized SQL condition of row filters, with %s placeholders (pg8000 format paramstyle)
+    
+    Returns:
+        (condition (str), params (list))
+    '''
+    conditions, params = [], []
+    for column, op, value in filters:
+        if op in ('in', 'not in'):
+            values = list(value)
+            # an empty list matches nothing (in) or everything (not in)
+            if len(values) == 0: conditions.append('FALSE' if op == 'in' else 'TRUE')
+            else: conditions.append(f'{column} {op.upper()} ({", ".join(["%s"] * len(values))})')
+            params += [_python_value(v) for v in values]
+        else:
+            conditions.append(f'{column} {"=" if op == "==" else "<>" if op == "!=" else op} %s')
+            params.append(_python_value(value))
+    return ' AND '.join(conditions), params
+
+
+def arrow_expression(filters : list):
+    '''pyarrow.dataset expression of row filters, None if there are no filters'''
+    import pyarrow.dataset as ds
+    
+    expression = None
+    for column, op, value in filters:
+        field = ds.field(column)
+        if op == 'in': e = field.isin(list(value))
+        elif op == 'not in': e = ~field.isin(list(value))
+        elif op == '==': e = field == value
+        elif op == '!=': e = field != value
+        elif op == '<': e = field < value
+        elif op == '<=': e = field <= value
+        elif op == '>': e = field > value
+        else: e = field >= value
+        expression = e if expression is None else expression & e
+    return expression
+
+
+def pandas_mask(df, filters : list):
+    '''Boolean mask of the rows of df that pass the row filters'''
+    mask = np.ones(len(df), dtype=bool)
+    for column, op, value in filters:
+        c = df[column]
+        if op == 'in': m = c.isin(list(value))
+        elif op == 'not in': m = ~c.isin(list(value))
+        elif op == '==': m = c == value
+        elif op == '!=': m = c != value
+        elif op == '<': m = c < value
+        elif op == '<=': m = c <= value
+        elif op == '>': m = c > value
+        else: m = c >= value
+        # missing values never pass, like NULL in SQL
+        mask &= m.to_numpy(dtype=bool, na_value=False) & c.notna().to_numpy()
+    return mask
+
+
+def _python_value(value):
+    '''NumPy scalars as Python scalars for the database driver'''
+    return value.item() if isinstance(value, np.generic) else value
@@ -1,14 +1,28 @@
+import os
 import pandas as pd
 from nflmodels.dataloader.presets import preset_cols
-from urllib.request import urlopen
+from nflmodels.dataloader.filters import check_filters, arrow_expression, pandas_mask
+from nflmodels.profiling import stage
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from io import BytesIO
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen, url2pathname
 import datetime
 
 class nflverseLoader():
     
-    def __init__(self):
-        self.loc = 'https://github.com/nflverse/nflverse-data/releases/download/pbp/play_by_play_'
+    def __init__(self, loc = 'https://github.com/nflverse/nflverse-data/releases/download/pbp', cache_dir = None):
+        '''
+        Parameters:
+            loc (str): Base URL or local directory containing the play_by_play_{season}.parquet files, file:// URLs are read from disk
+            cache_dir (str): Directory for the local per-season cache, default None for ~/.cache/nflmodels
+        '''
+        self.loc = loc.rstrip('/')
+        self.cache_dir = cache_dir if cache_dir is not None else os.path.join(os.path.expanduser('~'), '.cache', 'nflmodels')
         self.s_columns = []
         self.seasons = []
+        self.filters = []
         
     def select(self, select_preset = False, columns = []):
         '''
@@ -31,14 +45,147 @@ class nflverseLoader():
     
     def where(self, seasons = []):
         '''
-        
+        Set which seasons to load, empty for all seasons from 1999 to the current season
         '''
         self.seasons = seasons
         return self
     
-    def load(self):
+    def filter(self, filters = []):
+        '''
+        Set row filters, applied while reading the cached seasons so that only matching rows are converted to pandas.
+        Filters on season also skip whole seasons.
         
-        if len(self.seasons) == 0:
-            self.seasons = [*range(1999, datetime.datetime.now().year + 1)]
+        Parameters:
+            filters (list): (column, op, value) tuples that must all hold, op is one of ==, !=, <, <=, >, >=, in, not in. 
+                E.g. data_requirements(preprocess_field_goal)['filters']
             
-        return None
\ No newline at end of file
+        Returns:
+            self: nflverseloader object
+        '''
+        self.filters = check_filters(filters)
+        return self
+    
+    def load(self, n_jobs = 4, verbose = True):
+        '''
+        Load play-by-play data for the selected seasons and columns.
+        Each season is downloaded once into a local Feather cache, later loads are memory-mapped from the cache and read only the selected columns.
+        Cached past seasons are used as is, the current season is revalidated against the source on every load
+        and skipped if its file is not published yet.
+        
+        Parameters:
+            n_jobs (int): Number of seasons loaded concurrently, default 4
+            verbose (bool): Print status messages, default True
+        
+        Returns:
+            pandas DataFrame
+        '''
+        
+        if len(self.seasons) == 0:
+            self.seasons = [*range(1999, _current_season() + 1)]
+        
+        # seasons excluded by the filters are not fetched or read
+        season_filters = [f for f in self.filters if f[0] == 'season']
+        seasons = [s for s, keep in zip(self.seasons, pandas_mask(pd.DataFrame({'season': self.seasons}), season_filters)) if keep]
+        
+        os.makedirs(self.cache_dir, exist_ok=True)
+        
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            frames = list(executor.map(lambda season: self._load_season(season, verbose), seasons))
+        
+        if len(frames) == 0: raise Exception('No seasons left to load after applying the filters.')
+        # the current season before its file is published
+        seasons = [s for s, f in zip(seasons, frames) if f is not None]
+        frames = [f for f in frames if f is not None]
+        if len(frames) == 0: raise Exception('None of the selected seasons are published yet.')
+        
+        with stage('concat', rows=sum(len(f) for f in frames)):
+            df = pd.concat(frames, ignore_index=True)
+        if verbose: print(f'Loaded {len(df)} rows from {len(seasons)} seasons')
+        
+        return df
+    
+    def _load_season(self, season : int, verbose : bool):
+        '''Update the cache of a single season if needed and read it, None if it is the current season and not published yet'''
+        
+        path = os.path.join(self.cache_dir, f'play_by_play_{season}.feather')
+        
+        if not os.path.exists(path):
+            if verbose: print(f'Fetching season {season} from {self.loc}')
+            try:
+                self._update_cache(season, path, since=None)
+            except (HTTPError, FileNotFoundError) as e:
+                # the file of the current season is only published after its first games
+                if season != _current_season() or (isinstance(e, HTTPError) and e.code != 404): raise
+                if verbose: print(f'Season {season} is not published yet, skipped')
+                return None
+        elif season == _current_season():
+            if self._update_cache(season, path, since=os.path.getmtime(path)) and verbose:
+                print(f'Updated cached season {season}')
+        
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        
+        # memory-mapped read of the selected columns only, columns missing from the season are left out
+        with pa.memory_map(path) as source:
+            names = pa.ipc.open_file(source).schema.names
+        columns = None if len(self.s_columns) == 0 else [c for c in self.s_columns if c in names]
+        
+        with stage('read') as s:
+            if len(self.filters) == 0:
+                table = feather.read_table(path, columns=columns, memory_map=True)
+            else:
+                import pyarrow.dataset as ds
+                import pyarrow.fs as fs
+                # rows are filtered batch by batch before conversion, filter columns need not be selected
+                dataset = ds.dataset(path, format='ipc', filesystem=fs.LocalFileSystem(use_mmap=True))
+                table = dataset.to_table(columns=columns, filter=arrow_expression(self.filters))
+            df = table.to_pandas()
+            s.rows = len(df)
+        return df
+    
+    def _update_cache(self, season : int, path : str, since = None):
+        '''Write the season to the cache if the source is newer than since (timestamp), returns True if the cache was written'''
+        
+        with stage('fetch'):
+            source = self._fetch(season, since)
+        if source is None: return False
+        
+        import pyarrow.feather as feather
+        import pyarrow.parquet as pq
+        
+        # the full season is cached so that later selects with other columns are also served from the cache
+        table = pq.read_table(source)
+        
+        # write to a temporary file first, an interrupted write never leaves a partial cache file behind
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        feather.write_feather(table, tmp_path, compression='uncompressed')
+        os.replace(tmp_path, path)
+        return True
+    
+    def _fetch(self, season : int, since = None):
+        '''Get a readable source for the season file, None if the file has not been modified after since (timestamp)'''
+        
+        file = f'play_by_play_{season}.parquet'
+        
+        if self.loc.startswith(('http://', 'https://')):
+            request = Request(f'{self.loc}/{file}')
+            if since is not None: request.add_header('If-Modified-Since', formatdate(since, usegmt=True))
+            try:
+                with urlopen(request) as response:
+                    return BytesIO(response.read())
+            except HTTPError as e:
+                if e.code == 304: return None
+                raise
+        
+        # local directory or file:// mirror
+        loc = url2pathname(self.loc[len('file://'):]) if self.loc.startswith('file://') else self.loc
+        source = os.path.join(loc, file)
+        if since is not None and os.path.getmtime(source) <= since: return None
+        return source
+
+
+def _current_season():
+    '''NFL season of the current date, a season starts in September'''
+    now = datetime.datetime.now()
+    return now.year if now.month >= 9 else now.year - 1
+
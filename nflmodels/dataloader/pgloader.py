@@ -1,6 +1,11 @@
-import pg8000 as pg
+import re
+import threading
+import numpy as np
 import pandas as pd
-from nflmodels.dataloader.presets import preset_cols
+from concurrent.futures import ThreadPoolExecutor
+from nflmodels.dataloader.presets import preset_cols, preset_dtypes
+from nflmodels.dataloader.filters import check_filters, sql_where
+from nflmodels.profiling import stage
 
 class PgLoader():
     
@@ -14,6 +19,7 @@ class PgLoader():
         
         self.s_columns = []
         self.where_string = ''
+        self.filters = []
         
     def select(self, select_preset = False, columns = []):
         '''
@@ -34,7 +40,7 @@ class PgLoader():
             if c not in self.s_columns:
                 self.s_columns.append(c)
         return self
-
+    
     def where(self, where_string : str = ''):
         '''
         Set conditions to query, expects a valid PostgreSQL expression.
@@ -42,6 +48,20 @@ class PgLoader():
         self.where_string = where_string
         return self
     
+    def filter(self, filters = []):
+        '''
+        Set row filters, sent to the database as query parameters and combined with the where conditions.
+        
+        Parameters:
+            filters (list): (column, op, value) tuples that must all hold, op is one of ==, !=, <, <=, >, >=, in, not in. 
+                E.g. data_requirements(preprocess_field_goal)['filters']
+            
+        Returns:
+            self: PgLoader object
+        '''
+        self.filters = check_filters(filters)
+        return self
+    
     def load(self, verbose=True):
         '''
         Connect to database and load data
@@ -53,21 +73,215 @@ class PgLoader():
             pandas DataFrame
         '''
         
-        if len(self.s_columns) == 0: raise Exception('Unknown select statement, call .select() first to specify which columns to query.')
-        
-        select_string = ', '.join(self.s_columns)
-        
-        # construct query string from select and where strings
-        query = f'SELECT {select_string} FROM {self.c_tablename}'
-        if len(self.where_string) != 0: query += f' WHERE {self.where_string}'
+        query, params = self._query()
         query += ';'
         
-        if verbose: print(query)
+        if verbose: print(query if params is None else f'{query} {params}')
+        
+        import pg8000 as pg
     
         # complains but works!
         # https://hackersandslackers.com/connecting-pandas-to-a-sql-database-with-sqlalchemy/
         with pg.connect(user=self.c_user, password=self.c_password, host=self.c_host, port=self.c_port, database=self.c_dbname) as conn:
-            df = pd.read_sql_query(sql=query, con=conn)
+            with stage('query') as s:
+                df = pd.read_sql_query(sql=query, con=conn, params=params)
+                s.rows = len(df)
+    
+        return df
     
+    def load_iter(self, chunksize = 100000, dtypes = None, verbose = True):
+        '''
+        Connect to database and load data in chunks. 
+        Rows are fetched through a server-side cursor, so only one chunk is held in memory at a time.
+        
+        Parameters:
+            chunksize (int): Number of rows in each chunk, default 100000
+            dtypes (dict): Column dtypes for the chunks, default None for preset dtypes. Columns not present in dtypes are inferred
+            verbose (bool): Print status messages, default True
+            
+        Yields:
+            pandas DataFrame
+        '''
+        
+        if chunksize < 1: raise Exception('chunksize must be a positive integer.')
+        if dtypes is None: dtypes = preset_dtypes()
+        
+        query, params = self._query()
+        
+        if verbose: print(query if params is None else f'{query} {params}')
+        
+        import pg8000 as pg
+        
+        with pg.connect(user=self.c_user, password=self.c_password, host=self.c_host, port=self.c_port, database=self.c_dbname) as conn:
+            cursor = conn.cursor()
+            # cursors can only be declared inside a transaction, pg8000 opens one on the first execute
+            if params is None: cursor.execute(f'DECLARE nflmodels_cursor NO SCROLL CURSOR FOR {query}')
+            else: cursor.execute(f'DECLARE nflmodels_cursor NO SCROLL CURSOR FOR {query}', params)
+            try:
+                n_rows = 0
+                while True:
+                    with stage('fetch') as s:
+                        cursor.execute(f'FETCH FORWARD {int(chunksize)} FROM nflmodels_cursor')
+                        rows = cursor.fetchall()
+                        s.rows = len(rows)
+                    if len(rows) == 0: break
+                    
+                    with stage('dataframe', rows=len(rows)):
+                        columns = [d[0] for d in cursor.description]
+                        df = pd.DataFrame.from_records(rows, columns=columns)
+                        # integer columns (season) can not hold NULL, those are float64 like in load_bulk
+                        df = df.astype({c: 'float64' if dtypes[c] == 'int64' and df[c].isna().any() else dtypes[c] for c in columns if c in dtypes})
+                        # text columns are object with None for NULL, pandas >= 3 infers strings with NaN
+                        for c in columns:
+                            if dtypes.get(c) == 'object': df[c] = df[c].astype(object).where(df[c].notna(), None)
+                    
+                    n_rows += len(df)
+                    if verbose: print(f'Loaded {n_rows} rows', end='\r')
+                    yield df
+                    
+                if verbose: print(f'Loaded {n_rows} rows')
+            finally:
+                # ending the transaction closes the cursor. An explicit CLOSE would fail in a transaction aborted by a failed FETCH
+                # and replace the original error
+                conn.rollback()
+    
+    def load_bulk(self, partition_by = 'season', n_partitions = None, n_jobs = 4, dtypes = None, verbose = True):
+        '''
+        Connect to database and load data in partitions over a pool of connections, for large extracts such as the full history.
+        Each partition is streamed with COPY (query) TO STDOUT as CSV and parsed with the multithreaded pyarrow CSV reader,
+        so rows are not decoded one by one in Python. Requires pyarrow.
+        
+        Parameters:
+            partition_by (str): "season" for one partition per season or "game_id" for n_partitions ranges of game ids, default "season".
+                Rows where the partition column is NULL are loaded in one more partition
+            n_partitions (int): Number of game_id ranges, default None for 4 * n_jobs. Ignored if partition_by == "season"
+            n_jobs (int): Number of connections loading partitions concurrently, default 4
+            dtypes (dict): Column dtypes, default None for preset dtypes. Columns not present in dtypes are inferred
+            verbose (bool): Print status messages, default True
+            
+        Returns:
+            pandas DataFrame
+        '''
+        
+        if partition_by not in ('season', 'game_id'): raise Exception('Unknown value for parameter partition_by, use "season" or "game_id"')
+        if n_partitions is None: n_partitions = 4 * n_jobs
+        if dtypes is None: dtypes = preset_dtypes()
+        
+        import pg8000 as pg
+        from pg8000.native import literal
+        
+        # one connection per worker thread, closed when all partitions are loaded
+        local = threading.local()
+        connections = []
+        def connection():
+            if not hasattr(local, 'conn'):
+                local.conn = pg.connect(user=self.c_user, password=self.c_password, host=self.c_host, port=self.c_port, database=self.c_dbname)
+                connections.append(local.conn)
+            return local.conn
+        
+        try:
+            with stage('partition') as s:
+                cursor = connection().cursor()
+                cursor.execute(self._literal_query(f'DISTINCT {partition_by}') + f' ORDER BY {partition_by}')
+                values = [row[0] for row in cursor.fetchall()]
+                # rows with a NULL key match no comparison, they are loaded in a partition of their own
+                has_null = any(v is None for v in values)
+                values = [v for v in values if v is not None]
+                
+                if partition_by == 'season':
+                    partitions = [f'season = {literal(v)}' for v in values]
+                elif len(values) != 0:
+                    partitions = [f'game_id BETWEEN {literal(v[0])} AND {literal(v[-1])}' 
+                                  for v in np.array_split(np.array(values, dtype=object), min(n_partitions, len(values)))]
+                else:
+                    partitions = []
+                if has_null: partitions.append(f'{partition_by} IS NULL')
+                s.rows = len(partitions)
+            
+            if verbose: print(f'{self._literal_query()}\nLoading {len(partitions)} partitions by {partition_by} over {n_jobs} connections')
+            
+            def load_partition(partition):
+                with stage('copy') as s:
+                    df = _copy(connection(), self._literal_query(conditions=[partition]), dtypes)
+                    s.rows = len(df)
+                return df
+            
+            with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+                frames = list(executor.map(load_partition, partitions))
+        finally:
+            for conn in connections: conn.close()
+        
+        if len(frames) == 0: return _copy_frame(None, dtypes, self.s_columns)
+        
+        with stage('concat', rows=sum(len(f) for f in frames)):
+            df = pd.concat(frames, ignore_index=True)
+        if verbose: print(f'Loaded {len(df)} rows')
+        
         return df
-        
\ No newline at end of file
+    
+    def _query(self):
+        '''Construct query string and its parameters from select, where and filters, returns (query, params)'''
+        
+        if len(self.s_columns) == 0: raise Exception('Unknown select statement, call .select() first to specify which columns to query.')
+        
+        select_string = ', '.join(self.s_columns)
+        
+        filter_string, params = sql_where(self.filters)
+        
+        conditions = []
+        # with parameters % starts a placeholder, literal ones in the where string are escaped
+        if len(self.where_string) != 0: conditions.append(f'({self.where_string.replace("%", "%%")})' if len(params) != 0 else self.where_string)
+        if len(filter_string) != 0: conditions.append(filter_string)
+        
+        query = f'SELECT {select_string} FROM {self.c_tablename}'
+        if len(conditions) != 0: query += ' WHERE ' + ' AND '.join(conditions)
+        return query, params if len(params) != 0 else None
+    
+    def _literal_query(self, select_string = None, conditions = []):
+        '''Query string with the filter values written as literals, for statements that take no parameters (COPY)'''
+        from pg8000.native import literal
+        
+        if select_string is None:
+            if len(self.s_columns) == 0: raise Exception('Unknown select statement, call .select() first to specify which columns to query.')
+            select_string = ', '.join(self.s_columns)
+        
+        filter_string, params = sql_where(self.filters)
+        values = iter(params)
+        filter_string = re.sub('%s', lambda m: literal(next(values)), filter_string)
+        
+        all_conditions = [f'({c})' for c in [self.where_string, filter_string] + conditions if len(c) != 0]
+        
+        query = f'SELECT {select_string} FROM {self.c_tablename}'
+        if len(all_conditions) != 0: query += ' WHERE ' + ' AND '.join(all_conditions)
+        return query
+
+
+def _copy(conn, query : str, dtypes : dict):
+    '''Stream the result of query with COPY TO STDOUT and parse it into a DataFrame'''
+    from io import BytesIO
+    
+    buffer = BytesIO()
+    conn.cursor().execute(f'COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true)', stream=buffer)
+    conn.rollback()
+    return _copy_frame(buffer.getvalue(), dtypes)
+
+
+def _copy_frame(data : bytes, dtypes : dict, columns : list = []):
+    '''
+    Parse CSV output of COPY, text columns are object with None for NULL like in load. 
+    PostgreSQL writes NULL unquoted and empty strings quoted, only unquoted empty values are parsed as missing.
+    '''
+    if data is None: return pd.DataFrame({c: pd.Series(dtype=dtypes.get(c, 'object')) for c in columns})
+    
+    import pyarrow as pa
+    import pyarrow.csv as csv
+    
+    types = {'object': pa.string(), 'int64': pa.int64(), 'float64': pa.float64()}
+    convert_options = csv.ConvertOptions(column_types={c: types[t] for c, t in dtypes.items() if t in types},
+                                         null_values=[''], strings_can_be_null=True, quoted_strings_can_be_null=False,
+                                         true_values=['t'], false_values=['f'])
+    df = csv.read_csv(pa.py_buffer(data), convert_options=convert_options).to_pandas()
+    
+    for c in df.columns:
+        if dtypes.get(c) == 'object': df[c] = df[c].astype(object).where(df[c].notna(), None)
+    return df
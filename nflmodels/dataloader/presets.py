@@ -29,4 +29,22 @@ PRESET_COLS = [
     'game_stadium', 'roof', 'surface', 'weather', 'wind', 'temp', 'kicker_player_name']
 
 def preset_cols():
-    return PRESET_COLS
\ No newline at end of file
+    return PRESET_COLS
+
+# text columns of PRESET_COLS, all other preset columns are numeric
+PRESET_TEXT_COLS = [
+    'game_id', 'home_team', 'away_team', 
+    'posteam', 'posteam_type', 'defteam', 
+    'game_half', 'yrdln', 'play_type', 
+    'pass_length', 'pass_location', 'run_location', 'run_gap', 
+    'field_goal_result', 'extra_point_result', 'two_point_conv_result', 
+    'timeout_team', 'td_team', 'penalty_team', 
+    'game_stadium', 'roof', 'surface', 'weather', 'kicker_player_name']
+
+def preset_dtypes():
+    '''
+    Explicit pandas dtypes for the preset columns. 
+    Numeric columns are float64 as most of them may contain missing values, season is stored as int64. 
+    The loaders read an int64 column with NULL values as float64.
+    '''
+    return {c: 'object' if c in PRESET_TEXT_COLS else 'int64' if c == 'season' else 'float64' for c in PRESET_COLS}
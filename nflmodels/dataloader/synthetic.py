@@ -0,0 +1,427 @@
+import numpy as np
+import pandas as pd
+from nflmodels.dataloader.presets import preset_cols, preset_dtypes
+from nflmodels.dataloader.filters import check_filters, pandas_mask
+from nflmodels.profiling import stage
+
+TEAMS = [
+    'ARI', 'ATL', 'BAL', 'BUF', 'CAR', 'CHI', 'CIN', 'CLE', 'DAL', 'DEN', 'DET', 'GB', 'HOU', 'IND', 'JAX', 'KC',
+    'LA', 'LAC', 'LV', 'MIA', 'MIN', 'NE', 'NO', 'NYG', 'NYJ', 'PHI', 'PIT', 'SEA', 'SF', 'TB', 'TEN', 'WAS'
+]
+
+# one kicker per team, names of active kickers so that preprocess_field_goal(kickers='active') keeps them
+KICKERS = [
+    'M.Prater', 'Y.Koo', 'J.Tucker', 'T.Bass', 'E.Pineiro', 'C.Santos', 'E.McPherson', 'D.Hopkins', 'B.Maher', 'W.Lutz',
+    'R.Patterson', 'M.Crosby', 'K.Fairbairn', 'M.Gay', 'B.McManus', 'H.Butker', 'J.Sanders', 'C.Dicker', 'D.Carlson', 'J.Slye',
+    'G.Joseph', 'C.Ryland', 'B.Grupe', 'G.Gano', 'G.Zuerlein', 'J.Elliott', 'C.Boswell', 'J.Myers', 'M.Badgley', 'C.McLaughlin',
+    'N.Folk', 'R.Gould'
+]
+
+# home teams playing under a closed roof
+CLOSED_ROOF = {'ARI': 'closed', 'ATL': 'closed', 'DAL': 'closed', 'DET': 'dome', 'HOU': 'closed', 'IND': 'closed',
+               'LA': 'dome', 'LAC': 'dome', 'LV': 'dome', 'MIN': 'dome', 'NO': 'dome'}
+
+# outcome probabilities of a drive, the last drive of each half runs out the clock
+DRIVE_OUTCOMES = ['td', 'fg', 'punt', 'turnover', 'downs', 'return_td', 'safety']
+DRIVE_OUTCOME_P = [0.22, 0.17, 0.41, 0.12, 0.06, 0.01, 0.01]
+
+
+class SyntheticLoader():
+    '''
+    Deterministic synthetic nflverse-shaped play-by-play data with the PRESET_COLS schema, for tests and benchmarks without a database or a download.
+    Games are generated drive by drive: possession alternates between the teams, drives end in touchdowns (followed by an extra point
+    or two point attempt), field goals, punts, turnovers, safeties or the end of the half, and scores, clock, downs and timeouts
+    are consistent within each game half. Model outputs of nflverse (ep, wp, ...) are missing.
+    
+    Usage:
+        data = SyntheticLoader(n_rows=100000).select(select_preset=True).load()
+    '''
+    
+    def __init__(self, n_games : int = None, n_rows : int = None, seed : int = 0):
+        '''
+        Parameters:
+            n_games (int): Number of games to generate
+            n_rows (int): Number of rows to generate instead of n_games, the last game is cut at n_rows
+            seed (int): Random seed, the same parameters always generate the same data. Default 0
+        '''
+        if n_games is None and n_rows is None: raise Exception('Give either n_games or n_rows.')
+        self.n_games = n_games
+        self.n_rows = n_rows
+        self.seed = seed
+        self.s_columns = []
+        self.seasons = [*range(2015, 2023)]
+        self.filters = []
+    
+    def select(self, select_preset = False, columns = []):
+        '''
+        Set which columns will be generated
+        
+        Parameters:
+            select_preset (bool): Include preset columns? This includes all columns required to contruct the models in this package, default False
+            columns (list): Individual columns to include, only preset columns are available
+        
+        Returns:
+            self: SyntheticLoader object
+        '''
+        # add preset columns
+        if select_preset: self.s_columns += preset_cols()
+        # don't add if duplicate
+        for c in columns:
+            if c not in preset_cols(): raise Exception(f'Column {c} is not available in synthetic data.')
+            if c not in self.s_columns:
+                self.s_columns.append(c)
+        return self
+    
+    def where(self, seasons = []):
+        '''
+        Set which seasons the games are spread over, empty for 2015-2022
+        '''
+        self.seasons = seasons if len(seasons) != 0 else [*range(2015, 2023)]
+        return self
+    
+    def filter(self, filters = []):
+        '''
+        Set row filters, applied to the generated rows (n_rows counts the rows before filtering)
+        
+        Parameters:
+            filters (list): (column, op, value) tuples that must all hold, op is one of ==, !=, <, <=, >, >=, in, not in
+            
+        Returns:
+            self: SyntheticLoader object
+        '''
+        self.filters = check_filters(filters)
+        return self
+    
+    def load(self, verbose = True):
+        '''
+        Generate the data
+        
+        Parameters:
+            verbose (bool): Print status messages, default True
+        
+        Returns:
+            pandas DataFrame
+        '''
+        columns = self.s_columns if len(self.s_columns) != 0 else preset_cols()
+        
+        with stage('generate') as s:
+            if self.n_games is not None:
+                df = _generate(self.n_games, self.seasons, np.random.default_rng(self.seed))
+            else:
+                # games average about 150 rows, generate more games until there are enough rows
+                n_games = self.n_rows // 140 + 1
+                while True:
+                    df = _generate(n_games, self.seasons, np.random.default_rng(self.seed))
+                    if len(df) >= self.n_rows: break
+                    n_games = int(n_games * 1.1) + 1
+                df = df.iloc[:self.n_rows]
+            s.rows = len(df)
+        
+        if len(self.filters) != 0: df = df[pandas_mask(df, self.filters)]
+        df = df[columns]
+        
+        if verbose: print(f'Generated {len(df)} rows from {df["game_id"].nunique() if "game_id" in df else "?"} games')
+        return df
+
+
+def _generate(n_games : int, seasons : list, rng):
+    '''Generate n_games games, returns a DataFrame of all preset columns'''
+    
+    # ========================= Games =========================
+    
+    n_seasons = len(seasons)
+    game = np.arange(n_games)
+    season = np.asarray(seasons)[game % n_seasons]
+    # 16 games per week, every team plays once a week
+    week = (game // n_seasons) // 16
+    block = week * n_seasons + game % n_seasons
+    slot = (game // n_seasons) % 16
+    pairs = rng.permuted(np.tile(np.arange(32), (block.max() + 1, 1)), axis=1)
+    home = pairs[block, 2 * slot]
+    away = pairs[block, 2 * slot + 1]
+    teams = np.array(TEAMS, dtype=object)
+    game_id = np.array([f'{s}_{w + 1:02d}_{a}_{h}' for s, w, a, h in zip(season, week, teams[away], teams[home])], dtype=object)
+    
+    roof = np.array([CLOSED_ROOF.get(t, 'outdoors') for t in TEAMS], dtype=object)[home]
+    closed = roof != 'outdoors'
+    temp = np.where(closed, np.nan, rng.integers(20, 90, n_games).astype(float))
+    wind = np.where(closed, np.nan, rng.integers(0, 25, n_games).astype(float))
+    wind_dir = rng.choice(np.array(['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW'], dtype=object), n_games)
+    weather = np.array([None if c else f'Cloudy Temp: {t:.0f}° F, Humidity: 60%, Wind: {d} {w:.0f} mph'
+                        for c, t, d, w in zip(closed, temp, wind_dir, wind)], dtype=object)
+    # wind is missing from some games, preprocess_field_goal reads it from the weather string
+    wind = np.where(rng.random(n_games) < 0.2, np.nan, wind)
+    surface = rng.choice(np.array(['grass', 'fieldturf'], dtype=object), n_games)
+    
+    
+    # ========================= Drives =========================
+    
+    # drives per half, sorted by game, half and order
+    n_half_drives = rng.integers(10, 15, (n_games, 2)).ravel()
+    n_drives = n_half_drives.sum()
+    half_id = np.repeat(np.arange(2 * n_games), n_half_drives)
+    half_start = np.repeat(np.cumsum(n_half_drives) - n_half_drives, n_half_drives)
+    d_order = np.arange(n_drives) - half_start
+    d_game = half_id // 2
+    game_drives = n_half_drives.reshape(-1, 2).sum(axis=1)
+    game_first_drive = np.cumsum(game_drives) - game_drives
+    d_half = half_id % 2
+    last_of_half = d_order == np.repeat(n_half_drives, n_half_drives) - 1
+    
+    outcome = rng.choice(np.array(DRIVE_OUTCOMES, dtype=object), n_drives, p=DRIVE_OUTCOME_P)
+    outcome = np.where(last_of_half, 'end_half', outcome)
+    
+    # possession changes after every drive except a return touchdown, after which the scoring team kicks off
+    flip = (outcome != 'return_td').astype(np.int64)
+    flips = np.cumsum(flip) - flip
+    flips = flips - flips[half_start]
+    first_receiver = rng.integers(0, 2, n_games)
+    receiver = np.where(d_half == 0, first_receiver[d_game], 1 - first_receiver[d_game])
+    # side 0 = home, 1 = away
+    d_side = (receiver + flips) % 2
+    
+    # a kickoff precedes the first drive of each half and every drive after a score
+    scored = np.isin(outcome, ['td', 'fg', 'return_td', 'safety'])
+    kickoff = (d_order == 0) | np.concatenate([[True], scored[:-1]])
+    
+    # start and last snap yardlines
+    start = np.where(kickoff, rng.normal(75, 6, n_drives), rng.normal(62, 18, n_drives))
+    start = np.clip(np.round(start), 1, 99)
+    end = np.select(
+        [outcome == 'td', outcome == 'fg', outcome == 'punt', outcome == 'safety'],
+        [rng.integers(1, 35, n_drives), rng.integers(2, 40, n_drives), rng.integers(40, 90, n_drives), rng.integers(94, 100, n_drives)],
+        rng.integers(10, 90, n_drives)).astype(float)
+    start = np.where(outcome == 'safety', np.maximum(start, end), start)
+    end = np.minimum(start, end)
+    
+    # longer drives take more plays
+    d_plays = 1 + rng.poisson(np.where(outcome == 'end_half', 1.5, (start - end) / 7 + 1.5))
+    end = np.where(d_plays == 1, start, end)
+    
+    
+    # ========================= Plays =========================
+    
+    # rows of each drive: an optional kickoff, the plays of the drive and the conversion attempt after a touchdown
+    conversion = np.isin(outcome, ['td', 'return_td'])
+    n_rows = kickoff + d_plays + conversion
+    drive = np.repeat(np.arange(n_drives), n_rows)
+    row_start = np.cumsum(n_rows) - n_rows
+    position = np.arange(len(drive)) - row_start[drive] - kickoff[drive]
+    n = len(drive)
+    
+    is_kickoff = position == -1
+    is_conversion = position == d_plays[drive]
+    is_play = ~is_kickoff & ~is_conversion
+    is_last = position == d_plays[drive] - 1
+    
+    g = d_game[drive]
+    half = d_half[drive]
+    side = d_side[drive]
+    # the conversion is attempted by the scoring team
+    side = np.where(is_conversion & (outcome[drive] == 'return_td'), 1 - side, side)
+    posteam_idx = np.where(side == 0, home[g], away[g])
+    defteam_idx = np.where(side == 0, away[g], home[g])
+    
+    # yardlines move from the drive start to the last snap
+    frac = np.clip(position, 0, None) / np.maximum(d_plays[drive] - 1, 1)
+    yardline = start[drive] + (end[drive] - start[drive]) * frac + np.where(is_last | (position == 0), 0, rng.normal(0, 2, n))
+    yardline = np.clip(np.round(yardline), 1, 99)
+    yardline = np.where(is_kickoff, 35, yardline)
+    
+    # downs and distances, one play position of all drives at a time
+    down = np.full(n, np.nan)
+    ydstogo = np.zeros(n)
+    drive_down = np.ones(n_drives)
+    drive_togo = np.minimum(10, start)
+    snaps = np.flatnonzero(is_play)
+    snap_position = position[snaps]
+    for p in range(d_plays.max()):
+        rows = snaps[snap_position == p]
+        d = drive[rows]
+        down[rows] = drive_down[d]
+        ydstogo[rows] = drive_togo[d]
+        next_yardline = np.where(p + 1 < d_plays[d], yardline[np.minimum(rows + 1, n - 1)], yardline[rows])
+        togo = drive_togo[d] - (yardline[rows] - next_yardline)
+        # a drive that continues after a third down converted it
+        first_down = (togo <= 0) | (drive_down[d] >= 3)
+        drive_down[d] = np.where(first_down, 1, drive_down[d] + 1)
+        drive_togo[d] = np.where(first_down, np.minimum(10, next_yardline), togo)
+    # punts and field goals are fourth down plays
+    fourth = is_last & np.isin(outcome[drive], ['punt', 'fg', 'downs'])
+    down = np.where(fourth, 4, down)
+    ydstogo = np.clip(np.where(is_play, ydstogo, 0), 0, 99)
+    goal_to_go = (is_play & (ydstogo >= yardline)).astype(float)
+    ydstogo = np.where(is_play, np.minimum(ydstogo, yardline), ydstogo)
+    
+    # play types
+    o = outcome[drive]
+    is_pass = rng.random(n) < 0.58
+    play_type = np.where(is_pass, 'pass', 'run').astype(object)
+    play_type = np.where(is_last & (o == 'fg'), 'field_goal', play_type)
+    play_type = np.where(is_last & (o == 'punt'), 'punt', play_type)
+    play_type = np.where(is_last & (o == 'return_td'), 'pass', play_type)
+    play_type = np.where(is_last & (o == 'end_half'), 'qb_kneel', play_type)
+    play_type = np.where(is_kickoff, 'kickoff', play_type)
+    two_point = is_conversion & (rng.random(n) < 0.06)
+    play_type = np.where(is_conversion, np.where(two_point, play_type, 'extra_point'), play_type)
+    yardline = np.where(is_conversion, np.where(two_point, 2, 15), yardline)
+    is_pass = play_type == 'pass'
+    is_run = play_type == 'run'
+    
+    # kicks, field goal accuracy falls with distance and wind
+    kick_distance = np.where(play_type == 'field_goal', yardline + 17, np.nan)
+    fg_made = rng.random(n) < 1 / (1 + np.exp(-(6.0 - 0.1 * kick_distance - 0.03 * np.nan_to_num(wind[g]))))
+    field_goal_result = np.where(play_type == 'field_goal', np.where(fg_made, 'made', np.where(rng.random(n) < 0.1, 'blocked', 'missed')), None)
+    pat_good = rng.random(n) < 0.94
+    extra_point_result = np.where(play_type == 'extra_point', np.where(pat_good, 'good', np.where(rng.random(n) < 0.2, 'blocked', 'failed')), None)
+    two_point_good = two_point & (rng.random(n) < 0.48)
+    two_point_conv_result = np.where(two_point, np.where(two_point_good, 'success', 'failure'), None)
+    
+    touchdown = is_last & np.isin(o, ['td', 'return_td'])
+    safety = is_last & (o == 'safety')
+    interception = is_last & (((o == 'turnover') & is_pass) | (o == 'return_td'))
+    
+    # points of each row, to the posession team or its opponent
+    points = np.select([touchdown & (o == 'td'), field_goal_result == 'made', extra_point_result == 'good', two_point_good], [6, 3, 1, 2], 0)
+    opp_points = np.select([touchdown & (o == 'return_td'), safety], [6, 2], 0)
+    home_points = np.where(side == 0, points, opp_points)
+    away_points = np.where(side == 0, opp_points, points)
+    
+    game_rows = np.bincount(g, minlength=n_games)
+    game_start = np.cumsum(game_rows) - game_rows
+    game_end = game_start + game_rows - 1
+    home_score_post = _cumsum_by(home_points, game_start, game_rows)
+    away_score_post = _cumsum_by(away_points, game_start, game_rows)
+    home_score_pre = home_score_post - home_points
+    away_score_pre = away_score_post - away_points
+    posteam_score = np.where(side == 0, home_score_pre, away_score_pre).astype(float)
+    defteam_score = np.where(side == 0, away_score_pre, home_score_pre).astype(float)
+    posteam_score_post = np.where(side == 0, home_score_post, away_score_post).astype(float)
+    defteam_score_post = np.where(side == 0, away_score_post, home_score_post).astype(float)
+    
+    
+    # ========================= Clock =========================
+    
+    duration = np.where(is_kickoff, 5, np.where(is_conversion, 0, rng.integers(4, 42, n))).astype(float)
+    row_half = 2 * g + half
+    half_rows = np.bincount(row_half, minlength=2 * n_games)
+    half_row_start = np.cumsum(half_rows) - half_rows
+    elapsed = np.cumsum(duration) - duration
+    elapsed = elapsed - elapsed[half_row_start][row_half]
+    # the plays of a half fill the half
+    half_total = np.bincount(row_half, weights=duration, minlength=2 * n_games)
+    scale = 1800 * rng.uniform(0.985, 1.0, 2 * n_games) / np.maximum(half_total, 1)
+    elapsed = np.floor(elapsed * scale[row_half])
+    half_seconds_remaining = 1800 - elapsed
+    game_seconds_remaining = half_seconds_remaining + np.where(half == 0, 1800, 0)
+    qtr = np.minimum(4, (3600 - game_seconds_remaining) // 900 + 1)
+    quarter_seconds_remaining = game_seconds_remaining - (4 - qtr) * 900
+    
+    # each team uses up to three timeouts per half at random times
+    timeouts = np.where(rng.random((2 * n_games, 2, 3)) < 0.6, rng.uniform(0, 1800, (2 * n_games, 2, 3)), np.inf)
+    posteam_timeouts_remaining = 3 - (timeouts[row_half, side] < elapsed[:, None]).sum(axis=1).astype(float)
+    defteam_timeouts_remaining = 3 - (timeouts[row_half, 1 - side] < elapsed[:, None]).sum(axis=1).astype(float)
+    
+    
+    # ========================= Assemble =========================
+    
+    posteam = teams[posteam_idx]
+    defteam = teams[defteam_idx]
+    next_yardline = np.where(is_play & ~is_last, yardline[np.minimum(np.arange(n) + 1, n - 1)], np.where(touchdown, 0, yardline))
+    yards_gained = np.where(is_play, yardline - next_yardline, np.nan)
+    complete_pass = is_pass & ~interception & (rng.random(n) < 0.64)
+    air_yards = np.where(is_pass, rng.integers(-3, 30, n), np.nan)
+    kicker_idx = np.where(is_kickoff, defteam_idx, posteam_idx)
+    kicker = np.isin(play_type, ['field_goal', 'extra_point', 'kickoff'])
+    
+    columns = {
+        'play_id': np.arange(n) - np.repeat(game_start, game_rows) + 1.0,
+        'game_id': game_id[g],
+        'home_team': teams[home][g],
+        'away_team': teams[away][g],
+        'posteam': posteam,
+        'posteam_type': np.where(side == 0, 'home', 'away').astype(object),
+        'defteam': defteam,
+        'yardline_100': yardline,
+        'quarter_seconds_remaining': quarter_seconds_remaining,
+        'half_seconds_remaining': half_seconds_remaining,
+        'game_seconds_remaining': game_seconds_remaining,
+        'quarter_end': 0.0,
+        'drive': (drive - game_first_drive[g] + 1).astype(float),
+        'sp': ((points + opp_points) > 0).astype(float),
+        'qtr': qtr,
+        'game_half': np.where(half == 0, 'Half1', 'Half2').astype(object),
+        'down': down,
+        'goal_to_go': goal_to_go,
+        'yrdln': np.where(yardline == 50, '50', np.where(yardline > 50, posteam, defteam) + ' '
+                          + np.where(yardline > 50, 100 - yardline, yardline).astype(int).astype(str).astype(object)),
+        'ydstogo': ydstogo,
+        'ydsnet': np.where(is_play, start[drive] - yardline, np.nan),
+        'play_type': play_type,
+        'yards_gained': yards_gained,
+        'shotgun': (rng.random(n) < np.where(is_pass, 0.75, np.where(is_run, 0.3, 0))).astype(float),
+        'no_huddle': (is_play & (rng.random(n) < 0.08)).astype(float),
+        'qb_dropback': is_pass.astype(float),
+        'qb_kneel': (play_type == 'qb_kneel').astype(float),
+        'qb_spike': 0.0,
+        'qb_scramble': (is_pass & (rng.random(n) < 0.04)).astype(float),
+        'pass_length': np.where(is_pass, np.where(air_yards >= 15, 'deep', 'short'), None),
+        'pass_location': np.where(is_pass, rng.choice(np.array(['left', 'middle', 'right'], dtype=object), n), None),
+        'air_yards': air_yards,
+        'yards_after_catch': np.where(complete_pass, np.maximum(0, yards_gained - air_yards), np.nan),
+        'run_location': np.where(is_run, rng.choice(np.array(['left', 'middle', 'right'], dtype=object), n), None),
+        'run_gap': np.where(is_run, rng.choice(np.array(['end', 'guard', 'tackle'], dtype=object), n), None),
+        'field_goal_result': field_goal_result,
+        'kick_distance': kick_distance,
+        'extra_point_result': extra_point_result,
+        'two_point_conv_result': two_point_conv_result,
+        'posteam_timeouts_remaining': posteam_timeouts_remaining,
+        'defteam_timeouts_remaining': defteam_timeouts_remaining,
+        'timeout': 0.0,
+        'timeout_team': None,
+        'td_team': np.where(touchdown, np.where(o == 'td', posteam, defteam), None),
+        'posteam_score': posteam_score,
+        'defteam_score': defteam_score,
+        'score_differential': posteam_score - defteam_score,
+        'posteam_score_post': posteam_score_post,
+        'defteam_score_post': defteam_score_post,
+        'score_differential_post': posteam_score_post - defteam_score_post,
+        'ep': np.nan, 'epa': np.nan, 'wp': np.nan, 'def_wp': np.nan, 'home_wp': np.nan, 'away_wp': np.nan, 'wpa': np.nan,
+        'penalty': 0.0,
+        'safety': safety.astype(float),
+        'interception': interception.astype(float),
+        'touchdown': touchdown.astype(float),
+        'pass_touchdown': (touchdown & (o == 'td') & is_pass).astype(float),
+        'rush_touchdown': (touchdown & (o == 'td') & is_run).astype(float),
+        'return_touchdown': (touchdown & (o == 'return_td')).astype(float),
+        'extra_point_attempt': (play_type == 'extra_point').astype(float),
+        'two_point_attempt': two_point.astype(float),
+        'field_goal_attempt': (play_type == 'field_goal').astype(float),
+        'kickoff_attempt': is_kickoff.astype(float),
+        'punt_attempt': (play_type == 'punt').astype(float),
+        'complete_pass': complete_pass.astype(float),
+        'penalty_team': None,
+        'penalty_yards': np.nan,
+        'season': season[g],
+        'drive_ended_with_score': np.isin(o, ['td', 'fg']).astype(float),
+        'away_score': away_score_post[game_end][g].astype(float),
+        'home_score': home_score_post[game_end][g].astype(float),
+        'game_stadium': (teams[home] + ' Stadium')[g],
+        'roof': roof[g],
+        'surface': surface[g],
+        'weather': weather[g],
+        'wind': wind[g],
+        'temp': temp[g],
+        'kicker_player_name': np.where(kicker, np.array(KICKERS, dtype=object)[kicker_idx], None),
+    }
+    
+    # explicit dtypes, text columns stay object instead of being inferred as strings
+    dtypes = preset_dtypes()
+    return pd.DataFrame({c: pd.Series(np.full(n, v, dtype=object if dtypes[c] == 'object' else None) if np.ndim(v) == 0 else v,
+                                      dtype=dtypes[c], copy=False) for c, v in columns.items()})
+
+
+def _cumsum_by(values : np.ndarray, start : np.ndarray, length : np.ndarray):
+    '''Cumulative sum restarting at each group, groups are consecutive runs given by start and length'''
+    total = np.cumsum(values)
+    return total - np.repeat(total[start] - values[start], length)
@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+
+
+class FeatureEncoder():
+    '''
+    One-hot encoder with a fixed output layout.
+    Fit once on the features of a preprocessing step, after which any batch of plays is encoded into the same columns
+    regardless of which categories are present in the batch. The layout equals the pd.get_dummies output of the fit data:
+    continuous features first, followed by the dummy columns of each categorical feature.
+    
+    Usage:
+        encoder = FeatureEncoder()
+        X, y = preprocess_field_goal(data_train, return_X_y=True, encoder=encoder)  # fits the encoder
+        X_live = preprocess_field_goal(data_live, encoder=encoder)  # same columns as X
+    '''
+    
+    def __init__(self):
+        self.continuous = []
+        self.categoricals = []
+        self.categories = {}
+        self.unknown = {}
+        self.feature_names = []
+        self.fitted = False
+        self._lookup = []
+    
+    def fit(self, data : pd.DataFrame, continuous : list, categoricals : list, unknown : dict = {}):
+        '''
+        Fit encoder to the categories present in data.
+        
+        Parameters:
+            data (DataFrame): Features before one-hot encoding
+            continuous (list): Continuous features, passed through as is
+            categoricals (list): Categorical features to one-hot encode
+            unknown (dict): Fallback category for values not seen in fit, by feature. Unknown values of other features are encoded as all zeros
+        
+        Returns:
+            self: FeatureEncoder object
+        '''
+        self.continuous = list(continuous)
+        self.categoricals = list(categoricals)
+        self.unknown = dict(unknown)
+        
+        # same categories and order as pd.get_dummies
+        self.categories = {}
+        for c in self.categoricals:
+            values = data[c].dropna().unique()
+            self.categories[c] = np.sort(np.asarray(values, dtype=None if data[c].dtype.kind in 'biuf' else object))
+        
+        self._build()
+        return self
+    
+    def _build(self):
+        '''Build feature names and category lookups from the fitted categories'''
+        self.feature_names = list(self.continuous)
+        self._lookup = []
+        offset = len(self.continuous)
+        for c in self.categoricals:
+            categories = self.categories[c]
+            self.feature_names += [f'{c}_{v}' for v in categories]
+            
+            # string categories are searched as fixed width unicode arrays
+            is_str = categories.dtype.kind == 'O'
+            if is_str: categories = categories.astype(str)
+            fallback = None
+            if c in self.unknown and self.unknown[c] in categories:
+                fallback = int(np.flatnonzero(categories == self.unknown[c])[0])
+            self._lookup.append((c, categories, offset, is_str, fallback))
+            offset += len(categories)
+        
+        self.fitted = True
+    
+    def to_dict(self):
+        '''Fitted state as a JSON serializable dict'''
+        return {
+            'continuous': self.continuous,
+            'categoricals': self.categoricals,
+            'categories': {c: v.tolist() for c, v in self.categories.items()},
+            'dtypes': {c: v.dtype.str for c, v in self.categories.items()},
+            'unknown': self.unknown,
+        }
+    
+    @classmethod
+    def from_dict(cls, state : dict):
+        '''Create a fitted encoder from the output of to_dict'''
+        encoder = cls()
+        encoder.continuous = state['continuous']
+        encoder.categoricals = state['categoricals']
+        encoder.unknown = state['unknown']
+        encoder.categories = {c: np.array(v, dtype=np.dtype(state['dtypes'][c])) for c, v in state['categories'].items()}
+        encoder._build()
+        return encoder
+    
+    def transform(self, data, out : np.ndarray = None, dtype = np.float64):
+        '''
+        Encode features into the fitted layout.
+        
+        Parameters:
+            data (DataFrame or dict): Features before one-hot encoding, as a DataFrame or a dict of arrays.
+                A DataFrame that is already one-hot encoded (e.g. pd.get_dummies output) is realigned to the fitted layout
+            out (ndarray): Preallocated array of shape (rows, len(feature_names)) to write to, default None for a new array
+            dtype: dtype of the returned array if out is not given, default float64
+        
+        Returns:
+            ndarray of shape (rows, len(feature_names))
+        '''
+        if not self.fitted: raise Exception('Encoder is not fitted, call .fit() first.')
+        
+        if isinstance(data, pd.DataFrame) and not any(c in data.columns for c in self.categoricals):
+            # already encoded, missing dummy columns are categories not present in the batch
+            encoded = data.reindex(columns=self.feature_names, fill_value=0).to_numpy(dtype=dtype if out is None else out.dtype)
+            if out is None: return encoded
+            out[:] = encoded
+            return out
+        
+        n = len(data[self.continuous[0] if len(self.continuous) != 0 else self.categoricals[0]])
+        if out is None: out = np.empty((n, len(self.feature_names)), dtype=dtype)
+        elif out.shape != (n, len(self.feature_names)): raise Exception(f'out must be of shape {(n, len(self.feature_names))}, got {out.shape}')
+        
+        for i, c in enumerate(self.continuous):
+            out[:, i] = np.asarray(data[c])
+        
+        out[:, len(self.continuous):] = 0
+        for c, categories, offset, is_str, fallback in self._lookup:
+            if len(categories) == 0: continue
+            
+            values = np.asarray(data[c])
+            if is_str: values = values.astype(str)
+            
+            # position of each value in the sorted categories
+            position = np.minimum(np.searchsorted(categories, values), len(categories) - 1)
+            found = categories[position] == values
+            
+            if fallback is not None:
+                position[~found] = fallback
+                found[:] = True
+            
+            rows = np.flatnonzero(found)
+            out[rows, offset + position[rows]] = 1
+        
+        return out
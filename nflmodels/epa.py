@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+from nflmodels.preprocessing import NEXT_SCORE_VALUES, EP_CONTINUOUS, EP_CATEGORICALS, _game_order
+from nflmodels.profiling import stage, profiled
+
+
+@profiled('expected_points_added')
+def expected_points_added(data : pd.DataFrame, model, chunksize : int = 2**20, verbose : bool = True):
+    '''
+    Expected points before each play and expected points added by the play, from a fitted EPModel.
+    States before all plays are scored in batches, expected points are the predicted probabilities times NEXT_SCORE_VALUES.
+    The state after a play is the state before the next play of the same game half:
+        
+        - scoring plays: EPA is the points scored by the team in possession (negative for the opponent) minus EP
+        - change of possession: the next play's EP is negated, as it is seen from the other team
+        - last play of a half: EP after the play is zero
+    
+    Extra point and two point attempts are not modeled by EPModel (see preprocess_ep) and get no EP, touchdowns are worth 6 points.
+    If data has the nflverse ep and epa columns, their correlation with the computed values is printed.
+        
+        Parameters:
+            data (DataFrame): nflverse play-by-play data, e.g. one or more full seasons
+            model (EPModel): Fitted model, on preprocess_ep features
+            chunksize (int): Number of plays scored at a time, default 2**20
+            verbose (bool): Print progress messages? default True
+        
+        Returns:
+            DataFrame with ep and epa columns, indexed like data. Rows without a valid state (e.g. timeouts) are NaN
+    '''
+    
+    if verbose: print(f'Computing EPA for {len(data)} rows...')
+    
+    # valid states in game order, extra point attempts are left out so that the play after a try is the following kickoff
+    with stage('order') as s:
+        pat = (data['extra_point_attempt'].to_numpy(dtype=np.float64, na_value=np.nan) == 1) | \
+              (data['two_point_attempt'].to_numpy(dtype=np.float64, na_value=np.nan) == 1)
+        keep = data['posteam'].notna().to_numpy() & data['yardline_100'].notna().to_numpy() & ~pat
+        positions = _game_order(data, np.flatnonzero(keep))
+        s.rows = len(positions)
+    
+    # ========================= EP before each play =========================
+    
+    points = np.array([NEXT_SCORE_VALUES[str(c)] for c in model.classifier.classes_], dtype=np.float64)
+    features = data.columns.get_indexer(EP_CONTINUOUS + EP_CATEGORICALS)
+    if np.any(features < 0): raise Exception(f'data is missing EP features {[c for c, i in zip(EP_CONTINUOUS + EP_CATEGORICALS, features) if i < 0]}')
+    
+    ep = np.empty(len(positions))
+    for start in range(0, len(positions), chunksize):
+        X = data.iloc[positions[start:start + chunksize], features]
+        ep[start:start + chunksize] = model.predict_proba(_ep_features(model, X)) @ points
+    
+    # ========================= EP after each play =========================
+    
+    with stage('epa', rows=len(positions)):
+        def column(name, dtype=None):
+            if dtype is None: return data[name].to_numpy()[positions]
+            return data[name].to_numpy(dtype=dtype, na_value=np.nan)[positions]
+        
+        game_id, game_half, posteam = column('game_id'), column('game_half'), column('posteam')
+        
+        # next state in the same game half, none for the last play of a half
+        has_next = np.zeros(len(positions), dtype=bool)
+        has_next[:-1] = (game_id[1:] == game_id[:-1]) & (game_half[1:] == game_half[:-1])
+        
+        ep_after = np.zeros(len(positions))
+        next_ep = np.append(ep[1:], 0)
+        same_team = np.append(posteam[1:] == posteam[:-1], True)
+        ep_after[has_next] = np.where(same_team, next_ep, -next_ep)[has_next]
+        
+        # points scored on the play by the team in possession
+        score_gained = column('score_differential_post', np.float64) - column('score_differential', np.float64)
+        scoring = (column('sp', np.float64) == 1) & ~np.isnan(score_gained)
+        
+        epa = np.where(scoring, score_gained, ep_after) - ep
+    
+    result = pd.DataFrame({'ep': np.nan, 'epa': np.nan}, index=data.index)
+    result.iloc[positions, 0] = ep
+    result.iloc[positions, 1] = epa
+    
+    if verbose:
+        print(f'Computed EPA for {len(positions)} plays')
+        for c in ['ep', 'epa']:
+            if c not in data.columns: continue
+            computed, nflverse = result[c].to_numpy(), data[c].to_numpy(dtype=np.float64, na_value=np.nan)
+            both = ~np.isnan(computed) & ~np.isnan(nflverse)
+            if both.sum() < 2: continue
+            print('{}: correlation with nflverse {:.3f}, mean absolute difference {:.3f} over {} plays'.format(
+                c, np.corrcoef(computed[both], nflverse[both])[0, 1], np.abs(computed[both] - nflverse[both]).mean(), both.sum()))
+    
+    return result
+
+
+def _ep_features(model, X : pd.DataFrame):
+    '''Features of EPModel, raw features for a model with an encoder and otherwise pd.get_dummies aligned to the fitted columns'''
+    if model.encoder is not None: return X
+    
+    columns = getattr(model.classifier, 'feature_names_in_', None)
+    if columns is None: raise Exception('Model was fitted without feature names, fit it on a DataFrame or with a FeatureEncoder.')
+    return pd.get_dummies(X, columns=EP_CATEGORICALS).reindex(columns=columns, fill_value=0)
@@ -0,0 +1,240 @@
+import json
+import os
+import numpy as np
+from nflmodels.profiling import stage
+
+
+class LookupTable():
+    '''
+    Dense table of the output of a fitted model over a discretized grid of game states, for answering repeated queries without the classifier.
+    Each axis of the table is a model feature with its grid values. Discrete axes are looked up at the nearest grid value (categories must match exactly),
+    interpolated axes (e.g. the game clock) linearly between the neighbouring grid values. Values outside an axis are clipped to its range.
+    Features that follow from the axes (e.g. the quarter from the game clock) are derived when the table is built and are not part of a query.
+    
+    Tables are saved as raw .npy arrays and memory-mapped on load, a lookup reads only the cells it needs.
+    
+    Usage:
+        table = ep_table(model)  # evaluates the model over the grid once, reports the maximum error against the model
+        table.save('tables/ep')
+        table = LookupTable.load('tables/ep')
+        ep = table.lookup({'yardline_100': [75], 'ydstogo': [10], 'down': [1], 'qtr': [1], 'quarter_seconds_remaining': [810],
+                           'posteam_type': ['home'], 'posteam_timeouts_remaining': [3], 'defteam_timeouts_remaining': [3]})
+    '''
+    
+    def __init__(self, axes : dict, interpolate : list = [], values : np.ndarray = None, max_error : float = None):
+        '''
+        Parameters:
+            axes (dict): Sorted grid values of each axis feature, in the order of the table dimensions
+            interpolate (list): Axes interpolated linearly between grid values, these must be numeric
+            values (ndarray): Table of shape (len(axis) for axis in axes), default None for an empty table
+            max_error (float): Maximum absolute error against the model, default None if not measured
+        '''
+        self.axes = {c: np.asarray(v) for c, v in axes.items()}
+        self.interpolate = list(interpolate)
+        self.shape = tuple(len(v) for v in self.axes.values())
+        self.values = values if values is not None else np.zeros(self.shape, dtype=np.float32)
+        self.max_error = max_error
+        
+        # flat index strides of the axes and the midpoints between discrete grid values, nearest values are found between the midpoints
+        self._strides = np.cumprod((self.shape + (1,))[:0:-1])[::-1]
+        self._midpoints = {c: (v[1:] + v[:-1]) / 2 for c, v in self.axes.items() if v.dtype.kind in 'biuf' and c not in self.interpolate}
+        
+        for c in self.interpolate:
+            if c not in self.axes: raise Exception(f'Interpolated axis {c} is not an axis of the table')
+            if self.axes[c].dtype.kind not in 'biuf' or len(self.axes[c]) < 2: raise Exception(f'Interpolated axis {c} must have at least two numeric values')
+        if self.values.shape != self.shape: raise Exception(f'values must be of shape {self.shape}, got {self.values.shape}')
+    
+    @classmethod
+    def build(cls, model, axes : dict, value, interpolate : list = [], derived : dict = {},
+              chunksize : int = 2**18, n_check : int = 10000, random_state : int = 0, verbose : bool = True):
+        '''
+        Evaluate a fitted model over the full grid of axes.
+        
+        Parameters:
+            model (NFLModel): Fitted model with a FeatureEncoder, so that states can be passed as dicts of feature values
+            axes (dict): Grid values of each axis feature
+            value (callable): Function of the model and its predicted probabilities returning one value per row, e.g. expected_points
+            interpolate (list): Axes interpolated linearly between grid values
+            derived (dict): Functions computing the other model features from a dict of axis values, by feature
+            chunksize (int): Number of grid states predicted at a time, default 2**18
+            n_check (int): Number of random states within the grid range compared against the model for max_error, default 10000. 0 to skip
+            random_state (int): Seed for the random states, default 0
+            verbose (bool): Print progress messages? default True
+        
+        Returns:
+            table (LookupTable)
+        '''
+        if model.encoder is None: raise Exception('Lookup tables require a model fitted with a FeatureEncoder.')
+        missing = [f for f in model.encoder.continuous + model.encoder.categoricals if f not in axes and f not in derived]
+        if len(missing) != 0: raise Exception(f'No axis or derived function for model features {missing}')
+        
+        table = cls(axes, interpolate=interpolate)
+        size = int(np.prod(table.shape))
+        if verbose: print(f'Building lookup table of {size} states over {list(table.axes)}...')
+        
+        flat = table.values.reshape(-1)
+        with stage('build', rows=size):
+            for start in range(0, size, chunksize):
+                cells = np.arange(start, min(start + chunksize, size))
+                index = np.unravel_index(cells, table.shape)
+                states = {c: v[i] for (c, v), i in zip(table.axes.items(), index)}
+                flat[cells] = value(model, model.predict_proba(_derive(states, derived)))
+        
+        if n_check > 0:
+            table.max_error = table.error(model, value, derived=derived, n=n_check, random_state=random_state)
+            if verbose: print(f'Maximum absolute error against the model over {n_check} random states: {table.max_error:.5f}')
+        
+        return table
+    
+    def lookup(self, states):
+        '''
+        Table values of game states.
+        
+        Parameters:
+            states (DataFrame or dict): Values of each axis feature, as arrays or scalars
+        
+        Returns:
+            ndarray of table values, one per state
+        '''
+        n = max(np.size(states[c]) for c in self.axes)
+        
+        # flat index of the lower corner and the interpolation weight along each interpolated axis
+        base = np.zeros(n, dtype=np.int64)
+        corners = []
+        for (c, grid), stride in zip(self.axes.items(), self._strides):
+            values = np.broadcast_to(np.asarray(states[c]), (n,))
+            
+            if c in self.interpolate:
+                position = np.interp(values.astype(np.float64), grid, np.arange(len(grid)))
+                lower = np.minimum(position.astype(np.int64), len(grid) - 2)
+                base += lower * stride
+                corners.append((stride, position - lower))
+            elif c in self._midpoints:
+                base += np.searchsorted(self._midpoints[c], values) * stride
+            else:
+                position = np.minimum(np.searchsorted(grid, values), len(grid) - 1)
+                if not np.all(grid[position] == values):
+                    raise Exception(f'Unknown values for {c}: {np.unique(values[grid[position] != values])}, expected one of {grid}')
+                base += position * stride
+        
+        flat = self.values.reshape(-1)
+        result = np.zeros(n)
+        # weighted sum over the 2^k corners of the interpolated axes
+        for corner in range(2 ** len(corners)):
+            offset = np.zeros(n, dtype=np.int64)
+            weight = np.ones(n)
+            for bit, (stride, w) in enumerate(corners):
+                if corner >> bit & 1:
+                    offset += stride
+                    weight *= w
+                else:
+                    weight *= 1 - w
+            result += weight * flat[base + offset]
+        return result
+    
+    def error(self, model, value, derived : dict = {}, n : int = 10000, random_state : int = 0):
+        '''
+        Maximum absolute error of the table against the model over n random states within the grid range.
+        Discrete axes are sampled from their grid values, interpolated axes uniformly between their first and last grid value.
+        '''
+        rng = np.random.default_rng(random_state)
+        states = {}
+        for c, grid in self.axes.items():
+            if c in self.interpolate: states[c] = rng.uniform(grid[0], grid[-1], n)
+            else: states[c] = grid[rng.integers(len(grid), size=n)]
+        
+        expected = value(model, model.predict_proba(_derive(states, derived)))
+        return float(np.max(np.abs(self.lookup(states) - expected)))
+    
+    def save(self, path : str):
+        '''Save the table to directory path, the values as a raw .npy array and the axes in a JSON file'''
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'values.npy'), np.ascontiguousarray(self.values), allow_pickle=False)
+        with open(os.path.join(path, 'table.json'), 'w') as f:
+            json.dump({'axes': {c: v.tolist() for c, v in self.axes.items()}, 'dtypes': {c: v.dtype.str for c, v in self.axes.items()},
+                       'interpolate': self.interpolate, 'max_error': self.max_error}, f)
+    
+    @classmethod
+    def load(cls, path : str, mmap : bool = True):
+        '''Load a table saved with save(), the values are memory-mapped unless mmap = False'''
+        with open(os.path.join(path, 'table.json')) as f:
+            meta = json.load(f)
+        axes = {c: np.array(v, dtype=np.dtype(meta['dtypes'][c])) for c, v in meta['axes'].items()}
+        values = np.load(os.path.join(path, 'values.npy'), mmap_mode='r' if mmap else None)
+        return cls(axes, interpolate=meta['interpolate'], values=values, max_error=meta['max_error'])
+
+
+def expected_points(model, proba : np.ndarray):
+    '''Expected points of EPModel probabilities, the probability weighted NEXT_SCORE_VALUES'''
+    from nflmodels.preprocessing import NEXT_SCORE_VALUES
+    return proba @ np.array([NEXT_SCORE_VALUES[str(c)] for c in model.classifier.classes_], dtype=np.float64)
+
+
+def make_probability(model, proba : np.ndarray):
+    '''Probability of a made kick from FieldGoalModel probabilities'''
+    return proba[:, list(model.classifier.classes_).index(1)]
+
+
+def ep_table(model, seconds_step : int = 60, max_ydstogo : int = 25, **kwargs):
+    '''
+    Expected points lookup table of a fitted EPModel (preprocess_ep features, fitted with a FeatureEncoder).
+    Axes are yardline_100 1-99, ydstogo 1-max_ydstogo, down, qtr 1-4, quarter_seconds_remaining (interpolated), posteam_type and timeouts.
+    The clock is interpolated within quarters, which have no discontinuities of the clock features.
+    goal_to_go, half_seconds_remaining and game_seconds_remaining are derived from these, overtime is not covered.
+    At grid states the table equals the model, between them the error of interpolating the clock at the default seconds_step is below 0.01 points.
+    
+    Parameters:
+        model (EPModel): Fitted model
+        seconds_step (int): Grid step of quarter_seconds_remaining in seconds, default 60
+        max_ydstogo (int): Largest ydstogo in the grid, longer distances are looked up at max_ydstogo. Default 25
+        **kwargs: Passed to LookupTable.build
+    
+    Returns:
+        table (LookupTable)
+    '''
+    categories = model.encoder.categories
+    axes = {
+        'yardline_100': np.arange(1, 100),
+        'ydstogo': np.arange(1, max_ydstogo + 1),
+        'down': categories['down'],
+        'qtr': categories['qtr'][categories['qtr'] <= 4],
+        'quarter_seconds_remaining': np.unique(np.append(np.arange(0, 900, seconds_step), 900)).astype(np.float64),
+        'posteam_type': categories['posteam_type'],
+        'posteam_timeouts_remaining': categories['posteam_timeouts_remaining'],
+        'defteam_timeouts_remaining': categories['defteam_timeouts_remaining'],
+    }
+    
+    derived = {
+        'goal_to_go': lambda s: (s['ydstogo'] >= s['yardline_100']).astype(np.float64),
+        'half_seconds_remaining': lambda s: (s['qtr'] % 2 == 1) * 900 + s['quarter_seconds_remaining'],
+        'game_seconds_remaining': lambda s: (4 - s['qtr']) * 900 + s['quarter_seconds_remaining'],
+    }
+    return LookupTable.build(model, axes, expected_points, interpolate=['quarter_seconds_remaining'], derived=derived, **kwargs)
+
+
+def field_goal_table(model, max_wind : int = 40, **kwargs):
+    '''
+    Make probability lookup table of a fitted FieldGoalModel (preprocess_field_goal features, fitted with a FeatureEncoder).
+    Axes are yardline_100 1-99 and, if used by the model, closed, wind 0-max_wind and kicker_player_name.
+    All axes are discrete, for states on the grid the table equals the model up to float32 rounding.
+    
+    Parameters:
+        model (FieldGoalModel): Fitted model
+        max_wind (int): Largest wind speed in the grid, stronger winds are looked up at max_wind. Default 40
+        **kwargs: Passed to LookupTable.build
+    
+    Returns:
+        table (LookupTable)
+    '''
+    features = model.encoder.continuous + model.encoder.categoricals
+    grids = {'yardline_100': np.arange(1, 100), 'closed': np.array([0, 1]), 'wind': np.arange(0, max_wind + 1)}
+    axes = {f: grids[f] if f in grids else model.encoder.categories[f] for f in features}
+    return LookupTable.build(model, axes, make_probability, **kwargs)
+
+
+def _derive(states : dict, derived : dict):
+    '''Axis states with the derived features added'''
+    states = dict(states)
+    for c, f in derived.items():
+        states[c] = f(states)
+    return states
@@ -0,0 +1,180 @@
+import numpy as np
+from dataclasses import dataclass, asdict
+
+
+@dataclass
+class Metrics():
+    '''Validation metrics of a classifier, predictions are the most probable classes'''
+    roc_auc : float
+    f1 : float
+    mse : float
+    log_loss : float
+    accuracy : float
+    n : int
+    
+    def to_dict(self):
+        return asdict(self)
+    
+    def __str__(self):
+        return 'ROC AUC: {:.3f}\nF1 score: {:.3f}\nMSE: {:.3f}\nLog loss: {:.3f}\nAccuracy: {:.3f}'.format(
+            self.roc_auc, self.f1, self.mse, self.log_loss, self.accuracy)
+
+
+class MetricsAccumulator():
+    '''
+    Streaming computation of Metrics over chunks of predicted probabilities.
+    Only fixed size counts are kept: a confusion matrix, the log loss sum and per class histograms of the predicted probabilities.
+    ROC AUC is computed from the histograms and is exact up to the histogram resolution (bins).
+    For more than two classes, ROC AUC is the prevalence weighted one-vs-one average and F1 the support weighted average.
+    
+    Usage:
+        acc = MetricsAccumulator(model.classifier.classes_)
+        for X, y in chunks:
+            acc.update(y, model.predict_proba(X))
+        metrics = acc.result()
+    '''
+    
+    def __init__(self, classes, bins : int = 4096):
+        '''
+        Parameters:
+            classes (array-like): Class labels in the column order of the predicted probabilities (classifier.classes_)
+            bins (int): Number of probability bins for ROC AUC, default 4096
+        '''
+        self.classes = np.asarray(classes)
+        self.bins = bins
+        k = len(self.classes)
+        self.confusion = np.zeros((k, k), dtype=np.int64)
+        # histogram[a, t, b]: rows of true class t with probability of class a in bin b
+        self.histogram = np.zeros((k, k, bins), dtype=np.int64)
+        self.log_loss_sum = 0.0
+        self.n = 0
+        
+        self._order = np.argsort(self.classes)
+    
+    def update(self, y_true, y_pred_proba : np.ndarray):
+        '''
+        Add a chunk of true labels and predicted probabilities.
+        
+        Parameters:
+            y_true (array-like): True labels
+            y_pred_proba (ndarray): Predicted probabilities, one column per class
+        
+        Returns:
+            self: MetricsAccumulator object
+        '''
+        y_true = np.asarray(y_true).ravel()
+        y_pred_proba = np.asarray(y_pred_proba, dtype=np.float64)
+        k = len(self.classes)
+        
+        # class index of each label
+        sorted_classes = self.classes[self._order]
+        position = np.minimum(np.searchsorted(sorted_classes, y_true), k - 1)
+        if not np.all(sorted_classes[position] == y_true): raise Exception('y_true contains labels not in classes.')
+        t = self._order[position]
+        
+        p = np.argmax(y_pred_proba, axis=1)
+        self.confusion += np.bincount(t * k + p, minlength=k * k).reshape(k, k)
+        
+        eps = np.finfo(y_pred_proba.dtype).eps
+        self.log_loss_sum += -np.log(np.clip(y_pred_proba[np.arange(len(t)), t], eps, 1 - eps)).sum()
+        
+        b = np.minimum((y_pred_proba * self.bins).astype(np.int64), self.bins - 1)
+        for a in range(k):
+            self.histogram[a] += np.bincount(t * self.bins + b[:, a], minlength=k * self.bins).reshape(k, self.bins)
+        
+        self.n += len(t)
+        return self
+    
+    def result(self):
+        '''Metrics of all added chunks'''
+        if self.n == 0: raise Exception('No data, call .update() first.')
+        
+        k = len(self.classes)
+        support = self.confusion.sum(axis=1)
+        tp = np.diag(self.confusion)
+        
+        # F1 per class from the confusion matrix, weighted by support
+        predicted = self.confusion.sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            precision = np.where(predicted > 0, tp / predicted, 0)
+            recall = np.where(support > 0, tp / support, 0)
+            f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0)
+        f1 = (f1 * support).sum() / support.sum()
+        
+        # MSE of predicted labels, only defined for numeric labels
+        if self.classes.dtype.kind in 'biuf':
+            values = self.classes.astype(np.float64)
+            mse = (self.confusion * (values[:, None] - values[None, :]) ** 2).sum() / self.n
+        else:
+            mse = np.nan
+        
+        if k == 2:
+            roc_auc = self._auc(1, 1, 0)
+        else:
+            scores, weights = [], []
+            for a in range(k):
+                for c in range(a + 1, k):
+                    if support[a] == 0 or support[c] == 0: continue
+                    scores.append((self._auc(a, a, c) + self._auc(c, c, a)) / 2)
+                    weights.append(support[a] + support[c])
+            roc_auc = np.average(scores, weights=weights) if len(scores) != 0 else np.nan
+        
+        return Metrics(roc_auc=float(roc_auc), f1=float(f1), mse=float(mse), log_loss=self.log_loss_sum / self.n,
+                       accuracy=tp.sum() / self.n, n=self.n)
+    
+    def _auc(self, score_class, positive, negative):
+        '''ROC AUC of the probability of score_class, separating true class positive from negative'''
+        pos = self.histogram[score_class, positive]
+        neg = self.histogram[score_class, negative]
+        if pos.sum() == 0 or neg.sum() == 0: return np.nan
+        # negatives in lower bins rank below, ties within a bin count as half
+        below = np.cumsum(neg) - neg
+        return (pos * (below + neg / 2)).sum() / (pos.sum() * neg.sum())
+
+
+def evaluate(model, X, y, chunksize : int = None):
+    '''
+    Metrics of a fitted NFLModel from a single predict_proba pass.
+    
+    Parameters:
+        model (NFLModel): Fitted model
+        X (DataFrame, ndarray or dict of arrays): Features
+        y (array-like): True labels
+        chunksize (int): Predict in chunks of this many rows, default None for a single chunk
+    
+    Returns:
+        Metrics
+    '''
+    y = np.asarray(y).ravel()
+    if chunksize is None: chunksize = max(1, len(y))
+    
+    def chunks():
+        for i in range(0, len(y), chunksize):
+            yield _rows(X, slice(i, i + chunksize)), y[i:i + chunksize]
+    
+    return evaluate_chunks(model, chunks())
+
+
+def evaluate_chunks(model, chunks):
+    '''
+    Metrics of a fitted NFLModel over an iterable of (X, y) chunks, e.g. preprocessed PgLoader.load_iter chunks.
+    Predictions of only one chunk are held in memory at a time.
+    
+    Parameters:
+        model (NFLModel): Fitted model
+        chunks (iterable): (X, y) pairs
+    
+    Returns:
+        Metrics
+    '''
+    accumulator = MetricsAccumulator(model.classifier.classes_)
+    for X, y in chunks:
+        accumulator.update(y, model.predict_proba(X))
+    return accumulator.result()
+
+
+def _rows(X, rows : slice):
+    '''Positional rows of a DataFrame, array or dict of arrays'''
+    if isinstance(X, dict): return {c: v[rows] for c, v in X.items()}
+    if hasattr(X, 'iloc'): return X.iloc[rows]
+    return X[rows]
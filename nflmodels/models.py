@@ -1,88 +1,327 @@
+import hashlib
+import json
+import os
 import numpy as np
 import pandas as pd
-from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import roc_auc_score, mean_squared_error, log_loss, f1_score, RocCurveDisplay
-import xgboost as xgb
+from nflmodels.encoder import FeatureEncoder
+from nflmodels.profiling import stage
+
+# xgboost and sklearn are imported where they are used, importing them takes most of the import time of this module
+
+# version of the saved artifact layout, bumped on incompatible changes
+ARTIFACT_VERSION = 1
+
+# largest allowed increase of validation log loss of a weekly update or refit over a full refit (checked by the tests and benchmarks)
+UPDATE_LOG_LOSS_TOLERANCE = 0.01
 
 class NFLModel():
     
     def __init__(self):
         self.classifier = None
+        self.encoder = None
+        self.labels = None
     
     def clf(self):
         '''Alias for getting the classifier'''
         return self.classifier
     
-    def fit(self, X_train : pd.DataFrame, y_train : pd.DataFrame):
-        '''Fit model to data, wrapper around the underlying fit function (equivalent to calling model.classifier.fit(x, y))'''
-        self.classifier.fit(X_train, y_train)
+    def fit(self, X_train : pd.DataFrame, y_train : pd.DataFrame, encoder = None, labels = None):
+        '''
+        Fit model to data, wrapper around the underlying fit function (equivalent to calling model.classifier.fit(x, y))
+        If a fitted FeatureEncoder is given, it is stored with the model and all features passed to fit and predict are encoded with it
+        Labels (e.g. play_types from preprocess_next_play) are the names of the target classes and are stored with the model
+        '''
+        if encoder is not None: self.encoder = encoder
+        if labels is not None: self.labels = list(labels)
+        with stage('fit', rows=len(y_train)):
+            self.classifier.fit(self._features(X_train), y_train)
+        
+    def update(self, X_new : pd.DataFrame, y_new : pd.DataFrame, n_estimators : int = 10, sample_weight = None, seasons = None, half_life : float = None):
+        '''
+        Supported models: XGBoost (NextPlayModel) only. LogisticRegression models (FieldGoalModel, EPModel) raise NotImplementedError, use refit.
+        
+        Update a fitted model with new data instead of refitting it from scratch, e.g. for a weekly refresh.
+        Boosting continues for n_estimators rounds from the existing booster on the new rows only,
+        the classes of the new rows may be a subset of the fitted classes.
+        A warm-started LogisticRegression fit on the new rows alone would not update the old fit but replace it with a fit of one week,
+        as lbfgs minimizes the loss of the rows it is given; it needs all training data, which is what refit(X_all, y_all) does.
+        
+        Parameters:
+            X_new (DataFrame): Features of the new rows, in the same layout as in fit
+            y_new (DataFrame or Series): Target of the new rows
+            n_estimators (int): Number of boosting rounds to add, default 10
+            sample_weight (array-like): Weight of each row, default None
+            seasons (array-like): Season of each row, used with half_life
+            half_life (float): Weight rows by 0.5 ** ((latest season - season) / half_life), default None for no time decay
+        
+        Returns:
+            self: NFLModel object
+        '''
+        if not type(self.classifier).__module__.startswith('xgboost'): 
+            raise NotImplementedError(f'update is only supported for XGBoost models, refit {type(self).__name__} on all training data with .refit(X_all, y_all).')
+        
+        import xgboost as xgb
+        y_new = np.asarray(y_new).ravel()
+        weights = _weights(sample_weight, seasons, half_life)
+        
+        with stage('update', rows=len(y_new)):
+            # trained with the fitted number of classes, so that weeks without some play types can be added
+            params = {k: v for k, v in self.classifier.get_xgb_params().items() if v is not None}
+            n_classes = len(self.classifier.classes_)
+            if n_classes > 2: params['num_class'] = n_classes
+            dtrain = xgb.DMatrix(self._features(X_new), label=y_new, weight=weights)
+            booster = xgb.train(params, dtrain, num_boost_round=n_estimators, xgb_model=self.classifier.get_booster())
+            self.classifier._Booster = booster
+            self.classifier.set_params(n_estimators=booster.num_boosted_rounds())
+        
+        return self
+    
+    def refit(self, X_all : pd.DataFrame, y_all : pd.DataFrame, warm_start : bool = True, max_iter : int = None,
+              sample_weight = None, seasons = None, half_life : float = None):
+        '''
+        Refit the model on all training data, e.g. the previous training data with the rows of a new week appended.
+        LogisticRegression models (FieldGoalModel, EPModel) are warm-started from the existing coefficients,
+        which converges in a few iterations when the data has changed little. XGBoost models are refit from scratch, see update.
+        
+        Parameters:
+            X_all (DataFrame): Features of all training rows, in the same layout as in fit
+            y_all (DataFrame or Series): Target of all training rows
+            warm_start (bool): Start from the fitted coefficients, LogisticRegression only, default True
+            max_iter (int): Maximum number of iterations, LogisticRegression only, default None for the classifier's max_iter
+            sample_weight (array-like): Weight of each row, default None
+            seasons (array-like): Season of each row, used with half_life
+            half_life (float): Weight rows by 0.5 ** ((latest season - season) / half_life), default None for no time decay
+        
+        Returns:
+            self: NFLModel object
+        '''
+        y_all = np.asarray(y_all).ravel()
+        weights = _weights(sample_weight, seasons, half_life)
+        
+        with stage('refit', rows=len(y_all)):
+            if type(self.classifier).__module__.startswith('xgboost'):
+                self.classifier.fit(self._features(X_all), y_all, sample_weight=weights)
+            else:
+                params = self.classifier.get_params()
+                self.classifier.set_params(warm_start=warm_start, max_iter=max_iter if max_iter is not None else params['max_iter'])
+                try:
+                    self.classifier.fit(self._features(X_all), y_all, sample_weight=weights)
+                finally:
+                    self.classifier.set_params(warm_start=params['warm_start'], max_iter=params['max_iter'])
+        
+        return self
+    
+    def predict(self, X : pd.DataFrame):
+        '''Predict classes, wrapper around the underlying predict function'''
+        with stage('predict', rows=_n_rows(X)):
+            return self.classifier.predict(self._features(X))
+    
+    def predict_proba(self, X : pd.DataFrame):
+        '''Predict class probabilities, wrapper around the underlying predict_proba function'''
+        with stage('predict_proba', rows=_n_rows(X)):
+            return self.classifier.predict_proba(self._features(X))
         
     def validate(self, X_val : pd.DataFrame, y_val : pd.DataFrame):
-        '''Predict on supplied validation set and return predictions, don't call directly'''
-        y_pred = self.classifier.predict(X_val)
-        y_pred_proba = self.classifier.predict_proba(X_val)
+        '''Predict on validation set, print validation metrics and return predictions (y_pred, y_pred_proba)'''
+        from nflmodels.metrics import MetricsAccumulator
+        
+        # predictions are the most probable classes, from a single predict_proba pass
+        y_pred_proba = self.predict_proba(X_val)
+        y_pred = self.classifier.classes_[np.argmax(y_pred_proba, axis=1)]
+        
+        print('On validation set')
+        print(MetricsAccumulator(self.classifier.classes_).update(y_val, y_pred_proba).result())
+        
         return y_pred, y_pred_proba
+    
+    def evaluate(self, X_val, y_val, chunksize : int = None):
+        '''
+        Validation metrics as a Metrics object, see nflmodels.metrics.
+        With chunksize, predictions are made in chunks and only the metric counts are kept in memory.
+        '''
+        from nflmodels.metrics import evaluate
+        return evaluate(self, X_val, y_val, chunksize=chunksize)
         
     def fit_validate(self, X_train : pd.DataFrame, y_train : pd.DataFrame, X_val : pd.DataFrame, y_val : pd.DataFrame):
         '''Shorthand for fit().validate()'''
         self.fit(X_train, y_train)
         self.validate(X_val, y_val)
+    
+    def compile(self):
+        '''Compile the fitted model into a pure NumPy CompiledModel, for inference without sklearn or xgboost (see nflmodels.compiled)'''
+        from nflmodels.compiled import compile_model
+        return compile_model(self)
+    
+    def save(self, path : str):
+        '''
+        Save the fitted model as a new version in the artifact store at path.
+        Each version is a directory with a manifest (model type, parameters, feature schema, labels and file checksums)
+        and the classifier: XGBoost models in the native binary format, LogisticRegression coefficients as raw .npy arrays.
         
+        Parameters:
+            path (str): Artifact store directory
+            
+        Returns:
+            version (int): Saved version
+        '''
+        version = _latest_version(path) + 1
+        version_path = os.path.join(path, f'v{version}')
+        os.makedirs(version_path)
+        
+        manifest = {
+            'artifact_version': ARTIFACT_VERSION,
+            'model': type(self).__name__,
+            'labels': self.labels,
+            'encoder': self.encoder.to_dict() if self.encoder is not None else None,
+            'feature_names': list(self.encoder.feature_names) if self.encoder is not None 
+                else [str(f) for f in getattr(self.classifier, 'feature_names_in_', [])] or None,
+            'params': self.classifier.get_params(),
+        }
+        
+        if type(self.classifier).__module__.startswith('xgboost'):
+            manifest['classifier'] = 'xgboost'
+            self.classifier.save_model(os.path.join(version_path, 'classifier.ubj'))
+        else:
+            manifest['classifier'] = 'logistic_regression'
+            classes = self.classifier.classes_
+            arrays = {'coef': self.classifier.coef_, 'intercept': self.classifier.intercept_, 'n_iter': self.classifier.n_iter_,
+                      'classes': classes.astype(str) if classes.dtype.kind == 'O' else classes}
+            for name, array in arrays.items():
+                np.save(os.path.join(version_path, f'{name}.npy'), np.ascontiguousarray(array), allow_pickle=False)
+        
+        manifest['files'] = {f: _sha256(os.path.join(version_path, f)) for f in sorted(os.listdir(version_path))}
+        
+        with open(os.path.join(version_path, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, default=str)
+        
+        # latest pointer is written last, an interrupted save is never loaded by default
+        with open(os.path.join(path, 'latest'), 'w') as f:
+            f.write(str(version))
+        
+        return version
     
-class NextPlayModel(NFLModel):
+    @staticmethod
+    def load(path : str, version : int = None, verify : bool = True, mmap : bool = True):
+        '''
+        Load a model saved with save().
         
-    def __init__(self):
-        self.classifier = xgb.XGBClassifier(n_jobs=-1, n_estimators=100, learning_rate=0.1, eval_metric='mlogloss', min_child_weight=2)
+        Parameters:
+            path (str): Artifact store directory
+            version (int): Version to load, default None for the latest
+            verify (bool): Verify file checksums, default True
+            mmap (bool): Memory-map the coefficient arrays of LogisticRegression models, default True
+            
+        Returns:
+            model (NFLModel): Fitted model of the saved type
+        '''
+        if version is None:
+            with open(os.path.join(path, 'latest')) as f:
+                version = int(f.read())
+        version_path = os.path.join(path, f'v{version}')
         
-    def validate(self, X_val: pd.DataFrame, y_val: pd.DataFrame):
-        '''Predict on validation set and print validation metrics'''
+        with open(os.path.join(version_path, 'manifest.json')) as f:
+            manifest = json.load(f)
         
-        y_pred, y_pred_proba = super().validate(X_val, y_val)
+        if manifest['artifact_version'] != ARTIFACT_VERSION:
+            raise Exception(f'Unsupported artifact version {manifest["artifact_version"]}, expected {ARTIFACT_VERSION}')
         
-        print('On validation set')
-        print('ROC AUC: {:.3f}\nF1 score: {:.3f}\nMSE: {:.3f}\nLog loss: {:.3f}'.format(
-            roc_auc_score(pd.get_dummies(y_val, columns=y_val.columns.values), y_pred_proba, average='weighted', multi_class='ovo'), 
-            f1_score(y_val, y_pred, average='weighted'),
-            mean_squared_error(y_val, y_pred), 
-            log_loss(y_val, y_pred_proba))
-        )
+        if verify:
+            for file, checksum in manifest['files'].items():
+                if _sha256(os.path.join(version_path, file)) != checksum:
+                    raise Exception(f'Checksum mismatch for {file} in {version_path}')
         
-        return y_pred, y_pred_proba
+        models = {cls.__name__: cls for cls in NFLModel.__subclasses__()}
+        model = models[manifest['model']]()
+        model.labels = manifest['labels']
+        if manifest['encoder'] is not None: model.encoder = FeatureEncoder.from_dict(manifest['encoder'])
+        
+        if manifest['classifier'] == 'xgboost':
+            import xgboost as xgb
+            model.classifier = xgb.XGBClassifier()
+            model.classifier.load_model(os.path.join(version_path, 'classifier.ubj'))
+            model.classifier.set_params(**{k: v for k, v in manifest['params'].items() if k not in ('callbacks',)})
+        else:
+            from sklearn.linear_model import LogisticRegression
+            model.classifier = LogisticRegression(**manifest['params'])
+            arrays = {name: np.load(os.path.join(version_path, f'{name}.npy'), mmap_mode='r' if mmap else None) 
+                      for name in ['coef', 'intercept', 'n_iter', 'classes']}
+            model.classifier.coef_ = arrays['coef']
+            model.classifier.intercept_ = arrays['intercept']
+            model.classifier.n_iter_ = np.asarray(arrays['n_iter'])
+            model.classifier.classes_ = np.asarray(arrays['classes'])
+            model.classifier.n_features_in_ = arrays['coef'].shape[1]
+            if manifest['encoder'] is None and manifest['feature_names'] is not None:
+                model.classifier.feature_names_in_ = np.array(manifest['feature_names'], dtype=object)
+        
+        return model
+    
+    def _features(self, X):
+        '''Encode features with the stored encoder, so that the classifier always sees the same layout'''
+        if self.encoder is None or isinstance(X, np.ndarray): return X
+        return self.encoder.transform(X)
+        
+    
+class NextPlayModel(NFLModel):
+    
+    DEFAULT_PARAMS = {'n_jobs': -1, 'n_estimators': 100, 'learning_rate': 0.1, 'eval_metric': 'mlogloss', 'min_child_weight': 2}
+        
+    def __init__(self, **params):
+        '''Parameters are passed to XGBClassifier, overriding DEFAULT_PARAMS'''
+        super().__init__()
+        import xgboost as xgb
+        self.classifier = xgb.XGBClassifier(**{**self.DEFAULT_PARAMS, **params})
 
 
 class FieldGoalModel(NFLModel):
     
-    def __init__(self):
-        self.classifier = LogisticRegression(max_iter=1000)
-        
-    def validate(self, X_val: pd.DataFrame, y_val: pd.DataFrame):
-        '''Predict on validation set and print validation metrics'''
-        y_pred, y_pred_proba = super().validate(X_val, y_val)
-        
-        print('On validation set')
-        print('ROC AUC: {:.3f}\nMSE: {:.3f}\nLog loss: {:.3f}'.format(roc_auc_score(y_val, y_pred_proba[:,1]), 
-                                                                                 mean_squared_error(y_val, y_pred), 
-                                                                                 log_loss(y_val, y_pred_proba)))
-        
-        return y_pred, y_pred_proba
+    DEFAULT_PARAMS = {'max_iter': 1000}
+    
+    def __init__(self, **params):
+        '''Parameters are passed to LogisticRegression, overriding DEFAULT_PARAMS'''
+        super().__init__()
+        from sklearn.linear_model import LogisticRegression
+        self.classifier = LogisticRegression(**{**self.DEFAULT_PARAMS, **params})
 
 
 class EPModel(NFLModel):
+    
+    DEFAULT_PARAMS = {'max_iter': 10000}
         
-    def __init__(self):
-        self.classifier = LogisticRegression(max_iter=10000, n_jobs=-1)
-        
-    def validate(self, X_val: pd.DataFrame, y_val: pd.DataFrame):
-        '''Predict on validation set and print validation metrics'''
-        y_pred, y_pred_proba = super().validate(X_val, y_val)
-        
-        print('On validation set')
-        print('ROC AUC: {:.3f}\nF1 score: {:.3f}\nMSE: {:.3f}\nLog loss: {:.3f}'.format(
-            roc_auc_score(pd.get_dummies(y_val, columns=y_val.columns.values), y_pred_proba, average='weighted', multi_class='ovo'), 
-            f1_score(y_val, y_pred, average='weighted'),
-            mean_squared_error(y_val, y_pred), 
-            log_loss(y_val, y_pred_proba))
-        )
-        
-        return y_pred, y_pred_proba
-    
\ No newline at end of file
+    def __init__(self, **params):
+        '''Parameters are passed to LogisticRegression, overriding DEFAULT_PARAMS'''
+        super().__init__()
+        from sklearn.linear_model import LogisticRegression
+        self.classifier = LogisticRegression(**{**self.DEFAULT_PARAMS, **params})
+
+
+def _weights(sample_weight, seasons, half_life):
+    '''Row weights of update and refit, sample_weight times the time decay of half_life'''
+    weights = None if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+    if half_life is not None:
+        if seasons is None: raise Exception('seasons is required with half_life.')
+        seasons = np.asarray(seasons, dtype=np.float64)
+        decay = 0.5 ** ((seasons.max() - seasons) / half_life)
+        weights = decay if weights is None else weights * decay
+    return weights
+
+
+def _n_rows(X):
+    '''Number of rows of features, also for a dict of feature arrays'''
+    if isinstance(X, dict): return len(next(iter(X.values())))
+    return len(X)
+
+
+def _latest_version(path : str):
+    '''Latest saved version in the artifact store, 0 if there is none'''
+    if not os.path.isdir(path): return 0
+    versions = [int(d[1:]) for d in os.listdir(path) if d.startswith('v') and d[1:].isdigit()]
+    return max(versions, default=0)
+
+
+def _sha256(file : str):
+    '''Checksum of a file'''
+    h = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            h.update(block)
+    return h.hexdigest()
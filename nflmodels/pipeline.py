@@ -0,0 +1,172 @@
+import numpy as np
+import pandas as pd
+from nflmodels.profiling import stage
+
+
+# buffer column of each model feature that differs from the raw column of the same name, by model kind
+FEATURE_SOURCES = {
+    'next_play': {'posteam_type': 'posteam_home'},
+    'field_goal': {},
+    'ep': {},
+}
+
+# columns a row must have for the model to score it, in addition to its continuous features
+REQUIRED = {
+    'next_play': ['down', 'qtr', 'posteam_timeouts_remaining', 'defteam_timeouts_remaining'],
+    'field_goal': [],
+    'ep': ['posteam'],
+}
+
+MODEL_KINDS = {'NextPlayModel': 'next_play', 'FieldGoalModel': 'field_goal', 'EPModel': 'ep'}
+
+
+class ScoringPipeline():
+    '''
+    Scores one raw play-by-play batch with several models in one pass.
+    The features all models need are computed once from the raw frame into a shared columnar buffer (one array per feature),
+    and each model reads its features from the buffer as a dict of arrays, without copying or re-encoding the raw frame per model.
+    Features that the preprocessors derive (posteam_type as 0/1 for next play, closed and wind for field goals) are derived the same way.
+    Models must be fitted with a FeatureEncoder, so that the buffer columns are encoded into the fitted layout.
+    
+    Rows are scored by a model if its continuous features are present, like the dropna of its preprocessor.
+    Outputs, one or more columns per model and NaN for rows a model did not score:
+        NextPlayModel: probability of each play type, columns {name}_{play type}
+        FieldGoalModel: probability that a field goal attempted from the row's game state would be made, column {name}.
+            Every row with a yardline is scored, not only field goal attempts, e.g. for fourth down decisions.
+            Select the kicks with data['play_type'] == 'field_goal' to read it as the make probability of actual attempts
+        EPModel: expected points, column {name}
+    
+    Usage:
+        pipeline = ScoringPipeline().add(next_play_model).add(field_goal_model).add(ep_model)
+        scores = pipeline.score(data)
+    '''
+    
+    def __init__(self):
+        self.models = []
+    
+    def add(self, model, name : str = None):
+        '''
+        Register a fitted model.
+        
+        Parameters:
+            model (NFLModel): Fitted NextPlayModel, FieldGoalModel or EPModel with a FeatureEncoder
+            name (str): Name of the output column(s), default None for next_play, fg_prob or ep
+        
+        Returns:
+            self: ScoringPipeline object
+        '''
+        kind = MODEL_KINDS.get(type(model).__name__)
+        if kind is None: raise Exception(f'Unknown model type {type(model).__name__}, use one of {list(MODEL_KINDS)}')
+        if model.encoder is None: raise Exception(f'{type(model).__name__} must be fitted with a FeatureEncoder to be used in a pipeline.')
+        if name is None: name = {'next_play': 'next_play', 'field_goal': 'fg_prob', 'ep': 'ep'}[kind]
+        if name in [n for n, _, _ in self.models]: raise Exception(f'A model named {name} is already registered')
+        
+        self.models.append((name, kind, model))
+        return self
+    
+    def score(self, data : pd.DataFrame, verbose : bool = False):
+        '''
+        Score a raw play-by-play batch with all registered models.
+        
+        Parameters:
+            data (DataFrame): Raw play-by-play data
+            verbose (bool): Print progress messages? default False
+        
+        Returns:
+            DataFrame of model outputs, indexed like data
+        '''
+        if len(self.models) == 0: raise Exception('No models registered, call .add() first.')
+        
+        buffer = _Buffer(data)
+        results = []
+        
+        for name, kind, model in self.models:
+            encoder = model.encoder
+            sources = {f: FEATURE_SOURCES[kind].get(f, f) for f in encoder.continuous + encoder.categoricals}
+            
+            # the model's view of the buffer, rows are only taken if some cannot be scored
+            with stage('features', rows=len(data)):
+                valid = np.ones(len(data), dtype=bool)
+                for f in [sources[f] for f in encoder.continuous] + REQUIRED[kind]:
+                    valid &= buffer.present(f)
+                rows = None if valid.all() else np.flatnonzero(valid)
+                view = {f: buffer[s] if rows is None else buffer[s][rows] for f, s in sources.items()}
+            
+            n_rows = len(data) if rows is None else len(rows)
+            proba = model.predict_proba(view) if n_rows != 0 else None
+            results.append(_outputs(name, kind, model, proba, len(data), rows))
+            if verbose: print(f'Scored {n_rows} rows with {type(model).__name__} ({name})')
+        
+        return pd.concat(results, axis=1).set_axis(data.index, axis=0)
+
+
+class _Buffer():
+    '''Columnar feature buffer of a raw batch, each column is converted or derived once when first used'''
+    
+    def __init__(self, data : pd.DataFrame):
+        self.data = data
+        self.columns = {}
+        self._present = {}
+    
+    def __getitem__(self, column : str):
+        if column not in self.columns:
+            with stage('buffer', rows=len(self.data)):
+                if column in _DERIVED: values = _DERIVED[column](self)
+                else:
+                    series = self.data[column]
+                    values = series.to_numpy(dtype=np.float64, na_value=np.nan) if pd.api.types.is_numeric_dtype(series) else series.to_numpy()
+                self.columns[column] = values
+        return self.columns[column]
+    
+    def present(self, column : str):
+        '''Mask of rows where column is not missing'''
+        if column not in self._present: self._present[column] = ~pd.isna(self[column])
+        return self._present[column]
+
+
+def _posteam_home(buffer : _Buffer):
+    '''posteam_type as 1 for home and 0 for away, like preprocess_next_play'''
+    return pd.Series(buffer['posteam_type']).map({'home': 1, 'away': 0}).to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def _closed(buffer : _Buffer):
+    '''1 if the roof is closed, like preprocess_field_goal'''
+    return np.isin(buffer['roof'], ['closed', 'dome']).astype(np.float64)
+
+
+def _wind(buffer : _Buffer):
+    '''Wind speed, zero with a closed roof and parsed from the weather string where missing, like preprocess_field_goal'''
+    wind = np.where(buffer['closed'] == 1, 0, buffer.data['wind'].to_numpy(dtype=np.float64, na_value=np.nan))
+    missing = np.flatnonzero(np.isnan(wind))
+    if len(missing) != 0:
+        weather = buffer.data['weather'].iloc[missing].astype(object)
+        parsed = weather.str.split(' ').str[-2].str.replace(r'[^0-9]', '', regex=True)
+        wind[missing] = pd.to_numeric(parsed.replace('', None), errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    return wind
+
+
+_DERIVED = {'posteam_home': _posteam_home, 'closed': _closed, 'wind': _wind}
+
+
+def _outputs(name : str, kind : str, model, proba : np.ndarray, n : int, rows : np.ndarray):
+    '''Output columns of a model, NaN for rows the model did not score'''
+    classes = model.classifier.classes_
+    
+    if kind == 'next_play':
+        # integer encoded play types (map_target_to_int) are named with the stored labels
+        labels = [model.labels[c] if model.labels is not None and classes.dtype.kind in 'iu' else c for c in classes]
+        columns = [f'{name}_{label}' for label in labels]
+        values = proba
+    elif kind == 'field_goal':
+        columns = [name]
+        values = None if proba is None else proba[:, [list(classes).index(1)]]
+    else:
+        from nflmodels.preprocessing import NEXT_SCORE_VALUES
+        columns = [name]
+        values = None if proba is None else proba @ np.array([[NEXT_SCORE_VALUES[str(c)]] for c in classes], dtype=np.float64)
+    
+    out = np.full((n, len(columns)), np.nan)
+    if values is not None:
+        if rows is None: out[:] = values
+        else: out[rows] = values
+    return pd.DataFrame(out, columns=columns)
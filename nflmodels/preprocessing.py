@@ -1,8 +1,27 @@
+import inspect
+import json
+import os
+import shutil
 import numpy as np
 import pandas as pd
+from nflmodels.cache import _write_output, _read_output
+from nflmodels.profiling import stage, profiled
 
+# point value of each next scoring event of preprocess_ep, seen from the team in possession
+NEXT_SCORE_VALUES = {'td': 6, 'fg': 3, 'safety': 2, '2pat': 2, 'pat': 1,
+                     'opp_td': -6, 'opp_fg': -3, 'opp_safety': -2, 'opp_patreturn': -2,
+                     'no_score': 0}
 
-def preprocess_field_goal(data: pd.DataFrame, seasons = [], use_extra_points = True, use_wind = True, use_kickers = True, kickers = 'active', kicker_threshold = 100, return_X_y = False, verbose = True):
+# features of preprocess_ep and EPModel
+EP_CONTINUOUS = ['yardline_100', 'ydstogo', 'goal_to_go', 'half_seconds_remaining', 'game_seconds_remaining']
+EP_CATEGORICALS = ['qtr', 'down', 'posteam_type', 'posteam_timeouts_remaining', 'defteam_timeouts_remaining']
+
+# largest allowed peak memory of preprocess_ep above its input, as a fraction of the memory of the input data (checked by the tests and benchmarks)
+EP_PEAK_MEMORY_BUDGET = 0.25
+
+
+@profiled('preprocess_field_goal')
+def preprocess_field_goal(data: pd.DataFrame, seasons = [], use_extra_points = True, use_wind = True, use_kickers = True, kickers = 'active', kicker_threshold = 100, return_X_y = False, compact = False, encoder = None, verbose = True):
     '''
     Preprocesses nflverse play-by-play data for use in field goal prediction.
     Requires at least field_goal_result and yardline_100 columns to be present in the data.
@@ -16,6 +35,9 @@ def preprocess_field_goal(data: pd.DataFrame, seasons = [], use_extra_points = T
             kickers (str): "active" for currently active kickers, "all" for all kickers present in the dataset. Ignored if use_kickers == False
             kicker_threshold (int): How many attempts should a kicker have to be included individually. Ignored if use_kickers == False
             return_X_y (bool): Should the function return separate X and y data for features and target, returns complete DataFrame if False 
+            compact (bool): Downcast the output to compact dtypes (int8/int16/float32, uint8 dummies), default False
+            encoder (FeatureEncoder): Encode categoricals with a fixed layout instead of pd.get_dummies, an unfitted encoder is fit on this data. 
+                With a fitted encoder, kickers not seen in fit are encoded as "Other". Default None
             verbose (bool): Print progress messages? default True
         
         Returns:
@@ -41,11 +63,13 @@ def preprocess_field_goal(data: pd.DataFrame, seasons = [], use_extra_points = T
     # add play type to query
     if use_extra_points: query_string = add_to_query(query_string, '(play_type == "extra_point" or play_type == "field_goal")')
     else: query_string = add_to_query(query_string, 'play_type == "field_goal"')
-
+    
     # returns all features
-    data = data.query(query_string).copy()
-
-
+    with stage('query') as s:
+        data = data.query(query_string).copy()
+        s.rows = len(data)
+    
+    
     # ===== Process feature by feature =====
     
     # kick result
@@ -80,7 +104,7 @@ def preprocess_field_goal(data: pd.DataFrame, seasons = [], use_extra_points = T
                 'B.Maher', 'C.McLaughlin', 'B.McManus', 'E.McPherson', 'J.Myers', 'R.Patterson', 'E.Pineiro', 'M.Prater',
                 'J.Sanders', 'C.Santos', 'J.Slye', 'R.Succop', 'J.Tucker', 'T.Vizcaino', 'C.York', 'G.Zuerlein'
             ]
-
+            
             # all but active kickers to "Other"
             data['kicker_player_name'] = np.where(np.isin(data['kicker_player_name'], active_kickers), data['kicker_player_name'], 'Other')
         
@@ -91,8 +115,12 @@ def preprocess_field_goal(data: pd.DataFrame, seasons = [], use_extra_points = T
             raise Exception('Unknown value for parameter kickers, use "all" or "active"')
         
         # change kickers with fewer than threshold attempts to "Other"
-        kickers_few_atts = data.groupby(by='kicker_player_name')['kicker_player_name'].agg(['count']).query(f'count <= {kicker_threshold}').reset_index()['kicker_player_name'].to_numpy()
-        data['kicker_player_name'] = np.where(data['kicker_player_name'].isin(kickers_few_atts), 'Other', data['kicker_player_name'])
+        # a fitted encoder already knows the included kickers, the attempt counts of a small batch would be meaningless
+        if encoder is None or not encoder.fitted:
+            kickers_few_atts = data.groupby(by='kicker_player_name')['kicker_player_name'].agg(['count']).query(f'count <= {kicker_threshold}').reset_index()['kicker_player_name'].to_numpy()
+            data['kicker_player_name'] = np.where(data['kicker_player_name'].isin(kickers_few_atts), 'Other', data['kicker_player_name'])
+        
+        if compact: data['kicker_player_name'] = data['kicker_player_name'].astype('category')
         
         features.append('kicker_player_name')
         categoricals.append('kicker_player_name')
@@ -103,7 +131,12 @@ def preprocess_field_goal(data: pd.DataFrame, seasons = [], use_extra_points = T
     
     
     # ===== Encode categoricals =====
-    data = pd.get_dummies(data=data, columns=categoricals)
+    continuous = [f for f in features if f != 'kick_result' and f not in categoricals]
+    with stage('get_dummies', rows=len(data)):
+        data = _encode(data, continuous, categoricals, encoder=encoder, compact=compact, unknown={'kicker_player_name': 'Other'})
+    
+    if compact:
+        with stage('compact', rows=len(data)): (data,) = _compact(data, verbose=verbose)
     
     
     if return_X_y:
@@ -111,9 +144,10 @@ def preprocess_field_goal(data: pd.DataFrame, seasons = [], use_extra_points = T
     return data
     
     
+@profiled('preprocess_next_play')
 def preprocess_next_play(data : pd.DataFrame, seasons = [], 
             include_pass = True, include_run = True, include_fg = True, include_punt = True, include_qbkneel = False, include_qbspike = False, 
-            return_X_y = False, map_target_to_int = False, verbose=True):
+            return_X_y = False, map_target_to_int = False, compact = False, encoder = None, verbose=True):
     '''
     Preprocesses nflverse play-by-play data for use in next play prediction.
     
@@ -128,6 +162,8 @@ def preprocess_next_play(data : pd.DataFrame, seasons = [],
             include_qbspike (bool): Use qb_spike play type, default False
             return_X_y (bool): Should the function return separate X and y data for features and target, returns complete DataFrame if False 
             map_target_to_int (bool): Encode playtype as integer, default False
+            compact (bool): Downcast the output to compact dtypes (int8/int16/float32, uint8 dummies, categorical target), default False
+            encoder (FeatureEncoder): Encode categoricals with a fixed layout instead of pd.get_dummies, an unfitted encoder is fit on this data. Default None
             verbose (bool): Print progress messages? default True
         
         Returns:
@@ -146,13 +182,7 @@ def preprocess_next_play(data : pd.DataFrame, seasons = [],
         if len(query_string) != 0: return query_string + ' and ' + add
         else: return query_string + add
     
-    play_types = []
-    if include_pass: play_types.append('pass')
-    if include_run: play_types.append('run')
-    if include_fg: play_types.append('field_goal')
-    if include_punt: play_types.append('punt')
-    if include_qbkneel: play_types.append('qb_kneel')
-    if include_qbspike: play_types.append('qb_spike')
+    play_types = _play_types(include_pass, include_run, include_fg, include_punt, include_qbkneel, include_qbspike)
     
     if verbose: print('Preprocessing for play types: {}'.format(play_types))
     
@@ -160,13 +190,17 @@ def preprocess_next_play(data : pd.DataFrame, seasons = [],
     
     if len(seasons) != 0:
         query_string = add_to_query(query_string, 'season in @seasons')
-
+    
     # query dataset to a copy
-    data = data.query(query_string).copy()
+    with stage('query') as s:
+        data = data.query(query_string).copy()
+        s.rows = len(data)
     
     # drop NaN values
     if verbose: len_na = len(data)
-    data.dropna(axis=0, inplace=True, subset=target+continuous+categoricals)
+    with stage('dropna') as s:
+        data.dropna(axis=0, inplace=True, subset=target+continuous+categoricals)
+        s.rows = len(data)
     if verbose: 
         print('Dropped {} rows containing NaN values.'.format(len_na - len(data)))
         print('Resulting dataset size is {} rows.'.format(len(data)))
@@ -187,7 +221,8 @@ def preprocess_next_play(data : pd.DataFrame, seasons = [],
     
     
     # ===== Encode categoricals =====
-    data = pd.get_dummies(data=data, columns=categoricals)
+    with stage('get_dummies', rows=len(data)):
+        data = _encode(data, continuous, categoricals, encoder=encoder, compact=compact)
     
     # Transforms play type to integers, required for some models e.g. xgboost
     if map_target_to_int:
@@ -196,7 +231,11 @@ def preprocess_next_play(data : pd.DataFrame, seasons = [],
         for i in range(len(play_types)):
             map_dict[play_types[i]] = i
         data[target[0]] = data[target[0]].map(map_dict)
-        
+    
+    if compact:
+        with stage('compact', rows=len(data)): (data,) = _compact(data, verbose=verbose)
+    
+    if map_target_to_int:
         if return_X_y:
             if verbose: print('Returned preprocessed X, y, play_types')
             return (data.drop(target, axis=1), data[target], play_types)
@@ -210,162 +249,414 @@ def preprocess_next_play(data : pd.DataFrame, seasons = [],
         return data
     
     
-def preprocess_ep(data : pd.DataFrame, seasons = [], verbose : bool = True):
+@profiled('preprocess_ep')
+def preprocess_ep(data : pd.DataFrame, seasons = [], compact : bool = False, encoder = None, verbose : bool = True):
     '''
+    Preprocesses nflverse play-by-play data for use in expected points prediction.
+    Each play is labeled with the next scoring event of its game half, extra point attempts are separated from the other plays.
     
+        Parameters:
+            data (DataFrame): Dataset to preprocess
+            seasons (List): Which seasons to include, empty for all
+            compact (bool): Downcast the output to compact dtypes (int8/int16/float32, uint8 dummies, categorical target), default False
+            encoder (FeatureEncoder): Encode categoricals with a fixed layout instead of pd.get_dummies, an unfitted encoder is fit on this data. 
+                Normal plays and extra point attempts share the layout. Default None
+            verbose (bool): Print progress messages? default True
+        
+        Returns:
+            (X (DataFrame), y (DataFrame), X_pat (DataFrame), y_pat (DataFrame)) for normal plays and extra point attempts
     '''
     
     if verbose: print('Preprocessing {} rows...'.format(len(data)))
     
-    query_string = ''
     target = ['next_score']
-    continuous = ['yardline_100', 'ydstogo', 'goal_to_go', 'half_seconds_remaining', 'game_seconds_remaining']
-    categoricals = ['qtr', 'down', 'posteam_type', 'posteam_timeouts_remaining', 'defteam_timeouts_remaining']
-    
-    # add and separated with spaces if the given string is not empty
-    def add_to_query(query_string: str, add: str):
-        if len(query_string) != 0: return query_string + ' and ' + add
-        else: return query_string + add
+    continuous = list(EP_CONTINUOUS)
+    categoricals = list(EP_CATEGORICALS)
     
-    if len(seasons) != 0:
-        query_string = add_to_query(query_string, 'season in @seasons')
-
-    # query dataset and sort to a copy
-    # game_id, play_id is not enough as there are some games where the id is broken --> use game id, game clock and then play id (if equal clock) to mitigate 
-    if len(query_string) != 0:
-        data = data.query(query_string).sort_values(by=['game_id' ,'game_seconds_remaining', 'play_id'], ascending=[True, False, True]).copy()
-    else:
-        data = data.sort_values(by=['game_id', 'game_seconds_remaining', 'play_id'], ascending=[True, False, True]).copy()
+    # The input is never copied as a whole: rows are selected and ordered as an array of positions, 
+    # the labels are computed on NumPy arrays of the few columns they need and only the feature columns of the output rows are taken.
     
     # drop invalid rows, these include timeouts and start/end of quarter marks etc. 
     # not enough information is present to make these useful for analysis
-    data = data.dropna(axis=0, subset=['posteam', 'yardline_100'])
-    if verbose: print(f'After dropping some rows, dataset size is {len(data)}')
+    # sort by game id, game clock and then play id (if equal clock) as there are some games where the play id is broken
+    with stage('query') as s:
+        keep = data['posteam'].notna().to_numpy() & data['yardline_100'].notna().to_numpy()
+        if len(seasons) != 0: keep &= data['season'].isin(seasons).to_numpy()
+        positions = _game_order(data, np.flatnonzero(keep))
+        s.rows = len(positions)
+    if verbose: print(f'After dropping some rows, dataset size is {len(positions)}')
     
     
     # CANNOT drop kickoffs because may end up as a td --> TODO: must be considered separately? or encode down as some other value?
     
     
     # ========================= Calculate next scoring events for each play =========================
-
+    
     
     # 1: Get scoring play score value
     # 2: Map scoring play values to scoring types (e.g. 6 = "td")
     # 3: Fill rest of the plays based on mapped values
     
-    # score gained for play
-    data['play_score_gained'] = np.where(data['sp'] == 1, data['score_differential_post'] - data['score_differential'], None)
+    with stage('labeling', rows=len(positions)):
+        def column(name, dtype=None):
+            if dtype is None: return data[name].to_numpy()[positions]
+            return data[name].to_numpy(dtype=dtype, na_value=np.nan)[positions]
+        
+        # score gained for scoring plays, extra point attempts are set to zero if no score made
+        score_gained = np.where(column('sp', np.float64) == 1, 
+                                column('score_differential_post', np.float64) - column('score_differential', np.float64), np.nan)
+        pat_attempt = (column('extra_point_attempt', np.float64) == 1) | (column('two_point_attempt', np.float64) == 1)
+        score_gained[pat_attempt & np.isnan(score_gained)] = 0
+        
+        # map values to strings; SCORING PLAYS ONLY
+        # two point scores are two point conversions or safeties, negative for opponent returns on pat
+        safety = column('safety', np.float64)
+        next_score = np.full(len(positions), None, dtype=object)
+        for value, score_type in [(0, 'no_score'), (6, 'td'), (3, 'fg'), (1, 'pat'), (-6, 'opp_td'), (-3, 'opp_fg')]:
+            next_score[score_gained == value] = score_type
+        next_score[(score_gained == 2) & (safety == 1)] = 'safety'
+        next_score[(score_gained == 2) & (safety == 0)] = '2pat'
+        next_score[(score_gained == -2) & (safety == 0)] = 'opp_patreturn'
+        next_score[(score_gained == -2) & (safety == 1)] = 'opp_safety'
+        
+        # Fill values for other (non scoring) plays
+        next_score = _label_next_score(column('game_id'), column('game_half'), column('posteam'), next_score)
+        
+        if verbose: print(f'Labeled next scoring event for {len(next_score)} rows')
+        
+        # delete invalid vals
+        valid = next_score != 'opp_pat' # -1 or opponent pat should not be possible and is a result of faulty data
+    
+    if verbose: print(f'Final dataset size is {int(valid.sum())} rows')
+    
+    # ========================= Separate field goal and extra (& 2) point attempts =========================
     
-    # extra point attempts, set to zero if no score made
-    data['play_score_gained'] = np.where(((data['extra_point_attempt'] == 1) | (data['two_point_attempt'] == 1)) 
-                                         & (data['play_score_gained'].isna()), 0, data['play_score_gained'])
+    with stage('split', rows=int(valid.sum())):
+        # should cover all possible extra-point-related plays
+        pat = valid & (pat_attempt | np.isin(next_score, ['pat', '2pat', 'opp_patreturn']))
+        normal = valid & ~pat
+        
+        # index outputs by the rows of the input data, like the other preprocessors
+        features = data.columns.get_indexer(continuous + categoricals)
+        def rows(mask):
+            X = data.iloc[positions[mask], features].rename_axis(None)
+            y = pd.DataFrame({target[0]: next_score[mask]}, index=X.index)
+            return X, y
+        
+        data_normal_X, data_normal_y = rows(normal)
+        data_pat_X, data_pat_y = rows(pat)
+    
+    # ========================= Feature selection and engineering =========================
     
+    # fit on all plays so that both sets are encoded with the same layout
+    if encoder is not None and not encoder.fitted: encoder.fit(pd.concat([data_normal_X, data_pat_X]), continuous, categoricals)
     
-    # map values to strings; SCORING PLAYS ONLY
-    data['next_score'] = data['play_score_gained'].map({0: 'no_score', 
-                                                        6: 'td', 3: 'fg', 1: 'pat',
-                                                        -6: 'opp_td', -3: 'opp_fg',
-                                                        None: None})
+    with stage('get_dummies', rows=len(data_normal_X)):
+        data_normal_X = _encode(data_normal_X, continuous, categoricals, encoder=encoder, compact=compact)
+    
+    with stage('get_dummies', rows=len(data_pat_X)):
+        data_pat_X = _encode(data_pat_X, continuous, categoricals, encoder=encoder, compact=compact)
+    
+    if compact:
+        with stage('compact', rows=len(data_normal_X) + len(data_pat_X)):
+            data_normal_X, data_normal_y, data_pat_X, data_pat_y = _compact(data_normal_X, data_normal_y, data_pat_X, data_pat_y, verbose=verbose)
+    
+    #return data_normal, data_fg, data_pat
+    return data_normal_X, data_normal_y, data_pat_X, data_pat_y
 
-    # fix two point attempts and opponent returns on pat
-    data['next_score'] = np.where((data['play_score_gained'] == 2) & (data['safety'] == 1), 'safety', data['next_score'])
-    data['next_score'] = np.where((data['play_score_gained'] == 2) & (data['safety'] == 0), '2pat', data['next_score'])
+
+def data_requirements(preprocessor, **kwargs):
+    '''
+    Columns and row filters that a preprocessor call needs from the data, so that loaders transfer only those.
+    
+        Parameters:
+            preprocessor (function): preprocess_field_goal, preprocess_next_play or preprocess_ep
+            kwargs: The arguments the preprocessor will be called with, e.g. seasons or use_wind
+        
+        Returns:
+            requirements (dict): 'columns' (list) for loader.select(columns=...) and 'filters' (list of (column, op, value)) for loader.filter(...)
+        
+        Usage:
+            requirements = data_requirements(preprocess_field_goal, seasons=[2021, 2022])
+            data = PgLoader(credentials).select(columns=requirements['columns']).filter(requirements['filters']).load()
+            X, y = preprocess_field_goal(data, seasons=[2021, 2022], return_X_y=True)
+    '''
+    
+    func = inspect.unwrap(preprocessor)
+    arguments = inspect.signature(func).bind_partial(**kwargs)
+    arguments.apply_defaults()
+    a = arguments.arguments
+    
+    filters = []
+    
+    if func.__name__ == 'preprocess_field_goal':
+        columns = ['season', 'play_type', 'field_goal_result', 'yardline_100']
+        play_types = ['field_goal']
+        if a['use_extra_points']: 
+            columns.append('extra_point_result')
+            play_types.append('extra_point')
+        if a['use_wind']: columns += ['roof', 'wind', 'weather']
+        if a['use_kickers']: columns.append('kicker_player_name')
+        filters.append(('play_type', 'in', play_types))
+    
+    elif func.__name__ == 'preprocess_next_play':
+        columns = ['season', 'play_type', 'score_differential', 'game_seconds_remaining', 'half_seconds_remaining', 
+                   'yardline_100', 'ydstogo', 'goal_to_go', 'posteam_type', 'shotgun', 
+                   'qtr', 'down', 'posteam_timeouts_remaining', 'defteam_timeouts_remaining']
+        filters.append(('play_type', 'in', _play_types(a['include_pass'], a['include_run'], a['include_fg'], a['include_punt'], 
+                                                       a['include_qbkneel'], a['include_qbspike'])))
+    
+    elif func.__name__ == 'preprocess_ep':
+        # labeling needs every play of a game half, only whole seasons can be left out
+        columns = ['season', 'game_id', 'play_id', 'game_half', 'posteam', 'sp', 'score_differential', 'score_differential_post', 
+                   'extra_point_attempt', 'two_point_attempt', 'safety', 
+                   'yardline_100', 'ydstogo', 'goal_to_go', 'half_seconds_remaining', 'game_seconds_remaining', 
+                   'qtr', 'down', 'posteam_type', 'posteam_timeouts_remaining', 'defteam_timeouts_remaining']
+    
+    else:
+        raise Exception(f'No data requirements known for {func.__name__}')
     
-    data['next_score'] = np.where((data['play_score_gained'] == -2) & (data['safety'] == 0), 'opp_patreturn', data['next_score'])
-    data['next_score'] = np.where((data['play_score_gained'] == -2) & (data['safety'] == 1), 'opp_safety', data['next_score'])
+    if len(a['seasons']) != 0: filters.append(('season', 'in', list(a['seasons'])))
+    
+    return {'columns': columns, 'filters': filters}
+
 
+def _play_types(include_pass, include_run, include_fg, include_punt, include_qbkneel, include_qbspike):
+    '''Play types included in next play prediction'''
+    play_types = []
+    if include_pass: play_types.append('pass')
+    if include_run: play_types.append('run')
+    if include_fg: play_types.append('field_goal')
+    if include_punt: play_types.append('punt')
+    if include_qbkneel: play_types.append('qb_kneel')
+    if include_qbspike: play_types.append('qb_spike')
+    return play_types
+
+
+class IncrementalEP():
+    '''
+    Incremental version of preprocess_ep for weekly updates during the season.
+    The next scoring event of a play depends only on the plays of the same game half, so each update labels only
+    the games that have not been processed before and stores them as a new part. 
+    Only completed games should be added, plays of a game that has already been processed are ignored.
+    
+    If path is given, the state is persisted there: each update writes only its own part and the list of processed games.
+    The outputs are indexed by the position of each play among all rows passed to update(), not by the index of the input data.
+    
+    Usage:
+        ep = IncrementalEP('ep_state')
+        ep.update(new_week_data)
+        X, y, X_pat, y_pat = ep.result()
+    '''
     
-    # Fill values for other (non scoring) plays
-    # First, reset index to make iteration work, iterating is not "pandas-like" but here it is the simplest way to accomplish this task
-    # Additionally, the execution speed is still very good
-    data.reset_index(inplace=True)
-    
-    prev_half = ''
-    prev_game_id = ''
-    prev_score_gained = 'no_score'
-    prev_posteam = ''
-    
-    datalength = len(data)
-    
-    # create temp lists for pandas columns, this massively improves speeds when iterating
-    l_half = data['game_half'].values.tolist()
-    l_game_id = data['game_id'].values.tolist()
-    l_score_gained = data['play_score_gained'].values.tolist()
-    l_posteam = data['posteam'].values.tolist()
-    l_next_score = data['next_score'].values.tolist()
-    
-    # Iterate on ordered data, starting from the last play
-    for i in range(datalength - 1, -1, -1):
-        
-        if verbose: #print(f'Processing row {datalength - i} out of {datalength}', end='\r')
-            if (datalength - i) % 2500 == 0:
-                print(f'Processing row {datalength - i} out of {datalength}', end='\r')
-        
-        # Get current row game id, half, score made and posteam
-        row_half = l_half[i] 
-        row_game_id = l_game_id[i] 
-        row_score_gained = l_next_score[i] 
-        row_posteam = l_posteam[i] 
-        
-        # Game or half changed from previous iteration -> reset
-        if row_game_id != prev_game_id or row_half != prev_half: 
-            prev_half = row_half
-            prev_game_id = row_game_id
-            prev_score_gained = 'no_score'
-        
-        # If row does not have score information = row is not a scoring play
-        # Add "currentyl active" score to the row
-        if row_score_gained is None:
-            if row_posteam != prev_posteam:
-                if prev_score_gained == 'no_score':
-                    l_next_score[i] = prev_score_gained
-                else:
-                    if prev_score_gained.startswith('opp_'): l_next_score[i] = prev_score_gained[4:] 
-                    else: l_next_score[i] = 'opp_' + prev_score_gained 
-            else:
-                l_next_score[i] = prev_score_gained 
-        
-        # Row is a scoring play
-        # Save current row scoring information    
-        else:
-            prev_score_gained = row_score_gained
-            prev_posteam = row_posteam        
+    def __init__(self, path : str = None, compact : bool = False):
+        '''
+        Parameters:
+            path (str): Directory to persist the state in, an existing state is continued. Default None for in-memory only
+            compact (bool): Passed to preprocess_ep, default False. Ignored when continuing an existing state
+        '''
+        self.path = path
+        self.compact = compact
+        self.game_ids = set()
+        self.n_rows = 0
+        self.parts = []
+        
+        if path is not None and os.path.exists(os.path.join(path, 'state.json')):
+            with open(os.path.join(path, 'state.json')) as f:
+                state = json.load(f)
+            self.compact = state['compact']
+            self.game_ids = set(state['game_ids'])
+            self.n_rows = state['n_rows']
+            # parts are read from disk when needed
+            self.parts = [None] * state['n_parts']
+    
+    def update(self, data : pd.DataFrame, verbose : bool = True):
+        '''
+        Preprocess the games in data that have not been processed yet and append them to the state.
+        
+            Parameters:
+                data (DataFrame): New play-by-play data, e.g. the plays of the latest week
+                verbose (bool): Print progress messages? default True
+                
+            Returns:
+                self: IncrementalEP object
+        '''
+        
+        data = data[~data['game_id'].isin(self.game_ids)]
+        if len(data) == 0:
+            if verbose: print('No new games to preprocess')
+            return self
+        
+        # preprocess_ep indexes its outputs by the input rows, whose labels can repeat between updates (e.g. reloaded season-to-date data).
+        # Rows are indexed by their position among all rows added so far instead, so that the combined result has a unique index
+        part = preprocess_ep(data.reset_index(drop=True), compact=self.compact, verbose=verbose)
+        for frame in part: frame.index += self.n_rows
+        
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            part_path = os.path.join(self.path, f'part_{len(self.parts)}')
+            shutil.rmtree(part_path, ignore_errors=True)
+            os.makedirs(part_path)
+            _write_output(part_path, part)
+        
+        self.parts.append(part)
+        self.game_ids.update(data['game_id'].unique())
+        self.n_rows += len(data)
+        
+        if self.path is not None:
+            # state is written last, a part without a state entry is overwritten by the next update
+            with open(os.path.join(self.path, 'state.json'), 'w') as f:
+                json.dump({'compact': self.compact, 'game_ids': sorted(self.game_ids), 'n_rows': self.n_rows, 'n_parts': len(self.parts)}, f)
+        
+        if verbose: print(f'Added {data["game_id"].nunique()} new games, {len(self.game_ids)} games processed in total')
         
-    print(f'All {datalength} out of {datalength} rows processed!')
+        return self
     
-    data['next_score'] = l_next_score
+    def result(self):
+        '''
+        Combine all parts into the output of preprocess_ep.
+        Dummy columns missing from a part (categories not present in its games) are filled with zeros.
+        
+            Returns:
+                (X (DataFrame), y (DataFrame), X_pat (DataFrame), y_pat (DataFrame)) for normal plays and extra point attempts
+        '''
+        
+        for i in range(len(self.parts)):
+            if self.parts[i] is None: self.parts[i] = _read_output(os.path.join(self.path, f'part_{i}'))
+        
+        if len(self.parts) == 0: raise Exception('No data, call .update() first.')
+        
+        return tuple(_concat_aligned([part[i] for part in self.parts]) for i in range(4))
     
-    # delete invalid vals
-    data = data[data['next_score'] != 'opp_pat'] # -1 or opponent pat should not be possible and is a result of faulty data
     
-    # map next score type to next score value
-    # td quarantees an extra point attempt, therefore should the value of a td be higher...?
-    data['next_score_value'] = data['next_score'].map({'td': 6, 'fg': 3, 'safety': 2, '2pat': 2, 'pat': 1,
-                                                       'opp_td': -6, 'opp_fg': -3, 'opp_safety': -2, 'opp_patreturn': -2,
-                                                       'no_score': 0})
+def _game_order(data : pd.DataFrame, positions : np.ndarray):
+    '''Row positions sorted by game id, game clock and then play id (if equal clock), missing game ids last like sort_values'''
+    game_codes, _ = pd.factorize(data['game_id'].to_numpy()[positions], sort=True)
+    game_codes[game_codes < 0] = len(positions)
+    return positions[np.lexsort((data['play_id'].to_numpy(dtype=np.float64)[positions], 
+                                 -data['game_seconds_remaining'].to_numpy(dtype=np.float64)[positions], 
+                                 game_codes))]
+
+
+def _label_next_score(game_id : np.ndarray, game_half : np.ndarray, posteam : np.ndarray, next_score : np.ndarray):
+    '''
+    Fill the next scoring event for every play from the scoring plays that follow it.
+    Expects the rows to be ordered by game and game clock. Each play gets the label of the next scoring play
+    within the same game half, seen from the perspective of the play's posteam ('td' <-> 'opp_td').
+    Plays without a following scoring play in their half are labeled 'no_score'.
+    
+        Parameters:
+            game_id (ndarray): Game id of each play
+            game_half (ndarray): Game half of each play
+            posteam (ndarray): Team in possession for each play
+            next_score (ndarray): Scoring type for scoring plays, None or NaN for other plays
+            
+        Returns:
+            next_score (ndarray): Object array of next scoring event labels
+    '''
     
-    if verbose: print(f'Final dataset size is {len(data)} rows')
+    datalength = len(next_score)
+    labels = np.empty(datalength, dtype=object)
+    if datalength == 0: return labels
     
-    # ========================= Separate field goal and extra (& 2) point attempts =========================
+    # segments of consecutive plays in the same game half, labels never cross a segment boundary
+    segment_start = np.ones(datalength, dtype=bool)
+    segment_start[1:] = (game_id[1:] != game_id[:-1]) | (game_half[1:] != game_half[:-1])
+    segment = np.cumsum(segment_start)
     
-    #data_fg = data.query()
-    # should cover all possible extra-point-related plays
-    data_pat = data.query('(extra_point_attempt == 1 or two_point_attempt == 1) or (next_score == "pat" or next_score == "2pat" or next_score == "opp_patreturn")')
+    # position of the next scoring play at or after each row, datalength if there is none
+    scoring = ~pd.isna(next_score)
+    position = np.where(scoring, np.arange(datalength), datalength)
+    next_scoring = np.minimum.accumulate(position[::-1])[::-1]
     
-    # remove fg and pat rows from main set
-    #data_normal = pd.concat([data, data_fg]).drop_duplicates(keep=False)
-    #data_normal = pd.concat([data_normal, data_pat]).drop_duplicates(keep=False)
-    data_normal = pd.concat([data, data_pat]).drop_duplicates(keep=False)
+    has_next = next_scoring < datalength
+    next_scoring = np.minimum(next_scoring, datalength - 1)
+    has_next &= segment[next_scoring] == segment
     
-    # ========================= Feature selection and engineering =========================
+    # scoring type of the next scoring play, flipped to/from opp_ when posteam has changed
+    labels[:] = 'no_score'
+    labels[has_next] = next_score[next_scoring[has_next]]
     
-    data_normal_y = data_normal[target]
-    data_normal_X = data_normal[continuous+categoricals]
-    data_normal_X = pd.get_dummies(data=data_normal_X, columns=categoricals)
+    flip = has_next & ~scoring & (posteam != posteam[next_scoring])
+    if flip.any():
+        score_types, codes = np.unique(labels[flip].astype(str), return_inverse=True)
+        flipped = np.array([score_type if score_type == 'no_score' 
+                            else score_type[4:] if score_type.startswith('opp_') 
+                            else 'opp_' + score_type for score_type in score_types], dtype=object)
+        labels[flip] = flipped[codes]
     
-    data_pat_y = data_pat[target]
-    data_pat_X = data_pat[continuous+categoricals]
-    data_pat_X = pd.get_dummies(data=data_pat_X, columns=categoricals)
+    # scoring plays keep their own label
+    labels[scoring] = next_score[scoring]
     
-    #return data_normal, data_fg, data_pat
-    return data_normal_X, data_normal_y, data_pat_X, data_pat_y
\ No newline at end of file
+    return labels
+
+
+def _encode(data : pd.DataFrame, continuous : list, categoricals : list, encoder = None, compact : bool = False, unknown : dict = {}):
+    '''
+    One-hot encode categoricals with pd.get_dummies, or with the fixed layout of a FeatureEncoder if one is given.
+    An unfitted encoder is fit on data first. Columns other than the features (e.g. the target) are kept in front.
+    '''
+    
+    if encoder is None:
+        return pd.get_dummies(data=data, columns=categoricals, dtype=np.uint8 if compact else None)
+    
+    if not encoder.fitted: encoder.fit(data, continuous, categoricals, unknown=unknown)
+    
+    X = pd.DataFrame(encoder.transform(data, dtype=np.float32 if compact else np.float64), columns=encoder.feature_names, index=data.index)
+    return pd.concat([data.drop(continuous + categoricals, axis=1), X], axis=1)
+
+
+def _compact(*frames, verbose = True):
+    '''
+    Downcast preprocessed DataFrames (or Series) to compact dtypes.
+    Integers are downcast to the smallest integer type of the same signedness, floats holding only whole numbers (yards, seconds, flags) 
+    to the smallest integer type and other floats to float32, booleans to uint8 and strings to categoricals.
+    Dummies are bool or uint8 already, most of the saving comes from the numeric features: on preprocess_ep output about half the memory.
+    
+        Parameters:
+            *frames (DataFrame): Preprocessed datasets
+            verbose (bool): Print memory usage before and after, default True
+            
+        Returns:
+            frames (tuple): Compacted datasets
+    '''
+    
+    def compact_column(column : pd.Series):
+        if pd.api.types.is_bool_dtype(column): return column.astype(np.uint8)
+        if pd.api.types.is_unsigned_integer_dtype(column): return pd.to_numeric(column, downcast='unsigned')
+        if pd.api.types.is_integer_dtype(column): return pd.to_numeric(column, downcast='integer')
+        if pd.api.types.is_float_dtype(column):
+            values = column.to_numpy()
+            if len(values) != 0 and np.isfinite(values).all() and (values == np.round(values)).all(): 
+                return pd.to_numeric(column.astype(np.int64), downcast='integer')
+            return pd.to_numeric(column, downcast='float')
+        if pd.api.types.is_object_dtype(column) or pd.api.types.is_string_dtype(column): return column.astype('category')
+        return column
+    
+    compacted = tuple(compact_column(f) if isinstance(f, pd.Series) else pd.DataFrame({c: compact_column(f[c]) for c in f.columns}, index=f.index) for f in frames)
+    
+    if verbose:
+        before = sum(np.sum(f.memory_usage(deep=True)) for f in frames)
+        after = sum(np.sum(f.memory_usage(deep=True)) for f in compacted)
+        print(f'Compacted memory usage from {before / 2**20:.2f} MB to {after / 2**20:.2f} MB')
+    
+    return compacted
+
+
+def _concat_aligned(frames : list):
+    '''Concatenate DataFrames with differing dummy columns, missing columns are filled with zeros of the column's dtype'''
+    
+    columns = frames[0].columns
+    dtypes = {}
+    for f in frames:
+        columns = columns.union(f.columns, sort=False)
+        dtypes.update({c: t for c, t in f.dtypes.items() if c not in dtypes})
+    
+    aligned = []
+    for f in frames:
+        missing = columns.difference(f.columns, sort=False)
+        if len(missing) != 0:
+            f = f.assign(**{c: np.zeros(len(f), dtype=dtypes[c]) for c in missing})
+        aligned.append(f[columns])
+    
+    return pd.concat(aligned)
@@ -0,0 +1,206 @@
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+import pandas as pd
+
+# profiler receiving the stages, None when profiling is disabled
+_active = None
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class Profiler():
+    '''
+    Records the wall time, row count and peak memory of the stages of loaders, preprocessors and models.
+    Stages inside a profiled stage are recorded with the path of their parents, e.g. preprocess_ep/labeling.
+    Peak memory is the largest increase of memory over the start of the stage, measured either from the resident set size of the process,
+    sampled in a background thread (Linux only), or from the allocations of Python and NumPy traced with tracemalloc.
+    Stages of worker processes (backtest, tune) are not recorded.
+    
+    Without an active Profiler the stages only check a global, so the instrumentation costs nothing when disabled.
+    
+    Usage:
+        with Profiler() as profiler:
+            X, y, X_pat, y_pat = preprocess_ep(data)
+            model.fit(X, y)
+        profiler.to_dataframe()
+    '''
+    
+    def __init__(self, memory : str = 'rss', interval : float = 0.005):
+        '''
+        Parameters:
+            memory (str): "rss" to sample the resident set size, "tracemalloc" to trace allocations or None to not measure memory, default "rss".
+                Sampling misses peaks shorter than interval, tracing is exact but slows down code that allocates many Python objects considerably
+            interval (float): Sampling interval of the resident set size in seconds, default 0.005
+        '''
+        if memory not in ('rss', 'tracemalloc', None): raise Exception('Unknown value for parameter memory, use "rss", "tracemalloc" or None')
+        if memory == 'rss' and _rss() is None: memory = None
+        self.memory = memory
+        self.interval = interval
+        self.records = []
+        self._open = set()
+        self._local = threading.local()
+        self._started_tracing = False
+        self._sampler = None
+        self._stop = threading.Event()
+        self._previous = None
+    
+    def __enter__(self):
+        global _active
+        if self.memory == 'tracemalloc' and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        if self.memory == 'rss':
+            self._stop.clear()
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+        self._previous = _active
+        _active = self
+        return self
+    
+    def __exit__(self, *args):
+        global _active
+        _active = self._previous
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+    
+    def to_dataframe(self):
+        '''Recorded stages as a DataFrame, one row per stage in the order they finished'''
+        return pd.DataFrame(self.records, columns=['stage', 'depth', 'seconds', 'rows', 'peak_mb'])
+    
+    def to_json(self, path : str = None):
+        '''Recorded stages as a JSON string, also written to path if given'''
+        s = json.dumps(self.records)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(s)
+        return s
+    
+    def summary(self):
+        '''Total seconds, rows and largest peak memory of each stage over all of its runs'''
+        return self.to_dataframe().groupby('stage', sort=False).agg(
+            runs=('seconds', 'size'), seconds=('seconds', 'sum'), rows=('rows', 'sum'), peak_mb=('peak_mb', 'max'))
+    
+    def _stack(self):
+        '''Open stages of the current thread'''
+        if not hasattr(self._local, 'stack'): self._local.stack = []
+        return self._local.stack
+    
+    def _sample(self):
+        '''Update the peak of all open stages with the current resident set size until stopped'''
+        while not self._stop.wait(self.interval):
+            rss = _rss()
+            for s in list(self._open):
+                if rss > s.peak: s.peak = rss
+
+
+class _Stage():
+    '''A stage being recorded, set rows inside the with block if the row count is known only afterwards'''
+    
+    def __init__(self, profiler, name, rows):
+        self.profiler = profiler
+        self.name = name
+        self.rows = rows
+    
+    def __enter__(self):
+        stack = self.profiler._stack()
+        self.path = '/'.join([s.name for s in stack] + [self.name])
+        self.depth = len(stack)
+        
+        memory = self.profiler.memory
+        if memory == 'tracemalloc' and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            # the parent's peak so far is kept before the peak is reset for this stage
+            if len(stack) != 0: stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+            self.start_memory = self.peak = current
+        elif memory == 'rss':
+            self.start_memory = self.peak = _rss()
+            self.profiler._open.add(self)
+        
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *args):
+        seconds = time.perf_counter() - self.start
+        stack = self.profiler._stack()
+        stack.pop()
+        
+        peak_mb = None
+        memory = self.profiler.memory
+        if memory == 'tracemalloc' and tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            if len(stack) != 0: stack[-1].peak = max(stack[-1].peak, self.peak)
+            peak_mb = (self.peak - self.start_memory) / 2**20
+        elif memory == 'rss':
+            self.profiler._open.discard(self)
+            self.peak = max(self.peak, _rss())
+            peak_mb = (self.peak - self.start_memory) / 2**20
+        
+        self.profiler.records.append({'stage': self.path, 'depth': self.depth, 'seconds': seconds,
+                                      'rows': int(self.rows) if self.rows is not None else None, 'peak_mb': peak_mb})
+        return False
+
+
+class _NullStage():
+    '''Stage used when profiling is disabled, ignores everything'''
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        return False
+    
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+def stage(name : str, rows : int = None):
+    '''
+    Context manager recording a stage in the active Profiler, does nothing if there is none.
+    
+    Parameters:
+        name (str): Stage name, e.g. dropna
+        rows (int): Number of rows processed, can also be set on the returned stage inside the with block
+    
+    Usage:
+        with stage('dropna') as s:
+            data = data.dropna()
+            s.rows = len(data)
+    '''
+    if _active is None: return _NULL_STAGE
+    return _Stage(_active, name, rows)
+
+
+def profiled(name : str):
+    '''Decorator recording every call of a function as a stage, the row count is the length of its first argument (the data)'''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active is None: return func(*args, **kwargs)
+            rows = len(args[0]) if len(args) != 0 and hasattr(args[0], '__len__') else None
+            with _Stage(_active, name, rows):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _rss():
+    '''Current resident set size of the process in bytes, None where /proc is not available'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError):
+        return None
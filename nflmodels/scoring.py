@@ -0,0 +1,167 @@
+import asyncio
+import time
+import numpy as np
+import pandas as pd
+
+
+class MicroBatcher():
+    '''
+    Asyncio micro-batcher for scoring live game states with a fitted NFLModel.
+    Concurrent single-play requests are gathered for up to max_delay seconds (or max_batch_size requests),
+    scored with one batched predict_proba call and the probabilities are returned to each caller.
+    
+    A play is either a 1D array of encoded features or, for a model with a FeatureEncoder, a dict of feature values.
+    
+    Usage:
+        async with MicroBatcher(model) as batcher:
+            proba = await batcher.predict_proba(play)
+    '''
+    
+    def __init__(self, model, max_batch_size : int = 256, max_delay : float = 0.002):
+        '''
+        Parameters:
+            model (NFLModel): Fitted model
+            max_batch_size (int): Maximum number of plays scored in one call, default 256
+            max_delay (float): Maximum time in seconds to wait for more requests after the first one, default 0.002
+        '''
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._queue = None
+        self._task = None
+    
+    async def start(self):
+        '''Start the batching task on the running event loop'''
+        if self._task is not None: return self
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+        return self
+    
+    async def stop(self):
+        '''Stop the batching task, pending requests are cancelled'''
+        if self._task is None: return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            future.cancel()
+    
+    async def __aenter__(self):
+        return await self.start()
+    
+    async def __aexit__(self, *args):
+        await self.stop()
+    
+    async def predict_proba(self, play):
+        '''
+        Score a single play.
+        
+        Parameters:
+            play (ndarray or dict): Encoded features of the play, or a dict of feature values for a model with an encoder
+        
+        Returns:
+            ndarray of class probabilities
+        '''
+        if self._task is None: raise Exception('Batcher is not running, call .start() first or use "async with".')
+        
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((play, future))
+        return await future
+    
+    async def _run(self):
+        '''Collect requests into batches and score them, one batch at a time'''
+        while True:
+            batch = [await self._queue.get()]
+            
+            # wait for more requests unless a full batch is already queued
+            if self._queue.qsize() < self.max_batch_size - 1: await asyncio.sleep(self.max_delay)
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            
+            # score in a worker thread so that new requests are queued meanwhile
+            try:
+                proba = await asyncio.to_thread(self.model.predict_proba, _stack([play for play, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done(): future.set_exception(e)
+                continue
+            
+            for (_, future), p in zip(batch, proba):
+                if not future.done(): future.set_result(p)
+
+
+def benchmark(model, X, n_requests : int = 10000, concurrency : int = 64, max_batch_size : int = 256, max_delay : float = 0.002, verbose : bool = True):
+    '''
+    Benchmark the scoring latency and throughput of a model with a local load generator.
+    Plays of X are requested one at a time by concurrent clients, both through a MicroBatcher and with one predict_proba call per play.
+    
+    Parameters:
+        model (NFLModel): Fitted model
+        X (DataFrame or ndarray): Features to request, rows are reused if n_requests > len(X)
+        n_requests (int): Number of requests, default 10000
+        concurrency (int): Number of concurrent clients, default 64
+        max_batch_size (int): Passed to MicroBatcher, default 256
+        max_delay (float): Passed to MicroBatcher, default 0.002
+        verbose (bool): Print results, default True
+    
+    Returns:
+        results (DataFrame): p50 and p99 latency in milliseconds and throughput in requests per second, for batched and single scoring
+    '''
+    
+    X = np.asarray(model._features(X))
+    plays = [X[i % len(X)] for i in range(n_requests)]
+    
+    results = pd.DataFrame({
+        'batched': asyncio.run(_load(MicroBatcher(model, max_batch_size=max_batch_size, max_delay=max_delay), plays, concurrency)),
+        'single': asyncio.run(_load(_SingleScorer(model), plays, concurrency)),
+    }).T
+    
+    if verbose: print(results.to_string(float_format='{:.3f}'.format))
+    return results
+
+
+class _SingleScorer():
+    '''Scores every request with its own predict_proba call, baseline for benchmark'''
+    
+    def __init__(self, model):
+        self.model = model
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *args):
+        pass
+    
+    async def predict_proba(self, play):
+        return await asyncio.to_thread(self.model.predict_proba, _stack([play]))
+
+
+async def _load(scorer, plays : list, concurrency : int):
+    '''Request all plays with concurrent clients, returns latency percentiles and throughput'''
+    
+    latencies = np.empty(len(plays))
+    
+    async def client(start):
+        for i in range(start, len(plays), concurrency):
+            t = time.perf_counter()
+            await scorer.predict_proba(plays[i])
+            latencies[i] = time.perf_counter() - t
+    
+    async with scorer:
+        t = time.perf_counter()
+        await asyncio.gather(*[client(i) for i in range(concurrency)])
+        elapsed = time.perf_counter() - t
+    
+    return {'p50_ms': np.percentile(latencies, 50) * 1000, 'p99_ms': np.percentile(latencies, 99) * 1000, 'throughput': len(plays) / elapsed}
+
+
+def _stack(plays : list):
+    '''Stack single plays into a batch, dicts of feature values are stacked by feature'''
+    if isinstance(plays[0], dict):
+        return {c: np.array([play[c] for play in plays]) for c in plays[0]}
+    return np.vstack(plays)
@@ -0,0 +1,331 @@
+import math
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from nflmodels.pipeline import FEATURE_SOURCES
+from nflmodels.preprocessing import NEXT_SCORE_VALUES, _game_order
+from nflmodels.profiling import stage
+
+
+class PlayOutcomes():
+    '''
+    Empirical outcome distributions of plays, sampled by the Simulator:
+    yards gained on passes and runs, interception rate, net punt distance, shotgun rate and seconds run off the clock by each play type.
+    Punt distances and elapsed seconds are measured from the next play of the same game half.
+    
+    Usage:
+        outcomes = PlayOutcomes().fit(data)
+    '''
+    
+    def __init__(self):
+        self.distributions = {}
+        self.interception_rate = 0.0
+        self.shotgun_rate = 0.0
+    
+    def fit(self, data : pd.DataFrame):
+        '''
+        Fit the distributions to nflverse play-by-play data.
+        
+        Parameters:
+            data (DataFrame): Play-by-play data with whole game halves
+        
+        Returns:
+            self: PlayOutcomes object
+        '''
+        keep = data['posteam'].notna().to_numpy() & data['yardline_100'].notna().to_numpy() & data['play_type'].notna().to_numpy()
+        positions = _game_order(data, np.flatnonzero(keep))
+        
+        def column(name):
+            return data[name].to_numpy()[positions]
+        
+        play_type = column('play_type').astype(str)
+        yardline = column('yardline_100').astype(np.float64)
+        seconds = column('game_seconds_remaining').astype(np.float64)
+        posteam = column('posteam')
+        
+        # next play of the same game half
+        has_next = np.zeros(len(positions), dtype=bool)
+        has_next[:-1] = (column('game_id')[1:] == column('game_id')[:-1]) & (column('game_half')[1:] == column('game_half')[:-1])
+        next_yardline = np.append(yardline[1:], np.nan)
+        elapsed = np.append(seconds[:-1] - seconds[1:], np.nan)
+        changed = np.append(posteam[1:] != posteam[:-1], False)
+        
+        yards_gained = column('yards_gained').astype(np.float64)
+        for t in ['pass', 'run']:
+            yards = yards_gained[(play_type == t) & ~np.isnan(yards_gained)]
+            self.distributions[f'{t}_yards'] = _distribution(np.clip(np.round(yards), -20, 99))
+        
+        punt = (play_type == 'punt') & has_next & changed
+        self.distributions['punt_net'] = _distribution(np.clip(np.round(yardline[punt] - (100 - next_yardline[punt])), 0, 99))
+        
+        for t in ['pass', 'run', 'field_goal', 'punt', 'qb_kneel', 'qb_spike']:
+            e = elapsed[(play_type == t) & has_next]
+            self.distributions[f'{t}_seconds'] = _distribution(np.clip(np.round(e[~np.isnan(e)]), 0, 60) if t in play_type else np.array([5.0]))
+        
+        passes = play_type == 'pass'
+        self.interception_rate = float(np.nanmean(column('interception').astype(np.float64)[passes])) if passes.any() else 0.0
+        self.shotgun_rate = float(np.nanmean(column('shotgun').astype(np.float64))) if len(positions) != 0 else 0.0
+        return self
+    
+    def sample(self, name : str, rng : np.random.Generator, n : int):
+        '''Sample n values of distribution name'''
+        values, cdf = self.distributions[name]
+        return values[np.minimum(np.searchsorted(cdf, rng.random(n), side='right'), len(values) - 1)]
+
+
+def _distribution(samples : np.ndarray):
+    '''Discrete distribution (values, cumulative probabilities) of samples'''
+    if len(samples) == 0: samples = np.array([0.0])
+    values, counts = np.unique(samples, return_counts=True)
+    return values, np.cumsum(counts) / counts.sum()
+
+
+class Simulator():
+    '''
+    Vectorized Monte Carlo simulation of the rest of a game or drive from a given state.
+    All simulations advance in lockstep as NumPy arrays: each step makes one batched NextPlayModel.predict_proba call over all live simulations
+    to sample the play types, one FieldGoalModel call for the field goals and extra points of the step, samples the other outcomes
+    from PlayOutcomes and retires finished simulations with a mask. Drives are valued with one EPModel call over the ending states.
+    Models must be fitted with a FeatureEncoder, like in ScoringPipeline.
+    
+    Simplifications: kickoffs are touchbacks, extra points are kicked from the 15 yard line, interceptions are not returned,
+    timeouts are not used and the game ends in regulation.
+    
+    Simulations are run in shards of shard_size with their own random streams spawned from the seed,
+    so results are reproducible and do not depend on n_jobs.
+    
+    Usage:
+        simulator = Simulator(next_play_model, field_goal_model, ep_model, PlayOutcomes().fit(data))
+        state = {'posteam_type': 'home', 'yardline_100': 35, 'down': 4, 'ydstogo': 2, 'game_seconds_remaining': 300, 'score_differential': -3}
+        go = simulator.simulate(state, n=10000, first_play='run')
+        kick = simulator.simulate(state, n=10000, first_play='field_goal')
+        win_probability(go), win_probability(kick)
+    '''
+    
+    def __init__(self, next_play_model, field_goal_model, ep_model, outcomes : PlayOutcomes):
+        '''
+        Parameters:
+            next_play_model (NextPlayModel): Fitted model sampling the play types
+            field_goal_model (FieldGoalModel): Fitted model for field goal and extra point success
+            ep_model (EPModel): Fitted model valuing the states where simulated drives end
+            outcomes (PlayOutcomes): Fitted play outcome distributions
+        '''
+        for model in [next_play_model, field_goal_model, ep_model]:
+            if model.encoder is None: raise Exception(f'{type(model).__name__} must be fitted with a FeatureEncoder to be used in a simulation.')
+        self.next_play_model = next_play_model
+        self.field_goal_model = field_goal_model
+        self.ep_model = ep_model
+        self.outcomes = outcomes
+        
+        # play type of each NextPlayModel class, integer classes (map_target_to_int) are named with the stored labels
+        classes = next_play_model.classifier.classes_
+        self.play_types = np.array([next_play_model.labels[c] if next_play_model.labels is not None and classes.dtype.kind in 'iu' else c
+                                    for c in classes], dtype=object)
+    
+    def simulate(self, state : dict, n : int = 10000, until : str = 'game', first_play : str = None, seed : int = 0,
+                 n_jobs : int = 1, shard_size : int = 4096, max_plays : int = 300, verbose : bool = False):
+        '''
+        Simulate from a state.
+        
+        Parameters:
+            state (dict): Game state seen from the team in possession: posteam_type ("home" or "away"), yardline_100, down, ydstogo,
+                game_seconds_remaining and score_differential. Optional: posteam_timeouts_remaining, defteam_timeouts_remaining (default 3),
+                closed, wind and kicker_player_name for field goals (default 0, 0, "Other") and second_half_posteam ("home" or "away",
+                default None for a coin flip in each simulation)
+            n (int): Number of simulations, default 10000
+            until (str): "game" to simulate to the end of the game or "drive" to the end of the current drive, default "game"
+            first_play (str): Play type of the first play in all simulations, e.g. "field_goal" or "run" for go/kick decisions. Default None to sample it
+            seed (int): Seed of the random streams, default 0
+            n_jobs (int): Number of worker processes the shards are run in, default 1 to run in this process
+            shard_size (int): Number of simulations in a shard, default 4096
+            max_plays (int): Maximum number of plays in a simulation, default 300
+            verbose (bool): Print progress messages? default False
+        
+        Returns:
+            results (DataFrame): One row per simulation, from the perspective of the team in possession at the start.
+                For "game": final score_differential, plays and end. For "drive": points, value (points minus the EP of the opponent's next state), plays and end
+        '''
+        if until not in ('game', 'drive'): raise Exception('Unknown value for parameter until, use "game" or "drive"')
+        if first_play is not None and first_play not in self.play_types and first_play != 'field_goal':
+            raise Exception(f'Unknown play type {first_play}, use one of {list(self.play_types)}')
+        
+        children = np.random.SeedSequence(seed).spawn(math.ceil(n / shard_size))
+        sizes = [min(shard_size, n - i * shard_size) for i in range(len(children))]
+        args = (state, until, first_play, max_plays)
+        if verbose: print(f'Simulating {n} {until}s in {len(sizes)} shards with {n_jobs} processes')
+        
+        if n_jobs == 1:
+            shards = [self._simulate(size, child, *args) for size, child in zip(sizes, children)]
+        else:
+            with ProcessPoolExecutor(max_workers=min(n_jobs, len(sizes)), initializer=_init_worker, initargs=(self,)) as executor:
+                shards = list(executor.map(_run_shard, sizes, children, *[[a] * len(sizes) for a in args]))
+        
+        return pd.concat(shards, ignore_index=True)
+    
+    def _simulate(self, n : int, seed_sequence, state : dict, until : str, first_play : str, max_plays : int):
+        '''Simulate one shard of n simulations'''
+        rng = np.random.default_rng(seed_sequence)
+        
+        # state arrays, possession and score are kept from the home team's perspective
+        home = np.full(n, state['posteam_type'] == 'home')
+        start_home = home.copy()
+        differential = np.where(home, 1, -1) * float(state['score_differential'])
+        yardline = np.full(n, float(state['yardline_100']))
+        down = np.full(n, float(state['down']))
+        ydstogo = np.full(n, float(state['ydstogo']))
+        seconds = np.full(n, float(state['game_seconds_remaining']))
+        timeouts_home = np.full(n, float(state.get('posteam_timeouts_remaining' if home[0] else 'defteam_timeouts_remaining', 3)))
+        timeouts_away = np.full(n, float(state.get('defteam_timeouts_remaining' if home[0] else 'posteam_timeouts_remaining', 3)))
+        if state.get('second_half_posteam') is None: second_half_home = rng.random(n) < 0.5
+        else: second_half_home = np.full(n, state['second_half_posteam'] == 'home')
+        
+        live = np.ones(n, dtype=bool)
+        plays = np.zeros(n, dtype=np.int64)
+        end = np.full(n, 'max_plays', dtype=object)
+        drive_points = np.zeros(n)
+        
+        step = 0
+        with stage('simulate', rows=n):
+            while live.any() and step < max_plays:
+                i = np.flatnonzero(live)
+                h, yl, dn, togo, sec = home[i], yardline[i], down[i], ydstogo[i], seconds[i]
+                
+                # ===== play type =====
+                if step == 0 and first_play is not None:
+                    play_type = np.full(len(i), first_play, dtype=object)
+                else:
+                    features = self._features(h, differential[i], yl, dn, togo, sec, timeouts_home[i], timeouts_away[i])
+                    features['shotgun'] = (rng.random(len(i)) < self.outcomes.shotgun_rate).astype(np.float64)
+                    proba = self.next_play_model.predict_proba({f: features[FEATURE_SOURCES['next_play'].get(f, f)]
+                                                                for f in self.next_play_model.encoder.continuous + self.next_play_model.encoder.categoricals})
+                    choice = (rng.random(len(i))[:, None] > np.cumsum(proba, axis=1)).sum(axis=1)
+                    play_type = self.play_types[np.minimum(choice, len(self.play_types) - 1)]
+                
+                # ===== scrimmage plays =====
+                gained = np.zeros(len(i))
+                is_pass, is_run = play_type == 'pass', play_type == 'run'
+                gained[is_pass] = self.outcomes.sample('pass_yards', rng, int(is_pass.sum()))
+                gained[is_run] = self.outcomes.sample('run_yards', rng, int(is_run.sum()))
+                gained[play_type == 'qb_kneel'] = -1
+                scrimmage = is_pass | is_run | (play_type == 'qb_kneel') | (play_type == 'qb_spike')
+                
+                interception = is_pass & (rng.random(len(i)) < self.outcomes.interception_rate)
+                new_yardline = yl - gained
+                touchdown = scrimmage & ~interception & (new_yardline <= 0)
+                safety = scrimmage & ~interception & (new_yardline >= 100)
+                first_down = scrimmage & ~interception & ~touchdown & ~safety & (gained >= togo)
+                downs = scrimmage & ~interception & ~touchdown & ~safety & ~first_down & (dn >= 4)
+                
+                # ===== kicks, field goals and extra points after touchdowns in one call =====
+                field_goal = play_type == 'field_goal'
+                kicks = np.flatnonzero(field_goal | touchdown)
+                made = np.zeros(len(i), dtype=bool)
+                if len(kicks) != 0:
+                    kick_yardline = np.where(touchdown[kicks], 15.0, yl[kicks])
+                    proba = self.field_goal_model.predict_proba(self._kick_features(state, kick_yardline))
+                    made[kicks] = rng.random(len(kicks)) < proba[:, list(self.field_goal_model.classifier.classes_).index(1)]
+                missed_field_goal = field_goal & ~made
+                
+                punt = play_type == 'punt'
+                landing = yl[punt] - self.outcomes.sample('punt_net', rng, int(punt.sum()))
+                
+                # ===== points, from the team in possession =====
+                points = np.where(touchdown, 6 + made, 0) + np.where(field_goal & made, 3, 0) - np.where(safety, 2, 0)
+                differential[i] += np.where(h, points, -points)
+                if until == 'drive': drive_points[i] += np.where(h == start_home[i], points, -points)
+                
+                # ===== next state =====
+                change = touchdown | field_goal | safety | interception | downs | punt
+                next_yardline = np.clip(new_yardline, 1, 99)
+                next_yardline[interception | downs] = 100 - np.clip(new_yardline, 1, 99)[interception | downs]
+                next_yardline[touchdown | (field_goal & made)] = 75
+                next_yardline[safety] = 60
+                next_yardline[missed_field_goal] = np.minimum(93 - yl[missed_field_goal], 80)
+                next_yardline[punt] = np.where(landing <= 0, 80, 100 - landing)
+                
+                dn = np.where(first_down | change, 1, dn + 1)
+                togo = np.where(first_down | change, np.minimum(10, next_yardline), togo - gained)
+                h = np.where(change, ~h, h)
+                
+                elapsed = np.zeros(len(i))
+                for t in ['pass', 'run', 'field_goal', 'punt', 'qb_kneel', 'qb_spike']:
+                    m = play_type == t
+                    if m.any(): elapsed[m] = self.outcomes.sample(f'{t}_seconds', rng, int(m.sum()))
+                new_sec = np.maximum(sec - elapsed, 0)
+                
+                # second half kickoff
+                halftime = (sec > 1800) & (new_sec <= 1800)
+                h = np.where(halftime, second_half_home[i], h)
+                next_yardline[halftime], dn[halftime], togo[halftime] = 75, 1, 10
+                timeouts_home[i[halftime]] = timeouts_away[i[halftime]] = 3
+                
+                home[i], yardline[i], down[i], ydstogo[i], seconds[i] = h, next_yardline, dn, togo, new_sec
+                plays[i] += 1
+                
+                # ===== retire finished simulations =====
+                if until == 'drive':
+                    finished = change | halftime | (new_sec <= 0)
+                    result = np.select([touchdown, field_goal & made, missed_field_goal, safety, interception, downs, punt],
+                                       ['touchdown', 'field_goal', 'missed_field_goal', 'safety', 'interception', 'downs', 'punt'], 'end_of_half')
+                else:
+                    finished = new_sec <= 0
+                    result = np.full(len(i), 'end_of_game', dtype=object)
+                end[i[finished]] = result[finished]
+                live[i[finished]] = False
+                step += 1
+        
+        if until == 'game':
+            return pd.DataFrame({'score_differential': np.where(start_home, differential, -differential), 'plays': plays, 'end': end})
+        
+        # drives are valued by the EP of the state the opponent takes over, zero at the end of a half
+        value = drive_points.copy()
+        takeover = np.flatnonzero((home != start_home) & (seconds > 0) & ~np.isin(end, ['end_of_half', 'max_plays']))
+        if len(takeover) != 0:
+            t = takeover
+            features = self._features(home[t], differential[t], yardline[t], down[t], ydstogo[t], seconds[t], timeouts_home[t], timeouts_away[t])
+            proba = self.ep_model.predict_proba({f: features[FEATURE_SOURCES['ep'].get(f, f)]
+                                                 for f in self.ep_model.encoder.continuous + self.ep_model.encoder.categoricals})
+            value[t] -= proba @ np.array([NEXT_SCORE_VALUES[str(c)] for c in self.ep_model.classifier.classes_], dtype=np.float64)
+        return pd.DataFrame({'points': drive_points, 'value': value, 'plays': plays, 'end': end})
+    
+    def _features(self, home, differential, yardline, down, ydstogo, seconds, timeouts_home, timeouts_away):
+        '''Model features of states, seen from the team in possession'''
+        return {
+            'score_differential': np.where(home, differential, -differential),
+            'game_seconds_remaining': seconds,
+            'half_seconds_remaining': np.where(seconds > 1800, seconds - 1800, seconds),
+            'yardline_100': yardline,
+            'ydstogo': ydstogo,
+            'goal_to_go': (ydstogo >= yardline).astype(np.float64),
+            'posteam_type': np.where(home, 'home', 'away').astype(object),
+            'posteam_home': home.astype(np.float64),
+            'qtr': np.clip(5 - np.ceil(seconds / 900), 1, 4),
+            'down': down,
+            'posteam_timeouts_remaining': np.where(home, timeouts_home, timeouts_away),
+            'defteam_timeouts_remaining': np.where(home, timeouts_away, timeouts_home),
+        }
+    
+    def _kick_features(self, state : dict, yardline : np.ndarray):
+        '''FieldGoalModel features of kicks, weather and kicker from the state'''
+        features = {'yardline_100': yardline, 'closed': np.full(len(yardline), state.get('closed', 0)),
+                    'wind': np.full(len(yardline), state.get('wind', 0)),
+                    'kicker_player_name': np.full(len(yardline), state.get('kicker_player_name', 'Other'), dtype=object)}
+        return {f: features[f] for f in self.field_goal_model.encoder.continuous + self.field_goal_model.encoder.categoricals}
+
+
+def win_probability(results : pd.DataFrame):
+    '''Probability of winning from game simulation results, ties count as half'''
+    return float((results['score_differential'] > 0).mean() + 0.5 * (results['score_differential'] == 0).mean())
+
+
+# ========================= Worker process =========================
+
+_worker = {}
+
+def _init_worker(simulator):
+    '''Store the simulator in the worker process'''
+    _worker['simulator'] = simulator
+
+
+def _run_shard(n, seed_sequence, state, until, first_play, max_plays):
+    return _worker['simulator']._simulate(n, seed_sequence, state, until, first_play, max_plays)
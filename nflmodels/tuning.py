@@ -0,0 +1,180 @@
+import math
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+
+# default search spaces, values are sampled uniformly
+XGB_SPACE = {
+    'learning_rate': [0.02, 0.05, 0.1, 0.2, 0.3],
+    'max_depth': [3, 4, 5, 6, 8],
+    'min_child_weight': [1, 2, 4, 8],
+    'subsample': [0.6, 0.8, 1.0],
+    'colsample_bytree': [0.6, 0.8, 1.0],
+    'reg_lambda': [0.1, 1, 10],
+}
+
+LOGISTIC_SPACE = {
+    'C': [0.001, 0.01, 0.1, 1, 10, 100],
+}
+
+
+def tune(model_class, X_train, y_train, X_val, y_val, space : dict = None, n_trials : int = 27, eta : int = 3,
+         max_rounds : int = 1000, early_stopping_rounds : int = 20, n_workers : int = None, threads_per_trial : int = 1,
+         random_state : int = 0, verbose : bool = True):
+    '''
+    Random hyperparameter search with successive halving.
+    Trials are evaluated in rungs of increasing budget in a process pool, after each rung only the best 1/eta of the trials continue.
+    For XGBoost models (NextPlayModel) the budget is the number of boosting rounds: trials continue boosting from the previous rung
+    and stop early on the validation log loss. For LogisticRegression models (FieldGoalModel, EPModel) the budget is the number of training rows.
+    Training and validation data are encoded once per worker process (a DMatrix for XGBoost) and shared by all of its trials.
+    
+    Parameters:
+        model_class (class): NFLModel subclass, e.g. NextPlayModel
+        X_train, y_train: Training data, for XGBoost the target must be integer encoded (map_target_to_int=True)
+        X_val, y_val: Validation data used to rank trials
+        space (dict): Lists of values to sample for each parameter, default None for XGB_SPACE or LOGISTIC_SPACE
+        n_trials (int): Number of sampled configurations, default 27
+        eta (int): Reduction factor between rungs, default 3
+        max_rounds (int): Boosting rounds in the last rung, XGBoost only, default 1000
+        early_stopping_rounds (int): Stop boosting if validation log loss has not improved in this many rounds, XGBoost only, default 20
+        n_workers (int): Number of worker processes, default None for cpu count // threads_per_trial
+        threads_per_trial (int): Thread budget of each trial, default 1
+        random_state (int): Seed for sampling configurations and training rows, default 0
+        verbose (bool): Print progress messages? default True
+    
+    Returns:
+        (model (NFLModel), trials (DataFrame)): Model configured with the best parameters and fitted on the training data, and the results of all trials
+    '''
+    
+    is_xgb = type(model_class().classifier).__module__.startswith('xgboost')
+    if space is None: space = XGB_SPACE if is_xgb else LOGISTIC_SPACE
+    
+    rng = np.random.default_rng(random_state)
+    configs = []
+    while len(configs) < n_trials:
+        config = {k: v[rng.integers(len(v))] for k, v in space.items()}
+        # values are python scalars so that they are passed as is to the classifiers
+        configs.append({k: v.item() if isinstance(v, np.generic) else v for k, v in config.items()})
+    
+    n_rungs = int(math.log(n_trials, eta) + 1e-9) + 1
+    if is_xgb: budgets = [max(1, int(max_rounds / eta ** (n_rungs - 1 - r))) for r in range(n_rungs)]
+    else: budgets = [max(1, int(len(X_train) / eta ** (n_rungs - 1 - r))) for r in range(n_rungs)]
+    
+    if n_workers is None: n_workers = max(1, (os.cpu_count() or 1) // threads_per_trial)
+    if verbose: print(f'Tuning {model_class.__name__}: {n_trials} trials in {n_rungs} rungs with budgets {budgets}, {n_workers} processes')
+    
+    trials = [{'trial': i, 'params': config, 'rung': 0, 'score': np.inf, 'rounds': None, 'done': False, 'state': None}
+              for i, config in enumerate(configs)]
+    alive = list(trials)
+    
+    with ProcessPoolExecutor(max_workers=min(n_workers, n_trials), initializer=_init_worker,
+                             initargs=(is_xgb, model_class.DEFAULT_PARAMS, X_train, y_train, X_val, y_val, 
+                                       threads_per_trial, early_stopping_rounds, random_state)) as executor:
+        for rung, budget in enumerate(budgets):
+            running = [t for t in alive if not t['done']]
+            futures = [executor.submit(_run_trial, t['params'], budget, t['state']) for t in running]
+            for t, future in zip(running, futures):
+                t['score'], t['rounds'], t['done'], t['state'] = future.result()
+                t['rung'] = rung
+            
+            alive.sort(key=lambda t: t['score'])
+            if verbose: print(f'Rung {rung}: budget {budget}, best log loss {alive[0]["score"]:.4f}')
+            
+            # prune losing trials
+            if rung < n_rungs - 1: alive = alive[:max(1, len(alive) // eta)]
+    
+    best = alive[0]
+    if verbose: print(f'Best parameters: {best["params"]}')
+    
+    # final model on the full training data, with the number of rounds found by early stopping
+    params = dict(best['params'])
+    if is_xgb: params['n_estimators'] = best['rounds']
+    # n_jobs is deprecated in LogisticRegression, also when it is one of the model's default parameters
+    params['n_jobs'] = -1 if is_xgb else None
+    model = model_class(**params)
+    model.fit(X_train, y_train)
+    
+    results = pd.DataFrame([{'trial': t['trial'], 'rung': t['rung'], 'log_loss': t['score'], 'rounds': t['rounds'], **t['params']} for t in trials])
+    return model, results.sort_values(['rung', 'log_loss'], ascending=[False, True]).reset_index(drop=True)
+
+
+# ========================= Worker process =========================
+
+_worker = {}
+
+def _init_worker(is_xgb, default_params, X_train, y_train, X_val, y_val, threads, early_stopping_rounds, random_state):
+    '''Encode the data once in the worker process'''
+    y_train = np.asarray(y_train).ravel()
+    y_val = np.asarray(y_val).ravel()
+    _worker.update(is_xgb=is_xgb, default_params=default_params, threads=threads, early_stopping_rounds=early_stopping_rounds)
+    
+    if is_xgb:
+        import xgboost as xgb
+        _worker['dtrain'] = xgb.DMatrix(X_train, label=y_train, nthread=threads)
+        _worker['dval'] = xgb.DMatrix(X_val, label=y_val, nthread=threads)
+        _worker['n_classes'] = int(max(y_train.max(), y_val.max())) + 1
+    else:
+        # a fixed row order, the first budget rows are used in a rung
+        order = np.random.default_rng(random_state).permutation(len(y_train))
+        _worker['X_train'] = np.asarray(X_train, dtype=np.float64)[order]
+        _worker['y_train'] = y_train[order]
+        _worker['X_val'] = np.asarray(X_val, dtype=np.float64)
+        _worker['y_val'] = y_val
+
+
+def _run_trial(params, budget, state):
+    '''Run a trial up to budget, returns (score, rounds, done, state)'''
+    if _worker['is_xgb']: return _run_xgb_trial(params, budget, state)
+    return _run_logistic_trial(params, budget)
+
+
+def _run_xgb_trial(params, budget, state):
+    '''Continue boosting up to budget rounds, state is (raw booster, best score, best number of rounds)'''
+    import xgboost as xgb
+    
+    booster, best_score, best_rounds = None, np.inf, 0
+    if state is not None:
+        booster = xgb.Booster(model_file=bytearray(state[0]))
+        best_score, best_rounds = state[1], state[2]
+    
+    n_classes = _worker['n_classes']
+    train_params = {**params, 'nthread': _worker['threads'],
+                    'objective': 'multi:softprob' if n_classes > 2 else 'binary:logistic',
+                    'eval_metric': 'mlogloss' if n_classes > 2 else 'logloss'}
+    if n_classes > 2: train_params['num_class'] = n_classes
+    
+    done_rounds = booster.num_boosted_rounds() if booster is not None else 0
+    evals_result = {}
+    booster = xgb.train(train_params, _worker['dtrain'], num_boost_round=budget - done_rounds, evals=[(_worker['dval'], 'val')],
+                        early_stopping_rounds=_worker['early_stopping_rounds'], evals_result=evals_result, xgb_model=booster, verbose_eval=False)
+    
+    scores = evals_result['val'][train_params['eval_metric']]
+    i = int(np.argmin(scores))
+    if scores[i] < best_score: best_score, best_rounds = float(scores[i]), done_rounds + i + 1
+    
+    # stopped early, more rounds would not improve the trial
+    done = booster.num_boosted_rounds() < budget
+    
+    return best_score, best_rounds, done, (bytes(booster.save_raw('ubj')), best_score, best_rounds)
+
+
+def _run_logistic_trial(params, budget):
+    '''Fit on the first budget training rows'''
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.metrics import log_loss
+    from threadpoolctl import threadpool_limits
+    
+    # n_jobs is deprecated in LogisticRegression, the solver threads are limited by threadpool_limits
+    params = {k: v for k, v in {**_worker['default_params'], **params}.items() if k != 'n_jobs'}
+    with threadpool_limits(limits=_worker['threads']):
+        clf = LogisticRegression(**params)
+        try:
+            clf.fit(_worker['X_train'][:budget], _worker['y_train'][:budget])
+            score = log_loss(_worker['y_val'], clf.predict_proba(_worker['X_val']), labels=clf.classes_)
+        except ValueError:
+            # too few rows for all classes to be present
+            score = np.inf
+    
+    return score, None, False, None
@@ -1,68 +1,389 @@
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-sns.set_style('whitegrid')
 
-from sklearn.metrics import RocCurveDisplay, ConfusionMatrixDisplay, classification_report, cohen_kappa_score
+# matplotlib is imported on first plot, it is slow to import and not needed outside plotting.
+# The validation sets are aggregated with NumPy into small tables first, plots only draw the tables.
+# Figures saved to a path are drawn on a matplotlib Figure without pyplot, so that no interactive backend or display is needed.
 
-def valplot_fieldgoal(X_val : pd.DataFrame, y_val : pd.DataFrame, y_pred, y_pred_proba):
+# matplotlib style of the plots, the seaborn whitegrid style shipped with matplotlib
+PLOT_STYLE = 'seaborn-v0_8-whitegrid'
+
+
+def valplot_fieldgoal(X_val : pd.DataFrame, y_val : pd.DataFrame, y_pred, y_pred_proba, path : str = None, plot : bool = True, bins : int = 12):
     '''
-    Plot validation performance figures from FieldGoalModel predictions.
+    Validation performance tables and figures from FieldGoalModel predictions.
+    
+    Parameters:
+        X_val (DataFrame): Validation features, with yardline_100 and closed columns
+        y_val (DataFrame or Series): True results, 1 for a made kick
+        y_pred (array-like): Predicted results, not used, kept for a common signature with the other valplot functions
+        y_pred_proba (ndarray): Predicted probabilities, the second column is the success chance
+        path (str): Save the figure to this file instead of showing it, default None
+        plot (bool): Plot the tables? default True, False only returns the tables
+        bins (int): Number of calibration bins, default 12
+    
+    Returns:
+        dict of tables: roc (DataFrame), roc_auc (float), calibration (DataFrame), yardline (DataFrame)
     '''
-    fig, ax = plt.subplots(1, 3, figsize=(21,6))
-
-    # 1. ROC curve
-    RocCurveDisplay.from_predictions(y_val, y_pred_proba[:,1], ax=ax[0], color='maroon')
-    ax[0].set_title('ROC Curve, validation set')
-    ax[0].plot([0,1], [0,1], color='black', linestyle='--', linewidth=2)
-
-    # 2. Accuracy of predicted probabilities
-    # For predicted success %, what portion of attempts were actually successful
-    # Yellow line decipts optimal performance where the predicted success chance matches the proportion of successful attempts 
-    sns.histplot(x=y_pred_proba[:,1], hue=y_val, ax=ax[1], multiple='fill', stat='probability', palette='RdBu', hue_norm=(0,1), bins=12, alpha=0.9)
-    ax[1].plot([0,1], [0,1], color='yellow', linestyle='--', linewidth=2)
-    ax[1].set_xlim(0.3, 1)
-    ax[1].set_ylim(0.3, 1)
-    ax[1].set_xlabel('Predicted success chance')
-    ax[1].set_ylabel('Distribution of true results')
-    ax[1].set_title('Predicted % accuracy, validation set')
-
-    # 3. Predicted success by distance to end zone, validation set
-    sns.lineplot(data=X_val, x='yardline_100', y=y_pred_proba[:,1], ax=ax[2], palette='RdBu', hue_norm=(0,1), #legend=None,
-                #hue=X_val[[item for item in list(clf.feature_names_in_) if item.startswith('kicker_player_name_')]].idxmax(axis=1).str.split('_').str[-1]
-                hue='closed'
-                )
-    ax[2].set_ylabel('Success chance')
-    ax[2].set_xlabel('Yards to goal line')
-    ax[2].set_ylim(0,1)
-    ax[2].set_yticks([0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1])
-    ax[2].set_xlim(0, 60)
-    ax[2].set_xticks([0, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60])
-    ax[2].set_title('Predicted success chance by distance to end zone, validation set')
-
-    plt.tight_layout()
-    plt.show()
-
-
-def valplot_nextplay(X_val : pd.DataFrame, y_val : pd.DataFrame, y_pred, y_pred_proba, labels=None):
+    y_true = np.asarray(y_val, dtype=np.float64).ravel()
+    proba = np.asarray(y_pred_proba, dtype=np.float64)[:, 1]
+    
+    tables = {}
+    tables['roc'], tables['roc_auc'] = roc_table(y_true, proba)
+    tables['calibration'] = calibration_table(y_true, proba, bins=bins)
+    tables['yardline'] = curve_table(X_val['yardline_100'], proba, observed=y_true, groups=X_val['closed'] if 'closed' in X_val else None)
+    if not plot: return tables
+    
+    with _style():
+        fig, ax = _figure(1, 3, (21, 6), path)
+        
+        # 1. ROC curve
+        roc = tables['roc']
+        ax[0].plot(roc['fpr'], roc['tpr'], color='maroon', linewidth=2, label='AUC = {:.3f}'.format(tables['roc_auc']))
+        ax[0].plot([0,1], [0,1], color='black', linestyle='--', linewidth=2)
+        ax[0].set_xlabel('False positive rate')
+        ax[0].set_ylabel('True positive rate')
+        ax[0].legend(loc='lower right')
+        ax[0].set_title('ROC Curve, validation set')
+        
+        # 2. Accuracy of predicted probabilities
+        # For predicted success %, what portion of attempts were actually successful
+        # Yellow line decipts optimal performance where the predicted success chance matches the proportion of successful attempts
+        calibration = tables['calibration'][tables['calibration']['count'] > 0]
+        width = 1 / bins
+        ax[1].bar(calibration['bin_start'], calibration['observed'], width=width, align='edge', color='#2166ac', alpha=0.9, label='Made')
+        ax[1].bar(calibration['bin_start'], 1 - calibration['observed'], width=width, bottom=calibration['observed'], align='edge',
+                  color='#b2182b', alpha=0.9, label='Missed')
+        ax[1].plot([0,1], [0,1], color='yellow', linestyle='--', linewidth=2)
+        ax[1].set_xlim(0.3, 1)
+        ax[1].set_ylim(0.3, 1)
+        ax[1].set_xlabel('Predicted success chance')
+        ax[1].set_ylabel('Distribution of true results')
+        ax[1].legend(loc='lower right')
+        ax[1].set_title('Predicted % accuracy, validation set')
+        
+        # 3. Predicted success by distance to end zone, validation set
+        _draw_curves(ax[2], tables['yardline'], 'yardline_100', 'closed')
+        ax[2].set_ylabel('Success chance')
+        ax[2].set_xlabel('Yards to goal line')
+        ax[2].set_ylim(0,1)
+        ax[2].set_yticks([0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1])
+        ax[2].set_xlim(0, 60)
+        ax[2].set_xticks([0, 5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60])
+        ax[2].set_title('Predicted success chance by distance to end zone, validation set')
+        
+        _finish(fig, path)
+    
+    return tables
+
+
+def valplot_nextplay(X_val : pd.DataFrame, y_val : pd.DataFrame, y_pred, y_pred_proba, labels=None, path : str = None, plot : bool = True,
+                     verbose : bool = True):
     '''
-    Plot validation performance figures from NextPlayModel predictions.
+    Validation performance tables and figures from NextPlayModel predictions.
+    
+    Parameters:
+        X_val (DataFrame): Validation features, not used, kept for a common signature with the other valplot functions
+        y_val (DataFrame or Series): True play types
+        y_pred (array-like): Predicted play types
+        y_pred_proba (ndarray): Predicted probabilities, not used
+        labels (list): Names of the play types, for integer encoded play types (map_target_to_int), default None
+        path (str): Save the figure to this file instead of showing it, default None
+        plot (bool): Plot the tables? default True, False only returns the tables
+        verbose (bool): Print the classification report and Cohen kappa score? default True
+    
+    Returns:
+        dict of tables: confusion (DataFrame), report (DataFrame), kappa (float)
     '''
-    fig, ax = plt.subplots(figsize=(6,6))
+    confusion = confusion_table(y_val, y_pred)
+    if labels is not None and len(labels) == len(confusion):
+        confusion = confusion.set_axis(labels, axis=0).set_axis(labels, axis=1)
+    
+    tables = {'confusion': confusion, 'report': report_table(confusion), 'kappa': kappa_score(confusion)}
+    
+    if verbose:
+        print(tables['report'].round(2))
+        print('Cohen kappa score: {:.3f}'.format(tables['kappa']))
+    if not plot: return tables
+    
+    with _style():
+        fig, ax = _figure(1, 1, (6, 6), path)
+        _draw_confusion(ax, confusion)
+        _finish(fig, path)
+    
+    return tables
 
-    ConfusionMatrixDisplay.from_predictions(y_val, y_pred, ax=ax, cmap='Blues', display_labels = labels)
 
-    ax.grid(False)
-    plt.show()
+def valplot_ep(X_val : pd.DataFrame, y_val : pd.DataFrame, y_pred, y_pred_proba, classes=None, path : str = None, plot : bool = True,
+               bins : int = 10):
+    '''
+    Validation performance tables and figures from EPModel predictions.
+    
+    Parameters:
+        X_val (DataFrame): Validation features, with a yardline_100 column and a down column for per down curves
+        y_val (DataFrame or Series): True next scoring events
+        y_pred (array-like): Predicted next scoring events
+        y_pred_proba (ndarray): Predicted probabilities
+        classes (array-like): Next scoring events in the column order of y_pred_proba (model.classifier.classes_),
+            default None for the sorted events of y_val
+        path (str): Save the figure to this file instead of showing it, default None
+        plot (bool): Plot the tables? default True, False only returns the tables
+        bins (int): Number of calibration bins, default 10
+    
+    Returns:
+        dict of tables: calibration (DataFrame, per next scoring event), yardline (DataFrame), confusion (DataFrame)
+    '''
+    from nflmodels.preprocessing import NEXT_SCORE_VALUES
+    
+    y_true = np.asarray(y_val).ravel().astype(str)
+    proba = np.asarray(y_pred_proba, dtype=np.float64)
+    classes = np.unique(y_true) if classes is None else np.asarray(classes).astype(str)
+    if len(classes) != proba.shape[1]:
+        raise Exception(f'y_pred_proba has {proba.shape[1]} columns but there are {len(classes)} classes, pass classes=model.classifier.classes_')
+    
+    # calibration of the probability of each next scoring event
+    tables = {}
+    tables['calibration'] = pd.concat([calibration_table(y_true == c, proba[:, i], bins=bins).assign(next_score=c)
+                                       for i, c in enumerate(classes)], ignore_index=True)
+    
+    # expected points and the points of the true next scoring events
+    points = np.array([NEXT_SCORE_VALUES[c] for c in classes], dtype=np.float64)
+    observed = pd.Series(y_true).map(NEXT_SCORE_VALUES).to_numpy(dtype=np.float64, na_value=np.nan)
+    groups = X_val['down'] if 'down' in X_val else None
+    tables['yardline'] = curve_table(X_val['yardline_100'], proba @ points, observed=observed, groups=groups)
+    
+    tables['confusion'] = confusion_table(y_true, np.asarray(y_pred).ravel().astype(str), classes=classes)
+    if not plot: return tables
+    
+    with _style():
+        fig, ax = _figure(1, 3, (21, 6), path)
+        
+        # 1. Predicted probability of each next scoring event against its observed frequency
+        for c, table in tables['calibration'].groupby('next_score', sort=False):
+            table = table[table['count'] > 0]
+            ax[0].plot(table['predicted'], table['observed'], marker='o', label=c)
+        ax[0].plot([0,1], [0,1], color='black', linestyle='--', linewidth=2)
+        ax[0].set_xlim(0, 1)
+        ax[0].set_ylim(0, 1)
+        ax[0].set_xlabel('Predicted probability')
+        ax[0].set_ylabel('Observed frequency')
+        ax[0].legend(title='Next score')
+        ax[0].set_title('Calibration by next scoring event, validation set')
+        
+        # 2. Expected points by distance to end zone, lines are predicted and markers observed
+        _draw_curves(ax[1], tables['yardline'], 'yardline_100', 'down', observed=True)
+        ax[1].axhline(0, color='black', linewidth=1)
+        ax[1].set_xlim(0, 100)
+        ax[1].set_xlabel('Yards to goal line')
+        ax[1].set_ylabel('Expected points')
+        ax[1].set_title('Expected points by distance to end zone, validation set')
+        
+        # 3. Most probable against true next scoring event
+        _draw_confusion(ax[2], tables['confusion'])
+        
+        _finish(fig, path)
+    
+    return tables
 
-    # print prediction metrics
-    print(classification_report(y_val, y_pred))
-    print('Cohen kappa score: {:.3f}'.format(cohen_kappa_score(y_val, y_pred)))
 
+def calibration_table(y_true, proba, bins : int = 12):
+    '''
+    Calibration bins of the predicted probabilities of a binary outcome.
+    
+    Parameters:
+        y_true (array-like): True outcomes, 1 or True for the positive outcome
+        proba (array-like): Predicted probabilities of the positive outcome
+        bins (int): Number of equal width bins between 0 and 1, default 12
+    
+    Returns:
+        DataFrame with one row per bin: bin_start, bin_end, count, predicted (mean probability), observed (rate of the outcome)
+    '''
+    y_true = np.asarray(y_true, dtype=np.float64).ravel()
+    proba = np.asarray(proba, dtype=np.float64).ravel()
+    
+    b = np.clip((proba * bins).astype(np.int64), 0, bins - 1)
+    count = np.bincount(b, minlength=bins)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        predicted = np.bincount(b, weights=proba, minlength=bins) / count
+        observed = np.bincount(b, weights=y_true, minlength=bins) / count
+    
+    edges = np.linspace(0, 1, bins + 1)
+    return pd.DataFrame({'bin_start': edges[:-1], 'bin_end': edges[1:], 'count': count, 'predicted': predicted, 'observed': observed})
 
-def valplot_ep(X_val : pd.DataFrame, y_val : pd.DataFrame, y_pred, y_pred_proba):
+
+def curve_table(x, predicted, observed=None, groups=None):
+    '''
+    Mean predicted (and observed) values by integer x, e.g. yardline_100, and optionally by group.
+    
+    Parameters:
+        x (array-like): Values of the x axis, rounded to integers
+        predicted (array-like): Predicted values
+        observed (array-like): Observed values, default None
+        groups (Series or array-like): Group of each row, e.g. down, default None
+    
+    Returns:
+        DataFrame with one row per group and x present in the data: group, x, count, predicted and observed means.
+        The group and x columns are named like the Series, group and x otherwise
+    '''
+    x_name = getattr(x, 'name', None) or 'x'
+    group_name = getattr(groups, 'name', None) or 'group'
+    x = np.asarray(x, dtype=np.float64).ravel()
+    predicted = np.asarray(predicted, dtype=np.float64).ravel()
+    if observed is not None: observed = np.asarray(observed, dtype=np.float64).ravel()
+    
+    # rows without x are left out
+    valid = ~np.isnan(x)
+    if not valid.all():
+        x, predicted = x[valid], predicted[valid]
+        if observed is not None: observed = observed[valid]
+        if groups is not None: groups = np.asarray(groups)[valid]
+    x = np.rint(x).astype(np.int64)
+    x_min = x.min() if len(x) != 0 else 0
+    span = x.max() - x_min + 1 if len(x) != 0 else 1
+    
+    if groups is not None:
+        group_values, g = np.unique(np.asarray(groups), return_inverse=True)
+    else:
+        group_values, g = np.array([None]), np.zeros(len(x), dtype=np.int64)
+    
+    key = g.ravel() * span + (x - x_min)
+    size = len(group_values) * span
+    count = np.bincount(key, minlength=size)
+    present = np.flatnonzero(count)
+    
+    table = {}
+    if groups is not None: table[group_name] = group_values[present // span]
+    table[x_name] = present % span + x_min
+    table['count'] = count[present]
+    table['predicted'] = np.bincount(key, weights=predicted, minlength=size)[present] / count[present]
+    if observed is not None: table['observed'] = np.bincount(key, weights=observed, minlength=size)[present] / count[present]
+    return pd.DataFrame(table)
+
+
+def roc_table(y_true, score, bins : int = 1000):
+    '''
+    ROC curve of a binary outcome from histograms of the scores of both outcomes, exact up to the histogram resolution.
+    
+    Parameters:
+        y_true (array-like): True outcomes, 1 or True for the positive outcome
+        score (array-like): Predicted probabilities of the positive outcome
+        bins (int): Number of score bins between 0 and 1, default 1000
+    
+    Returns:
+        (DataFrame with threshold, fpr and tpr columns, ROC AUC (float))
     '''
-    Plot validation performance figures from EPModel predictions.
+    y_true = np.asarray(y_true).ravel().astype(bool)
+    b = np.clip((np.asarray(score, dtype=np.float64).ravel() * bins).astype(np.int64), 0, bins - 1)
+    pos = np.bincount(b[y_true], minlength=bins)
+    neg = np.bincount(b[~y_true], minlength=bins)
+    if pos.sum() == 0 or neg.sum() == 0: raise Exception('y_true must contain both outcomes.')
+    
+    # thresholds from the highest bin down, a row is predicted positive if its score is in or above the bin
+    tpr = np.concatenate([[0], np.cumsum(pos[::-1]) / pos.sum()])
+    fpr = np.concatenate([[0], np.cumsum(neg[::-1]) / neg.sum()])
+    threshold = np.concatenate([[1], np.arange(bins)[::-1] / bins])
+    
+    # negatives in lower bins rank below, ties within a bin count as half (like MetricsAccumulator)
+    below = np.cumsum(neg) - neg
+    auc = (pos * (below + neg / 2)).sum() / (pos.sum() * neg.sum())
+    return pd.DataFrame({'threshold': threshold, 'fpr': fpr, 'tpr': tpr}), float(auc)
+
+
+def confusion_table(y_true, y_pred, classes=None):
     '''
-    return
\ No newline at end of file
+    Confusion matrix of predicted classes.
+    
+    Parameters:
+        y_true (array-like): True classes
+        y_pred (array-like): Predicted classes
+        classes (array-like): Classes in the order of the table, default None for the sorted classes of y_true and y_pred
+    
+    Returns:
+        DataFrame of counts, true classes as the index and predicted classes as the columns
+    '''
+    y_true, y_pred = np.asarray(y_true).ravel(), np.asarray(y_pred).ravel()
+    classes = np.unique(np.concatenate([y_true, y_pred])) if classes is None else np.asarray(classes)
+    
+    order = np.argsort(classes)
+    sorted_classes = classes[order]
+    k = len(classes)
+    
+    def index(y):
+        position = np.minimum(np.searchsorted(sorted_classes, y), k - 1)
+        if not np.all(sorted_classes[position] == y): raise Exception('y_true or y_pred contain labels not in classes.')
+        return order[position]
+    
+    counts = np.bincount(index(y_true) * k + index(y_pred), minlength=k * k).reshape(k, k)
+    return pd.DataFrame(counts, index=pd.Index(classes, name='true'), columns=pd.Index(classes, name='predicted'))
+
+
+def report_table(confusion : pd.DataFrame):
+    '''Precision, recall, F1 score and support of each class from a confusion_table'''
+    counts = confusion.to_numpy()
+    tp = np.diag(counts)
+    support, predicted = counts.sum(axis=1), counts.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(predicted > 0, tp / predicted, 0)
+        recall = np.where(support > 0, tp / support, 0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0)
+    return pd.DataFrame({'precision': precision, 'recall': recall, 'f1-score': f1, 'support': support}, index=confusion.index)
+
+
+def kappa_score(confusion : pd.DataFrame):
+    '''Cohen kappa score from a confusion_table'''
+    counts = confusion.to_numpy().astype(np.float64)
+    n = counts.sum()
+    agreement = np.trace(counts) / n
+    chance = (counts.sum(axis=1) * counts.sum(axis=0)).sum() / n ** 2
+    return float((agreement - chance) / (1 - chance)) if chance != 1 else np.nan
+
+
+def _style():
+    '''Context of the plot style'''
+    import matplotlib.style
+    return matplotlib.style.context(PLOT_STYLE)
+
+
+def _figure(nrows : int, ncols : int, figsize : tuple, path : str):
+    '''Figure and axes, a pyplot figure to show or a Figure drawn with the non-interactive Agg canvas when saved to path'''
+    if path is None:
+        import matplotlib.pyplot as plt
+        return plt.subplots(nrows, ncols, figsize=figsize)
+    
+    from matplotlib.figure import Figure
+    fig = Figure(figsize=figsize)
+    return fig, fig.subplots(nrows, ncols)
+
+
+def _finish(fig, path : str):
+    '''Save the figure to path, or show it'''
+    fig.tight_layout()
+    if path is None:
+        import matplotlib.pyplot as plt
+        plt.show()
+    else:
+        fig.savefig(path)
+
+
+def _draw_curves(ax, table : pd.DataFrame, x : str, group : str, observed : bool = False):
+    '''Predicted means of a curve_table as lines, one per group, observed means as markers'''
+    groups = table.groupby(group, sort=True) if group in table else [(None, table)]
+    for value, curve in groups:
+        line, = ax.plot(curve[x], curve['predicted'], linewidth=2, label=None if value is None else f'{group} = {value}')
+        if observed: ax.scatter(curve[x], curve['observed'], s=8, alpha=0.5, color=line.get_color())
+    if group in table: ax.legend()
+
+
+def _draw_confusion(ax, confusion : pd.DataFrame):
+    '''Confusion matrix as a heatmap with the counts'''
+    counts = confusion.to_numpy()
+    ax.imshow(counts, cmap='Blues')
+    threshold = counts.max() / 2
+    for i in range(counts.shape[0]):
+        for j in range(counts.shape[1]):
+            ax.text(j, i, counts[i, j], ha='center', va='center', color='white' if counts[i, j] > threshold else 'black')
+    ax.set_xticks(np.arange(counts.shape[1]), [str(c) for c in confusion.columns], rotation=45, ha='right')
+    ax.set_yticks(np.arange(counts.shape[0]), [str(c) for c in confusion.index])
+    ax.set_xlabel('Predicted label')
+    ax.set_ylabel('True label')
+    ax.grid(False)
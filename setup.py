@@ -8,6 +8,7 @@ setup(
     author='epaunonen',
     author_email='',
     license='MIT',
-    packages=['nflmodels'],
+    packages=['nflmodels', 'nflmodels.dataloader'],
+    install_requires=['numpy', 'pandas', 'scikit-learn', 'xgboost', 'threadpoolctl', 'pyarrow', 'matplotlib', 'pg8000'],
     zip_safe=False,
 )
\ No newline at end of file
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from nflmodels.backtest import backtest, _init_worker, _run_fold
+from nflmodels.dataloader import SyntheticLoader
+from nflmodels.models import FieldGoalModel, EPModel
+from nflmodels.preprocessing import preprocess_field_goal
+
+
+@pytest.fixture(scope='module')
+def field_goals():
+    data = SyntheticLoader(n_rows=20000, seed=0).select(select_preset=True).load(verbose=False)
+    X, y = preprocess_field_goal(data, return_X_y=True, verbose=False)
+    return X, y, data.loc[X.index, 'season'].to_numpy()
+
+
+@pytest.mark.filterwarnings('error::FutureWarning')
+def test_fold_without_n_jobs(field_goals):
+    X, y, seasons = field_goals
+    
+    # folds run in worker processes, where warnings are not seen by pytest
+    _init_worker(FieldGoalModel, X, y, seasons, None, 1)
+    result = _run_fold(seasons.min(), seasons.min() + 1)
+    assert result['val_season'] == seasons.min() + 1
+    assert EPModel().classifier.get_params()['n_jobs'] is None
+
+
+def test_backtest_folds(field_goals):
+    X, y, seasons = field_goals
+    results = backtest(FieldGoalModel, X, y, seasons, min_train_seasons=6, n_workers=1, verbose=False)
+    assert list(results['val_season']) == list(np.unique(seasons)[6:])
@@ -0,0 +1,125 @@
+import functools
+import importlib
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+from nflmodels.cache import PreprocessingCache
+from nflmodels.dataloader import SyntheticLoader
+from nflmodels.encoder import FeatureEncoder
+from nflmodels.preprocessing import preprocess_field_goal, preprocess_next_play
+
+
+@pytest.fixture(scope='module')
+def data():
+    return SyntheticLoader(n_rows=100000, seed=0).select(select_preset=True).load(verbose=False)
+
+
+def _counted(func):
+    '''func with a counter of its calls, keyed like func by the cache'''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        wrapper.calls += 1
+        return func(*args, **kwargs)
+    wrapper.calls = 0
+    return wrapper
+
+
+def test_hit_does_not_call_preprocessor(tmp_path, data):
+    cache = PreprocessingCache(str(tmp_path))
+    func = _counted(preprocess_next_play)
+    
+    expected = cache(func, data, return_X_y=True, verbose=False)
+    assert func.calls == 1
+    output = cache(func, data, return_X_y=True, verbose=False)
+    assert func.calls == 1
+    pd.testing.assert_frame_equal(output[0], expected[0])
+    
+    # a single text value changed in a row in the middle of the data is a miss
+    changed = data.copy()
+    row = len(changed) // 2 + 1
+    changed.iloc[row, changed.columns.get_loc('play_type')] = 'run' if changed['play_type'].iloc[row] != 'run' else 'pass'
+    cache(func, changed, return_X_y=True, verbose=False)
+    assert func.calls == 2
+
+
+def test_key_covers_required_columns(tmp_path, data):
+    cache = PreprocessingCache(str(tmp_path))
+    key = cache.key(preprocess_field_goal, data, return_X_y=True)
+    
+    # a column preprocess_field_goal does not read
+    other = data.copy()
+    other['ydstogo'] = other['ydstogo'] + 1
+    assert cache.key(preprocess_field_goal, other, return_X_y=True) == key
+    
+    # a single value of a column it reads, outside the sampled rows
+    changed = data.copy()
+    row = np.flatnonzero(changed['yardline_100'].notna().to_numpy())[1]
+    changed.iloc[row, changed.columns.get_loc('yardline_100')] += 1
+    assert cache.key(preprocess_field_goal, changed, return_X_y=True) != key
+    
+    # values swapped between rows keep the column sums
+    swapped = data.copy()
+    values = swapped['yardline_100'].to_numpy(copy=True)
+    rows = [i for i in range(1, 20) if not np.isnan(values[i])]
+    a, b = next((a, b) for a in rows for b in rows if values[a] != values[b])
+    values[[a, b]] = values[[b, a]]
+    swapped['yardline_100'] = values
+    assert cache.key(preprocess_field_goal, swapped, return_X_y=True) != key
+    
+    assert cache.key(preprocess_field_goal, data.iloc[1:], return_X_y=True) != key
+    assert cache.key(preprocess_field_goal, data, return_X_y=True, use_wind=False) != key
+
+
+def test_encoder_argument(tmp_path, data):
+    cache = PreprocessingCache(str(tmp_path))
+    
+    # unfitted encoders have the same key in every process, fitted ones are keyed on their layout
+    key = cache.key(preprocess_field_goal, data, return_X_y=True, encoder=FeatureEncoder())
+    assert cache.key(preprocess_field_goal, data, return_X_y=True, encoder=FeatureEncoder()) == key
+    
+    fitted = FeatureEncoder()
+    X, y = cache(preprocess_field_goal, data, return_X_y=True, encoder=fitted, verbose=False)
+    assert fitted.fitted
+    assert cache.key(preprocess_field_goal, data, return_X_y=True, encoder=fitted) != key
+    
+    # a hit fits the encoder that was passed in
+    encoder = FeatureEncoder()
+    X_hit, _ = cache(preprocess_field_goal, data, return_X_y=True, encoder=encoder, verbose=False)
+    assert encoder.fitted
+    assert encoder.to_dict() == fitted.to_dict()
+    np.testing.assert_array_equal(encoder.transform(X), fitted.transform(X))
+    pd.testing.assert_frame_equal(X_hit, X)
+
+
+HELPER_MODULE = """
+import pandas as pd
+
+OFFSET = {offset}
+
+def _helper(values):
+    return values + OFFSET
+
+def preprocess_plays(data : pd.DataFrame, verbose : bool = True):
+    return _helper(data[['yardline_100']])
+"""
+
+
+def test_changed_helper_is_a_miss(tmp_path, monkeypatch, data):
+    cache = PreprocessingCache(str(tmp_path / 'cache'))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    # the edited source has the same size and may have the same modification time, no stale bytecode is read
+    monkeypatch.setattr(sys, 'dont_write_bytecode', True)
+    module_path = tmp_path / 'nflmodels_cache_helper.py'
+    
+    module_path.write_text(HELPER_MODULE.format(offset=1))
+    module = importlib.import_module('nflmodels_cache_helper')
+    monkeypatch.setitem(sys.modules, 'nflmodels_cache_helper', module)
+    key = cache.key(module.preprocess_plays, data)
+    assert cache(module.preprocess_plays, data, verbose=False)['yardline_100'].iloc[0] == data['yardline_100'].iloc[0] + 1
+    
+    # only the helper changes, the code of preprocess_plays is the same
+    module_path.write_text(HELPER_MODULE.format(offset=2))
+    module = importlib.reload(module)
+    assert cache.key(module.preprocess_plays, data) != key
+    assert cache(module.preprocess_plays, data, verbose=False)['yardline_100'].iloc[0] == data['yardline_100'].iloc[0] + 2
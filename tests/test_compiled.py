@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from nflmodels.compiled import CompiledModel, COMPILED_TOLERANCE
+from nflmodels.dataloader import SyntheticLoader
+from nflmodels.encoder import FeatureEncoder
+from nflmodels.models import NextPlayModel, FieldGoalModel
+from nflmodels.preprocessing import preprocess_field_goal, preprocess_next_play
+
+
+@pytest.fixture(scope='module')
+def data():
+    return SyntheticLoader(n_rows=10000, seed=0).select(select_preset=True).load(verbose=False)
+
+
+def _next_play(data):
+    X, y, _ = preprocess_next_play(data, return_X_y=True, map_target_to_int=True, verbose=False)
+    return X, np.asarray(y).ravel()
+
+
+def _field_goal(data):
+    X, y = preprocess_field_goal(data, return_X_y=True, verbose=False)
+    return X, np.asarray(y).ravel()
+
+
+# multiclass XGBoost, binary XGBoost and LogisticRegression
+CASES = {
+    'xgb_multiclass': (NextPlayModel, _next_play),
+    'xgb_binary': (NextPlayModel, _field_goal),
+    'logistic': (FieldGoalModel, _field_goal),
+}
+
+
+@pytest.mark.parametrize('case', list(CASES))
+def test_compiled_matches_model(tmp_path, data, case):
+    model_class, preprocessor = CASES[case]
+    X, y = preprocessor(data)
+    model = model_class()
+    model.fit(X, y)
+    
+    compiled = model.compile()
+    difference = np.abs(compiled.predict_proba(X) - model.predict_proba(X)).max()
+    assert difference <= COMPILED_TOLERANCE, f'compiled probabilities differ by {difference:.2e}'
+    np.testing.assert_array_equal(compiled.classes_, model.classifier.classes_)
+    
+    # the memory-mapped saved model gives the same probabilities, also in small batches
+    compiled.save(str(tmp_path))
+    loaded = CompiledModel.load(str(tmp_path))
+    np.testing.assert_array_equal(loaded.predict_proba(X), compiled.predict_proba(X))
+    np.testing.assert_array_equal(loaded.predict_proba(X, chunksize=7), compiled.predict_proba(X))
+
+
+def test_compiled_with_encoder(data):
+    encoder = FeatureEncoder()
+    X, y = preprocess_field_goal(data, return_X_y=True, encoder=encoder, verbose=False)
+    model = FieldGoalModel()
+    model.fit(X, y, encoder=encoder)
+    
+    assert np.abs(model.compile().predict_proba(X) - model.predict_proba(X)).max() <= COMPILED_TOLERANCE
@@ -0,0 +1,42 @@
+import json
+import os
+import re
+import subprocess
+import sys
+
+# largest allowed import time of nflmodels and its modules in seconds, on top of numpy and pandas which every module needs
+IMPORT_TIME_BUDGET = 0.25
+
+# dependencies that must only be imported on first use
+DEFERRED = ['sklearn', 'xgboost', 'matplotlib', 'seaborn', 'pg8000']
+
+MODULES = ['nflmodels', 'nflmodels.models', 'nflmodels.validation', 'nflmodels.dataloader', 'nflmodels.preprocessing',
+           'nflmodels.encoder', 'nflmodels.cache', 'nflmodels.metrics', 'nflmodels.profiling', 'nflmodels.compiled',
+           'nflmodels.pipeline', 'nflmodels.scoring', 'nflmodels.epa', 'nflmodels.lookup', 'nflmodels.simulation',
+           'nflmodels.backtest', 'nflmodels.tuning']
+
+
+def _import(modules : list):
+    '''Import modules in a fresh interpreter with -X importtime, returns (seconds per top level import, deferred modules loaded)'''
+    code = '; '.join(['import sys, json', 'import numpy, pandas'] + [f'import {m}' for m in modules] +
+                     [f'print(json.dumps([m for m in {DEFERRED!r} if m in sys.modules]))'])
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, check=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    
+    # "import time: self [us] | cumulative | imported package", top level imports are indented by one space
+    times = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| (\S.*)$', line)
+        if match: times[match.group(2)] = times.get(match.group(2), 0) + int(match.group(1)) / 1e6
+    return times, json.loads(result.stdout.splitlines()[-1])
+
+
+def test_deferred_dependencies_not_imported():
+    _, loaded = _import(MODULES)
+    assert loaded == []
+
+
+def test_import_time_budget():
+    times, _ = _import(MODULES)
+    total = sum(t for m, t in times.items() if m not in ('numpy', 'pandas'))
+    assert total <= IMPORT_TIME_BUDGET, f'importing nflmodels took {total:.3f} s on top of numpy and pandas, over the budget of {IMPORT_TIME_BUDGET} s'
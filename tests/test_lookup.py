@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from nflmodels.dataloader import SyntheticLoader
+from nflmodels.encoder import FeatureEncoder
+from nflmodels.lookup import LookupTable, ep_table, field_goal_table, expected_points, make_probability
+from nflmodels.models import EPModel, FieldGoalModel
+from nflmodels.preprocessing import preprocess_ep, preprocess_field_goal
+
+
+@pytest.fixture(scope='module')
+def data():
+    return SyntheticLoader(n_rows=20000, seed=0).select(select_preset=True).load(verbose=False)
+
+
+def test_field_goal_table_exact(tmp_path, data):
+    encoder = FeatureEncoder()
+    X, y = preprocess_field_goal(data, return_X_y=True, encoder=encoder, verbose=False)
+    model = FieldGoalModel()
+    model.fit(X, y, encoder=encoder)
+    
+    table = field_goal_table(model, verbose=False)
+    assert table.max_error < 1e-6
+    
+    table.save(str(tmp_path))
+    table = LookupTable.load(str(tmp_path))
+    states = {c: np.repeat(v[:1], 99) if c != 'yardline_100' else v for c, v in table.axes.items()}
+    np.testing.assert_allclose(table.lookup(states), make_probability(model, model.predict_proba(states)), rtol=0, atol=1e-6)
+
+
+@pytest.mark.filterwarnings('ignore::sklearn.exceptions.ConvergenceWarning')
+def test_ep_table_error_bound(data):
+    encoder = FeatureEncoder()
+    X, y, _, _ = preprocess_ep(data, encoder=encoder, verbose=False)
+    model = EPModel(max_iter=300)
+    model.fit(X, y, encoder=encoder)
+    
+    # the default clock step, fewer distances keep the grid small
+    table = ep_table(model, max_ydstogo=5, n_check=0, verbose=False)
+    derived = {'goal_to_go': lambda s: (s['ydstogo'] >= s['yardline_100']).astype(np.float64),
+               'half_seconds_remaining': lambda s: (s['qtr'] % 2 == 1) * 900 + s['quarter_seconds_remaining'],
+               'game_seconds_remaining': lambda s: (4 - s['qtr']) * 900 + s['quarter_seconds_remaining']}
+    assert table.error(model, expected_points, derived=derived, n=20000, random_state=1) < 0.01
+    
+    # grid states are exact
+    state = {'yardline_100': [75], 'ydstogo': [5], 'down': [1], 'qtr': [2], 'quarter_seconds_remaining': [600.0],
+             'posteam_type': ['home'], 'posteam_timeouts_remaining': [3], 'defteam_timeouts_remaining': [3]}
+    state = {c: np.asarray(v, dtype=table.axes[c].dtype) for c, v in state.items()}
+    expected = expected_points(model, model.predict_proba({**state, **{c: f(state) for c, f in derived.items()}}))
+    np.testing.assert_allclose(table.lookup(state), expected, rtol=0, atol=1e-5)
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+from nflmodels.dataloader import SyntheticLoader
+from nflmodels.models import NFLModel, NextPlayModel, FieldGoalModel, EPModel, UPDATE_LOG_LOSS_TOLERANCE
+from nflmodels.preprocessing import preprocess_field_goal, preprocess_next_play, preprocess_ep
+
+PREPROCESSORS = {
+    NextPlayModel: lambda data: preprocess_next_play(data, return_X_y=True, map_target_to_int=True, verbose=False)[:2],
+    FieldGoalModel: lambda data: preprocess_field_goal(data, return_X_y=True, verbose=False),
+    EPModel: lambda data: preprocess_ep(data, verbose=False)[:2],
+}
+
+# EPModel fits run to max_iter, fewer iterations keep the test fast
+PARAMS = {NextPlayModel: {}, FieldGoalModel: {}, EPModel: {'max_iter': 500}}
+
+
+def _weeks(model_class):
+    '''Training rows before the new week, all training rows, the new week and the validation week, like the Refresh benchmark'''
+    data = SyntheticLoader(n_rows=10000, seed=0).select(select_preset=True).load(verbose=False)
+    X, y = PREPROCESSORS[model_class](data)
+    y = np.asarray(y).ravel()
+    
+    # the last two weeks (16 games each) are the new week and the validation week
+    games = data.loc[X.index, 'game_id'].to_numpy()
+    last_games = np.unique(games)[-32:]
+    new, val = np.isin(games, last_games[:16]), np.isin(games, last_games[16:])
+    old = ~new & ~val
+    return (X[old], y[old]), (X[old | new], y[old | new]), (X[new], y[new]), (X[val], y[val])
+
+
+@pytest.mark.filterwarnings('ignore::sklearn.exceptions.ConvergenceWarning')
+@pytest.mark.parametrize('model_class', [NextPlayModel, FieldGoalModel, EPModel])
+def test_update_log_loss_gap(model_class):
+    from sklearn.metrics import log_loss
+    
+    (X_old, y_old), (X_all, y_all), (X_new, y_new), (X_val, y_val) = _weeks(model_class)
+    
+    refit = model_class(**PARAMS[model_class])
+    refit.fit(X_all, y_all)
+    
+    model = model_class(**PARAMS[model_class])
+    model.fit(X_old, y_old)
+    if model_class is NextPlayModel: model.update(X_new, y_new)
+    else: model.refit(X_all, y_all, max_iter=100)
+    
+    labels = refit.classifier.classes_
+    gap = log_loss(y_val, model.predict_proba(X_val), labels=labels) - log_loss(y_val, refit.predict_proba(X_val), labels=labels)
+    assert gap <= UPDATE_LOG_LOSS_TOLERANCE, f'updated {model_class.__name__} log loss is {gap:.4f} worse than a full refit'
+
+
+@pytest.mark.parametrize('model_class', [FieldGoalModel, EPModel])
+def test_update_linear_model_raises(model_class):
+    (X_old, y_old), _, (X_new, y_new), _ = _weeks(model_class)
+    model = model_class(max_iter=100)
+    model.fit(X_old, y_old)
+    
+    with pytest.raises(NotImplementedError, match='refit'):
+        model.update(X_new, y_new)
+
+
+@pytest.mark.parametrize('model_class', [NextPlayModel, FieldGoalModel])
+def test_save_load_round_trip(tmp_path, model_class):
+    (X, y), _, _, (X_val, _) = _weeks(model_class)
+    model = model_class()
+    model.fit(X, y)
+    
+    assert model.save(str(tmp_path)) == 1
+    loaded = NFLModel.load(str(tmp_path))
+    assert type(loaded) is model_class
+    np.testing.assert_array_equal(loaded.predict_proba(X_val), model.predict_proba(X_val))
+
+
+def test_load_tampered_artifact_raises(tmp_path):
+    (X, y), _, _, (X_val, _) = _weeks(FieldGoalModel)
+    model = FieldGoalModel()
+    model.fit(X, y)
+    model.save(str(tmp_path))
+    
+    # one changed byte in the coefficients
+    file = tmp_path / 'v1' / 'coef.npy'
+    data = bytearray(file.read_bytes())
+    data[-1] ^= 0xFF
+    file.write_bytes(bytes(data))
+    
+    with pytest.raises(Exception, match='Checksum mismatch for coef.npy'):
+        NFLModel.load(str(tmp_path))
+    assert not np.allclose(NFLModel.load(str(tmp_path), verify=False).predict_proba(X_val), model.predict_proba(X_val))
+
+
+def test_load_latest_version(tmp_path):
+    (X, y), _, _, (X_val, _) = _weeks(FieldGoalModel)
+    models = [FieldGoalModel(C=C) for C in [0.01, 1.0, 100.0]]
+    for version, model in enumerate(models, start=1):
+        model.fit(X, y)
+        assert model.save(str(tmp_path)) == version
+    
+    assert (tmp_path / 'latest').read_text() == '3'
+    np.testing.assert_array_equal(NFLModel.load(str(tmp_path)).predict_proba(X_val), models[-1].predict_proba(X_val))
+    np.testing.assert_array_equal(NFLModel.load(str(tmp_path), version=1).predict_proba(X_val), models[0].predict_proba(X_val))
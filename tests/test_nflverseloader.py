@@ -0,0 +1,89 @@
+import os
+import time
+import pandas as pd
+import pytest
+from nflmodels.dataloader import nflverseLoader, SyntheticLoader
+from nflmodels.dataloader import nflverseloader
+
+pytest.importorskip('pyarrow')
+
+SEASONS = [2020, 2021, 2022]
+CURRENT_SEASON = 2023
+
+
+@pytest.fixture
+def mirror(tmp_path, monkeypatch):
+    '''file:// mirror with the files of SEASONS, the current season is not published yet'''
+    monkeypatch.setattr(nflverseloader, '_current_season', lambda: CURRENT_SEASON)
+    
+    data = SyntheticLoader(n_games=60, seed=0).select(select_preset=True).load(verbose=False)
+    data = data[data['season'].isin(SEASONS)].reset_index(drop=True)
+    path = tmp_path / 'mirror'
+    path.mkdir()
+    for season in SEASONS:
+        _publish(path, data[data['season'] == season])
+    return path, data
+
+
+def _publish(path, season_data : pd.DataFrame, mtime : float = None):
+    '''Write the play-by-play file of a season to the mirror'''
+    file = path / f'play_by_play_{int(season_data["season"].iloc[0])}.parquet'
+    season_data.to_parquet(file, index=False)
+    if mtime is not None: os.utime(file, (mtime, mtime))
+
+
+def _loader(tmp_path, path):
+    return nflverseLoader(loc=f'file://{path}', cache_dir=str(tmp_path / 'cache'))
+
+
+def test_load_caches_seasons(tmp_path, mirror):
+    path, data = mirror
+    df = _loader(tmp_path, path).where(seasons=SEASONS).load(verbose=False)
+    
+    assert len(df) == len(data)
+    assert sorted(os.listdir(tmp_path / 'cache')) == [f'play_by_play_{s}.feather' for s in SEASONS]
+    
+    # later loads are served from the cache
+    for season in SEASONS: os.remove(path / f'play_by_play_{season}.parquet')
+    assert len(_loader(tmp_path, path).where(seasons=SEASONS).load(verbose=False)) == len(data)
+
+
+def test_load_revalidates_current_season_only(tmp_path, mirror):
+    path, data = mirror
+    _loader(tmp_path, path).where(seasons=SEASONS).load(verbose=False)
+    
+    # newer files for a past season and for the current season
+    later = time.time() + 60
+    _publish(path, data[data['season'] == 2022].iloc[:10], mtime=later)
+    current = data[data['season'] == 2022].iloc[:5].assign(season=CURRENT_SEASON)
+    _publish(path, current, mtime=later)
+    _loader(tmp_path, path).where(seasons=[2022, CURRENT_SEASON]).load(verbose=False)
+    
+    _publish(path, current.iloc[:3], mtime=later + 60)
+    df = _loader(tmp_path, path).where(seasons=[2022, CURRENT_SEASON]).load(verbose=False)
+    
+    assert (df['season'] == 2022).sum() == (data['season'] == 2022).sum()
+    assert (df['season'] == CURRENT_SEASON).sum() == 3
+
+
+def test_load_selected_columns(tmp_path, mirror):
+    path, _ = mirror
+    df = _loader(tmp_path, path).select(columns=['season', 'game_id', 'not_a_column']).where(seasons=SEASONS).load(verbose=False)
+    assert list(df.columns) == ['season', 'game_id']
+    
+    # the full season is cached, other columns are read from the same cache file
+    df = _loader(tmp_path, path).select(columns=['yardline_100']).where(seasons=SEASONS).load(verbose=False)
+    assert list(df.columns) == ['yardline_100']
+
+
+def test_load_skips_unpublished_current_season(tmp_path, mirror, capsys):
+    path, data = mirror
+    df = _loader(tmp_path, path).where(seasons=SEASONS + [CURRENT_SEASON]).load()
+    
+    assert len(df) == len(data)
+    assert f'Season {CURRENT_SEASON} is not published yet' in capsys.readouterr().out
+    
+    # a missing past season is an error
+    os.remove(path / 'play_by_play_2022.parquet')
+    with pytest.raises(FileNotFoundError):
+        nflverseLoader(loc=f'file://{path}', cache_dir=str(tmp_path / 'other')).where(seasons=[2022]).load(verbose=False)
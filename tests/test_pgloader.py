@@ -0,0 +1,171 @@
+import re
+import sqlite3
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+from nflmodels.dataloader import PgLoader
+
+pg8000 = pytest.importorskip('pg8000')
+
+CREDENTIALS = dict(user='user', password='password', host='localhost', port=5432, dbname='nfl', tablename='pbp')
+
+
+class FakeConnection():
+    '''
+    pg8000 connection answering queries from an in-memory SQLite table, with the PostgreSQL behaviour the loader depends on:
+    DECLARE/FETCH over a server-side cursor, COPY TO STDOUT as CSV and aborted transactions after an error.
+    '''
+    
+    def __init__(self, db : sqlite3.Connection, fail_fetch : bool = False):
+        self.db = db
+        self.lock = threading.Lock()
+        self.fail_fetch = fail_fetch
+        self.aborted = False
+        self.cursor_query = None
+        self.cursor_offset = 0
+        self.rollbacks = 0
+        self.closed = False
+    
+    def cursor(self):
+        return FakeCursor(self)
+    
+    def rollback(self):
+        self.aborted = False
+        self.cursor_query = None
+        self.rollbacks += 1
+    
+    def close(self):
+        self.closed = True
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+
+
+class FakeCursor():
+    
+    def __init__(self, conn : FakeConnection):
+        self.conn = conn
+        self.rows = []
+        self.description = None
+    
+    def execute(self, sql : str, params = None, stream = None):
+        conn = self.conn
+        if conn.aborted: raise pg8000.dbapi.DatabaseError('current transaction is aborted, commands ignored until end of transaction block')
+        
+        declare = re.match(r'DECLARE \w+ NO SCROLL CURSOR FOR (.*)', sql, re.S)
+        fetch = re.match(r'FETCH FORWARD (\d+) FROM \w+', sql)
+        copy = re.match(r'COPY \((.*)\) TO STDOUT', sql, re.S)
+        
+        if declare:
+            conn.cursor_query, conn.cursor_offset = declare.group(1), 0
+        elif fetch:
+            if conn.fail_fetch:
+                conn.aborted = True
+                raise pg8000.dbapi.DatabaseError('canceling statement due to statement timeout')
+            df = self._read(f'{conn.cursor_query} LIMIT {int(fetch.group(1))} OFFSET {conn.cursor_offset}', params)
+            conn.cursor_offset += len(df)
+            self._result(df)
+        elif sql.startswith('CLOSE'):
+            conn.cursor_query = None
+        elif copy:
+            stream.write(_csv(self._read(copy.group(1))))
+        else:
+            self._result(self._read(sql))
+    
+    def fetchall(self):
+        return self.rows
+    
+    def _result(self, df : pd.DataFrame):
+        # pg8000 returns NULL as None
+        self.rows = df.astype(object).where(df.notna(), None).values.tolist()
+        self.description = [(c,) for c in df.columns]
+    
+    def _read(self, sql : str, params = None):
+        # PostgreSQL sorts NULL last, SQLite first
+        sql = re.sub(r'ORDER BY (\w+)', r'ORDER BY \1 IS NULL, \1', sql)
+        with self.conn.lock:
+            return pd.read_sql_query(sql.replace('%s', '?'), self.conn.db, params=params)
+
+
+def _csv(df : pd.DataFrame):
+    '''CSV like COPY writes it, NULL unquoted and empty strings quoted'''
+    lines = [','.join(df.columns)]
+    for row in df.itertuples(index=False):
+        cells = []
+        for v in row:
+            if v is None or (isinstance(v, float) and np.isnan(v)): cells.append('')
+            elif isinstance(v, str): cells.append('"' + v.replace('"', '""') + '"')
+            else: cells.append(str(v))
+        lines.append(','.join(cells))
+    return ('\n'.join(lines) + '\n').encode()
+
+
+@pytest.fixture
+def db():
+    data = pd.DataFrame({
+        'season': [2021, 2021, 2022, 2022, 2023, None],
+        'game_id': ['2021_01_A_B', '2021_01_A_B', '2022_01_C_D', '2022_02_C_D', '2023_01_E_F', None],
+        'play_id': [1, 2, 1, 1, 1, 1],
+        'yards_gained': [3.0, None, 7.0, 0.0, 12.0, 4.0],
+    })
+    db = sqlite3.connect(':memory:', check_same_thread=False)
+    data.to_sql('pbp', db, index=False)
+    return db
+
+
+def _connect(monkeypatch, db, **kwargs):
+    '''Patch pg8000.connect to return fake connections, returns the list of connections made'''
+    connections = []
+    def connect(**_):
+        connections.append(FakeConnection(db, **kwargs))
+        return connections[-1]
+    monkeypatch.setattr(pg8000, 'connect', connect)
+    return connections
+
+
+def test_load_iter_failed_fetch_raises_original_error(monkeypatch, db):
+    connections = _connect(monkeypatch, db, fail_fetch=True)
+    loader = PgLoader(CREDENTIALS).select(columns=['season', 'game_id', 'play_id'])
+    
+    with pytest.raises(pg8000.dbapi.DatabaseError, match='statement timeout'):
+        list(loader.load_iter(chunksize=2, dtypes={}, verbose=False))
+    assert connections[0].rollbacks == 1
+    assert connections[0].closed
+
+
+def test_load_iter_chunks(monkeypatch, db):
+    connections = _connect(monkeypatch, db)
+    loader = PgLoader(CREDENTIALS).select(columns=['season', 'game_id', 'play_id'])
+    
+    chunks = list(loader.load_iter(chunksize=4, dtypes={}, verbose=False))
+    assert [len(c) for c in chunks] == [4, 2]
+    assert connections[0].rollbacks == 1
+
+
+@pytest.mark.parametrize('partition_by', ['season', 'game_id'])
+def test_load_bulk_null_partition_key(monkeypatch, db, partition_by):
+    connections = _connect(monkeypatch, db)
+    loader = PgLoader(CREDENTIALS).select(columns=['season', 'game_id', 'play_id', 'yards_gained'])
+    
+    df = loader.load_bulk(partition_by=partition_by, n_partitions=2, n_jobs=2, dtypes={'game_id': 'object'}, verbose=False)
+    assert len(df) == 6
+    # the row with a NULL season and game_id
+    assert df[partition_by].isna().sum() == 1
+    assert sorted(df['yards_gained'].dropna()) == [0.0, 3.0, 4.0, 7.0, 12.0]
+    assert all(c.closed for c in connections)
+
+
+def test_load_iter_default_dtypes_null_season(monkeypatch, db):
+    _connect(monkeypatch, db)
+    loader = PgLoader(CREDENTIALS).select(columns=['season', 'game_id', 'play_id', 'yards_gained'])
+    
+    chunks = list(loader.load_iter(chunksize=4, verbose=False))
+    assert chunks[0]['season'].dtype == 'int64'
+    # the last chunk has the row with a NULL season
+    assert chunks[1]['season'].dtype == 'float64'
+    assert chunks[1]['season'].isna().sum() == 1
+    assert chunks[1]['game_id'].tolist()[-1] is None
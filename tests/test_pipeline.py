@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from nflmodels.dataloader import SyntheticLoader
+from nflmodels.encoder import FeatureEncoder
+from nflmodels.lookup import expected_points, make_probability
+from nflmodels.models import NextPlayModel, FieldGoalModel, EPModel
+from nflmodels.pipeline import ScoringPipeline
+from nflmodels.preprocessing import preprocess_ep, preprocess_field_goal, preprocess_next_play
+
+
+@pytest.mark.filterwarnings('ignore::sklearn.exceptions.ConvergenceWarning')
+def test_pipeline_equals_separate_models():
+    data = SyntheticLoader(n_rows=10000, seed=0).select(select_preset=True).load(verbose=False)
+    
+    encoder = FeatureEncoder()
+    X_np, y_np, play_types = preprocess_next_play(data, return_X_y=True, map_target_to_int=True, encoder=encoder, verbose=False)
+    next_play = NextPlayModel(n_estimators=10)
+    next_play.fit(X_np, y_np, encoder=encoder, labels=play_types)
+    
+    encoder = FeatureEncoder()
+    X_fg, y_fg = preprocess_field_goal(data, return_X_y=True, encoder=encoder, verbose=False)
+    field_goal = FieldGoalModel()
+    field_goal.fit(X_fg, y_fg, encoder=encoder)
+    
+    encoder = FeatureEncoder()
+    X_ep, y_ep, _, _ = preprocess_ep(data, encoder=encoder, verbose=False)
+    ep = EPModel(max_iter=200)
+    ep.fit(X_ep, y_ep, encoder=encoder)
+    
+    scores = ScoringPipeline().add(next_play).add(field_goal).add(ep).score(data)
+    assert scores.index.equals(data.index)
+    
+    columns = [f'next_play_{play_types[c]}' for c in next_play.classifier.classes_]
+    np.testing.assert_allclose(scores.loc[X_np.index, columns].to_numpy(), next_play.predict_proba(X_np), rtol=0, atol=1e-6)
+    np.testing.assert_allclose(scores.loc[X_fg.index, 'fg_prob'].to_numpy(), make_probability(field_goal, field_goal.predict_proba(X_fg)), rtol=0, atol=1e-9)
+    np.testing.assert_allclose(scores.loc[X_ep.index, 'ep'].to_numpy(), expected_points(ep, ep.predict_proba(X_ep)), rtol=0, atol=1e-9)
@@ -0,0 +1,211 @@
+import numpy as np
+import pandas as pd
+from nflmodels.preprocessing import preprocess_ep, _label_next_score, EP_PEAK_MEMORY_BUDGET
+
+
+# score gained by the team in possession, safety flag and pat attempt columns of each kind of play
+PLAY_KINDS = {
+    None: (None, 0, 0, 0),
+    'td': (6, 0, 0, 0),
+    'fg': (3, 0, 0, 0),
+    'pat': (1, 0, 1, 0),
+    'pat_missed': (None, 0, 1, 0),
+    '2pat': (2, 0, 0, 1),
+    'safety': (2, 1, 0, 0),
+    'opp_safety': (-2, 1, 0, 0),
+    'opp_patreturn': (-2, 0, 1, 0),
+}
+
+
+def _game(game_id : str, plays : list):
+    '''Play-by-play rows of a game from (game_half, posteam, kind) tuples, in game order'''
+    rows = []
+    for i, (half, posteam, kind) in enumerate(plays):
+        score_gained, safety, extra_point_attempt, two_point_attempt = PLAY_KINDS[kind]
+        game_seconds_remaining = 3600 - 10 * i
+        rows.append({
+            'season': 2023, 'game_id': game_id, 'play_id': i + 1, 'game_half': half, 'posteam': posteam,
+            'posteam_type': 'home' if posteam in ('KC', 'BUF') else 'away',
+            'qtr': 1 if half == 'Half1' else 3, 'down': 1, 'yardline_100': 50, 'ydstogo': 10, 'goal_to_go': 0,
+            'game_seconds_remaining': game_seconds_remaining, 'half_seconds_remaining': game_seconds_remaining % 1800,
+            'posteam_timeouts_remaining': 3, 'defteam_timeouts_remaining': 3,
+            'sp': 0 if score_gained is None else 1, 'score_differential': 0, 'score_differential_post': score_gained or 0,
+            'safety': safety, 'extra_point_attempt': extra_point_attempt, 'two_point_attempt': two_point_attempt,
+        })
+    return rows
+
+
+def _data():
+    '''Hand-built drives covering the edge cases of next score labeling'''
+    g1 = _game('2023_01_KC_DEN', [
+        # touchdown and extra point, the DEN play between them would be an "opp_pat" and is removed
+        ('Half1', 'KC', None), ('Half1', 'KC', None), ('Half1', 'KC', 'td'), ('Half1', 'DEN', None), ('Half1', 'KC', 'pat'),
+        # touchdown and two point conversion
+        ('Half1', 'DEN', None), ('Half1', 'DEN', 'td'), ('Half1', 'DEN', '2pat'),
+        # safety by the defense, seen as a safety by the team that had the ball before
+        ('Half1', 'DEN', None), ('Half1', 'KC', None), ('Half1', 'KC', 'opp_safety'),
+        # safety scored by the team in possession
+        ('Half1', 'KC', None), ('Half1', 'DEN', None), ('Half1', 'DEN', 'safety'),
+        # touchdown, missed extra point and a defensive two point return
+        ('Half1', 'KC', 'td'), ('Half1', 'KC', 'pat_missed'), ('Half1', 'DEN', 'td'), ('Half1', 'DEN', 'opp_patreturn'),
+        # no score before the end of the half: the field goal after halftime must not carry over
+        ('Half1', 'KC', None), ('Half1', 'DEN', None),
+        ('Half2', 'DEN', None), ('Half2', 'KC', None), ('Half2', 'KC', 'fg'), ('Half2', 'DEN', None),
+    ])
+    # the next game starts with a touchdown, the last plays of the previous game must not see it
+    g2 = _game('2023_01_BUF_NYJ', [('Half1', 'NYJ', None), ('Half1', 'BUF', None), ('Half1', 'BUF', 'td'), ('Half2', 'NYJ', None)])
+    
+    # shuffled and with a non default index, preprocess_ep orders the plays itself
+    data = pd.DataFrame(g1 + g2).sample(frac=1, random_state=0)
+    data.index = data.index * 7 + 100
+    return data
+
+
+def _reference_loop(game_id, game_half, posteam, next_score):
+    '''The reverse Python loop that _label_next_score replaced'''
+    prev_half, prev_game_id, prev_score_gained, prev_posteam = '', '', 'no_score', ''
+    l_next_score = list(next_score)
+    for i in range(len(l_next_score) - 1, -1, -1):
+        row_half, row_game_id, row_score_gained, row_posteam = game_half[i], game_id[i], l_next_score[i], posteam[i]
+        if row_game_id != prev_game_id or row_half != prev_half:
+            prev_half, prev_game_id, prev_score_gained = row_half, row_game_id, 'no_score'
+        if row_score_gained is None:
+            if row_posteam != prev_posteam:
+                if prev_score_gained == 'no_score': l_next_score[i] = prev_score_gained
+                elif prev_score_gained.startswith('opp_'): l_next_score[i] = prev_score_gained[4:]
+                else: l_next_score[i] = 'opp_' + prev_score_gained
+            else:
+                l_next_score[i] = prev_score_gained
+        else:
+            prev_score_gained, prev_posteam = row_score_gained, row_posteam
+    return l_next_score
+
+
+def _reference_labels(data : pd.DataFrame):
+    '''Labels of the loop based preprocess_ep by (game_id, play_id), without the removed opp_pat rows'''
+    data = data.sort_values(by=['game_id', 'game_seconds_remaining', 'play_id'], ascending=[True, False, True])
+    data = data.dropna(axis=0, subset=['posteam', 'yardline_100']).copy()
+    
+    data['play_score_gained'] = np.where(data['sp'] == 1, data['score_differential_post'] - data['score_differential'], None)
+    data['play_score_gained'] = np.where(((data['extra_point_attempt'] == 1) | (data['two_point_attempt'] == 1))
+                                         & (data['play_score_gained'].isna()), 0, data['play_score_gained'])
+    data['next_score'] = data['play_score_gained'].map({0: 'no_score', 6: 'td', 3: 'fg', 1: 'pat', -6: 'opp_td', -3: 'opp_fg', None: None})
+    data['next_score'] = np.where((data['play_score_gained'] == 2) & (data['safety'] == 1), 'safety', data['next_score'])
+    data['next_score'] = np.where((data['play_score_gained'] == 2) & (data['safety'] == 0), '2pat', data['next_score'])
+    data['next_score'] = np.where((data['play_score_gained'] == -2) & (data['safety'] == 0), 'opp_patreturn', data['next_score'])
+    data['next_score'] = np.where((data['play_score_gained'] == -2) & (data['safety'] == 1), 'opp_safety', data['next_score'])
+    
+    # pandas >= 3 stores the labels as strings with NaN, the loop expects None for non scoring plays
+    next_score = [None if pd.isna(s) else s for s in data['next_score']]
+    data['next_score'] = _reference_loop(data['game_id'].tolist(), data['game_half'].tolist(), data['posteam'].tolist(), next_score)
+    data = data[data['next_score'] != 'opp_pat']
+    return {(g, p): s for g, p, s in zip(data['game_id'], data['play_id'], data['next_score'])}
+
+
+def _labels(data : pd.DataFrame):
+    '''Labels of preprocess_ep, normal plays and extra point attempts together, by (game_id, play_id)'''
+    _, y, _, y_pat = preprocess_ep(data, verbose=False)
+    y = pd.concat([y, y_pat])
+    rows = data.loc[y.index]
+    return {(g, p): s for g, p, s in zip(rows['game_id'], rows['play_id'], y['next_score'])}
+
+
+def test_labels_match_loop():
+    data = _data()
+    assert _labels(data) == _reference_labels(data)
+
+
+def test_opp_pat_removed():
+    labels = _labels(_data())
+    assert 'opp_pat' not in labels.values()
+    # the DEN play between the touchdown and the extra point
+    assert ('2023_01_KC_DEN', 4) not in labels
+    assert labels[('2023_01_KC_DEN', 2)] == 'td'
+    assert labels[('2023_01_KC_DEN', 5)] == 'pat'
+
+
+def test_two_point_and_safety_remapping():
+    labels = _labels(_data())
+    assert labels[('2023_01_KC_DEN', 8)] == '2pat'
+    assert labels[('2023_01_KC_DEN', 11)] == 'opp_safety'
+    assert labels[('2023_01_KC_DEN', 10)] == 'opp_safety'
+    assert labels[('2023_01_KC_DEN', 9)] == 'safety'
+    assert labels[('2023_01_KC_DEN', 14)] == 'safety'
+    assert labels[('2023_01_KC_DEN', 12)] == 'opp_safety'
+    assert labels[('2023_01_KC_DEN', 16)] == 'no_score'
+    assert labels[('2023_01_KC_DEN', 18)] == 'opp_patreturn'
+
+
+def test_resets_at_half_and_game():
+    labels = _labels(_data())
+    assert labels[('2023_01_KC_DEN', 19)] == 'no_score'
+    assert labels[('2023_01_KC_DEN', 20)] == 'no_score'
+    assert labels[('2023_01_KC_DEN', 21)] == 'opp_fg'
+    assert labels[('2023_01_KC_DEN', 24)] == 'no_score'
+    assert labels[('2023_01_BUF_NYJ', 1)] == 'opp_td'
+    assert labels[('2023_01_BUF_NYJ', 4)] == 'no_score'
+
+
+def test_label_next_score_random():
+    rng = np.random.default_rng(0)
+    n = 5000
+    game_id = np.repeat(np.arange(50), 100)
+    game_half = np.tile(np.repeat(['Half1', 'Half2'], 50), 50)
+    posteam = rng.choice(['A', 'B'], n)
+    next_score = np.where(rng.random(n) < 0.05, rng.choice(['td', 'fg', 'pat', 'opp_td', 'safety', '2pat', 'no_score'], n), None)
+    
+    labels = _label_next_score(game_id, game_half, posteam, next_score.astype(object))
+    assert list(labels) == _reference_loop(list(game_id), list(game_half), list(posteam), list(next_score))
+
+
+def test_incremental_ep_unique_index(tmp_path):
+    from nflmodels.dataloader import SyntheticLoader
+    from nflmodels.preprocessing import IncrementalEP
+    
+    data = SyntheticLoader(n_games=60, seed=0).select(select_preset=True).load(verbose=False)
+    games = data['game_id'].unique()
+    
+    # updates with the index labels of the full frame, e.g. games filtered from a season loaded once,
+    # and a season-to-date reload indexed from zero that repeats the processed games
+    ep = IncrementalEP(str(tmp_path))
+    for k in range(2):
+        ep.update(data[data['game_id'].isin(games[k::3])], verbose=False)
+    ep.update(data.reset_index(drop=True), verbose=False)
+    X, y, X_pat, y_pat = IncrementalEP(str(tmp_path)).result()
+    
+    index = pd.concat([X, X_pat]).index
+    assert index.is_unique
+    assert X.index.equals(y.index) and X_pat.index.equals(y_pat.index)
+    
+    # the same plays as preprocessing all games at once
+    X_all, y_all, X_pat_all, y_pat_all = preprocess_ep(data, verbose=False)
+    assert len(X) == len(X_all) and len(X_pat) == len(X_pat_all)
+    assert sorted(y['next_score']) == sorted(y_all['next_score'])
+
+
+def test_preprocess_ep_peak_memory():
+    from nflmodels.dataloader import SyntheticLoader
+    from nflmodels.profiling import Profiler
+    
+    data = SyntheticLoader(n_rows=100000, seed=0).select(select_preset=True).load(verbose=False)
+    with Profiler(memory='tracemalloc') as profiler:
+        preprocess_ep(data, verbose=False)
+    
+    # peak allocations of the whole call over the memory of its input, like the PreprocessingMemory benchmark
+    peak = profiler.to_dataframe().query('depth == 0')['peak_mb'].max() * 2**20
+    fraction = peak / data.memory_usage(deep=True).sum()
+    assert fraction <= EP_PEAK_MEMORY_BUDGET, f'preprocess_ep peak memory is {fraction:.2f} of the input, over the budget of {EP_PEAK_MEMORY_BUDGET}'
+
+
+def test_preprocess_ep_compact():
+    from nflmodels.dataloader import SyntheticLoader
+    
+    data = SyntheticLoader(n_rows=20000, seed=0).select(select_preset=True).load(verbose=False)
+    X, y, X_pat, y_pat = preprocess_ep(data, verbose=False)
+    X_c, y_c, X_pat_c, y_pat_c = preprocess_ep(data, compact=True, verbose=False)
+    
+    # the same values in integer types for whole numbers
+    assert X_c['yardline_100'].dtype == np.int8 and X_c['game_seconds_remaining'].dtype == np.int16
+    np.testing.assert_array_equal(X_c.to_numpy(dtype=np.float64), X.to_numpy(dtype=np.float64))
+    assert (y_c['next_score'].astype(str) == y['next_score'].astype(str)).all()
+    assert X_c.memory_usage(deep=True).sum() <= 0.55 * X.memory_usage(deep=True).sum()
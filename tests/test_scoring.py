@@ -0,0 +1,24 @@
+import asyncio
+import numpy as np
+from nflmodels.dataloader import SyntheticLoader
+from nflmodels.models import NextPlayModel
+from nflmodels.preprocessing import preprocess_next_play
+from nflmodels.scoring import MicroBatcher
+
+
+def test_batched_equals_direct_predict_proba():
+    data = SyntheticLoader(n_rows=5000, seed=0).select(select_preset=True).load(verbose=False)
+    X, y, _ = preprocess_next_play(data, return_X_y=True, map_target_to_int=True, verbose=False)
+    model = NextPlayModel(n_estimators=10)
+    model.fit(X, y)
+    
+    plays = np.asarray(X[:300], dtype=np.float64)
+    expected = model.predict_proba(plays)
+    
+    async def score():
+        # more concurrent requests than fit in one batch, answered out of order
+        async with MicroBatcher(model, max_batch_size=64, max_delay=0.001) as batcher:
+            return await asyncio.gather(*[batcher.predict_proba(play) for play in plays[::-1]])
+    
+    proba = np.array(asyncio.run(score()))[::-1]
+    np.testing.assert_allclose(proba, expected, rtol=0, atol=1e-6)
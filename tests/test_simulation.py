@@ -0,0 +1,46 @@
+import pandas as pd
+import pytest
+from nflmodels.dataloader import SyntheticLoader
+from nflmodels.encoder import FeatureEncoder
+from nflmodels.models import NextPlayModel, FieldGoalModel, EPModel
+from nflmodels.preprocessing import preprocess_ep, preprocess_field_goal, preprocess_next_play
+from nflmodels.simulation import PlayOutcomes, Simulator, win_probability
+
+STATE = {'posteam_type': 'home', 'yardline_100': 35, 'down': 4, 'ydstogo': 2, 'game_seconds_remaining': 300, 'score_differential': -3}
+
+
+@pytest.fixture(scope='module')
+def simulator():
+    data = SyntheticLoader(n_rows=10000, seed=0).select(select_preset=True).load(verbose=False)
+    
+    encoder = FeatureEncoder()
+    X, y, play_types = preprocess_next_play(data, return_X_y=True, map_target_to_int=True, encoder=encoder, verbose=False)
+    next_play = NextPlayModel(n_estimators=10)
+    next_play.fit(X, y, encoder=encoder, labels=play_types)
+    
+    encoder = FeatureEncoder()
+    X, y = preprocess_field_goal(data, return_X_y=True, encoder=encoder, verbose=False)
+    field_goal = FieldGoalModel()
+    field_goal.fit(X, y, encoder=encoder)
+    
+    encoder = FeatureEncoder()
+    X, y, _, _ = preprocess_ep(data, encoder=encoder, verbose=False)
+    ep = EPModel(max_iter=200)
+    ep.fit(X, y['next_score'], encoder=encoder)
+    
+    return Simulator(next_play, field_goal, ep, PlayOutcomes().fit(data))
+
+
+@pytest.mark.parametrize('until', ['game', 'drive'])
+def test_same_seed_same_results_across_n_jobs(simulator, until):
+    kwargs = dict(n=1000, until=until, first_play='run', shard_size=256)
+    expected = simulator.simulate(STATE, seed=1, n_jobs=1, **kwargs)
+    
+    pd.testing.assert_frame_equal(simulator.simulate(STATE, seed=1, n_jobs=2, **kwargs), expected)
+    assert len(expected) == 1000
+    assert not simulator.simulate(STATE, seed=2, n_jobs=1, **kwargs).equals(expected)
+
+
+def test_win_probability(simulator):
+    results = simulator.simulate(STATE, n=1000, first_play='field_goal', shard_size=256)
+    assert 0 <= win_probability(results) <= 1
@@ -0,0 +1,17 @@
+import pytest
+from nflmodels.dataloader import SyntheticLoader
+from nflmodels.models import EPModel
+from nflmodels.preprocessing import preprocess_ep
+from nflmodels.tuning import tune
+
+
+@pytest.mark.filterwarnings('error::FutureWarning')
+def test_logistic_tuning_without_n_jobs():
+    data = SyntheticLoader(n_games=40, seed=0).select(select_preset=True).load(verbose=False)
+    X, y, _, _ = preprocess_ep(data, verbose=False)
+    n = len(X) * 3 // 4
+    
+    # LogisticRegression warns about n_jobs since scikit-learn 1.8
+    model, trials = tune(EPModel, X[:n], y[:n], X[n:], y[n:], space={'C': [0.1, 1], 'max_iter': [200]}, n_trials=2, n_workers=1, verbose=False)
+    assert model.classifier.get_params()['n_jobs'] is None
+    assert len(trials) == 2